@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+插件热点函数的性能测试, 使用合成的作品数据、图片和动图ZIP, 不需要网络和 hoshino。
+
+用法 (在插件目录下运行):
+    python benchmarks/bench.py                          # 运行全部测试, 结果输出为JSON
+    python benchmarks/bench.py --quick -o before.json   # 减少重复次数和数据规模, 结果保存到文件
+    python benchmarks/bench.py --filter ugoira          # 只运行名字包含 ugoira 的测试
+    python benchmarks/bench.py --compare before.json after.json  # 比较两次结果
+
+比较修改前后的性能时, 可以用 git worktree 检出修改前的版本, 再用当前的脚本测试那个目录:
+    git worktree add ../baseline <修改前的提交>
+    python benchmarks/bench.py --plugin-dir ../baseline -o before.json
+旧版本中不存在的模块或函数对应的测试会跳过, 函数缺少的参数对应的测试项也会跳过
+"""
+import argparse
+import importlib
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import zipfile
+from typing import Callable, Dict, List, Optional
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只导入不依赖 hoshino 的模块, 由 load_modules 填充, 被测试的版本中不存在的模块不在其中
+MODULES: Dict[str, object] = {}
+
+RESULTS: List[Dict] = []
+
+
+def load_modules(plugin_dir: str) -> None:
+    """把插件目录加入搜索路径并导入被测试的模块"""
+    sys.path.insert(0, plugin_dir)
+    for name in ('illust_helpers', 'imaging', 'tag_rules'):
+        try:
+            MODULES[name] = importlib.import_module(name)
+        except ImportError as e:
+            print(f"跳过模块 {name}: {e}", file=sys.stderr)
+
+
+def require(module: str, attr: str) -> Optional[Callable]:
+    """返回被测试版本中的函数, 不存在时返回 None 并提示跳过"""
+    func = getattr(MODULES.get(module), attr, None)
+    if func is None:
+        print(f"跳过 {module}.{attr}: 被测试的版本中不存在", file=sys.stderr)
+    return func
+
+
+def supported_kwargs(func: Callable, features: Dict, **options) -> Optional[Dict]:
+    """
+    只保留函数支持的参数。features 为要测试的功能开关, 开启的功能函数不支持时返回 None,
+    表示这个测试项在该版本中没有意义; options 为调优参数, 不支持时直接忽略
+    """
+    params = inspect.signature(func).parameters
+    if any(value and key not in params for key, value in features.items()):
+        return None
+    kwargs = dict(features, **options)
+    return {key: value for key, value in kwargs.items() if key in params}
+
+
+def bench(name: str, func: Callable[[], object], repeat: int, **params) -> None:
+    """运行 func repeat 次并记录耗时, func 返回 bytes 时同时记录输出大小"""
+    timings = []
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    result = {
+        'name': name,
+        'params': params,
+        'repeat': repeat,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+    }
+    if isinstance(output, (bytes, bytearray)):
+        result['output_bytes'] = len(output)
+    RESULTS.append(result)
+    print(f"{name:<40} {json.dumps(params, ensure_ascii=False):<50} median {result['median_ms']:>10.3f} ms",
+          file=sys.stderr)
+
+
+# ---------- 合成数据 ----------
+
+def make_illust(rng: random.Random, illust_id: int, page_count: int = 1, tag_count: int = 10) -> dict:
+    """生成结构与 Pixiv API 返回值相同的作品数据"""
+    def urls(page: int) -> dict:
+        path = f"img/2026/10/19/00/00/00/{illust_id}_p{page}"
+        # 和API返回值一样, 各画质的地址不同
+        return {
+            'square_medium': f"https://i.pximg.net/c/360x360_70/img-master/{path}_square1200.jpg",
+            'medium': f"https://i.pximg.net/c/540x540_70/img-master/{path}_master1200.jpg",
+            'large': f"https://i.pximg.net/c/600x1200_90/img-master/{path}_master1200.jpg",
+            'original': f"https://i.pximg.net/img-original/{path}.jpg",
+        }
+
+    illust = {
+        'id': illust_id,
+        'title': f"作品{illust_id}",
+        'type': 'illust',
+        'page_count': page_count,
+        'x_restrict': 1 if rng.random() < 0.2 else 0,
+        'tags': [
+            {'name': f"tag{rng.randint(0, 500)}", 'translated_name': f"Tag{rng.randint(0, 500)}" if rng.random() < 0.5 else None}
+            for _ in range(tag_count)
+        ],
+        'image_urls': urls(0),
+        'meta_single_page': {'original_image_url': urls(0)['original']} if page_count == 1 else {},
+        'meta_pages': [{'image_urls': urls(p)} for p in range(page_count)] if page_count > 1 else [],
+    }
+    return illust
+
+
+def make_image(width: int, height: int, seed: int = 0) -> 'Image.Image':
+    """生成带渐变和色块的测试图片, 压缩难度接近插画"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        r = rng.randint(10, max(width, height) // 6)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    return img
+
+
+def encode(img, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    if fmt == 'JPEG':
+        img.save(buf, format=fmt, quality=90)
+    else:
+        img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def make_ugoira_zip(frames: int, size: int, moving_ratio: float = 0.2) -> bytes:
+    """生成Ugoira格式的ZIP: 静止背景上有一块移动的区域, 帧为JPEG"""
+    from PIL import ImageDraw
+
+    background = make_image(size, size, seed=frames)
+    box = max(int(size * moving_ratio), 8)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for i in range(frames):
+            frame = background.copy()
+            x = (i * 7) % max(size - box, 1)
+            ImageDraw.Draw(frame).rectangle((x, size // 3, x + box, size // 3 + box), fill=(255, (i * 13) % 255, 0))
+            zf.writestr(f"{i:06d}.jpg", encode(frame, 'JPEG'))
+    return buf.getvalue()
+
+
+# ---------- 测试 ----------
+
+def make_rules(rng: random.Random, count: int, wildcard_ratio: float) -> List[str]:
+    """生成tag规则, 其中 wildcard_ratio 比例为通配符规则"""
+    rules = []
+    for _ in range(count):
+        tag = f"tag{rng.randint(0, 500)}"
+        if rng.random() < wildcard_ratio:
+            tag = "glob:" + rng.choice([f"*{tag[3:]}*", f"{tag[:4]}*", f"tag?{tag[4:]}"])
+        rules.append(tag)
+    return rules
+
+
+def bench_filters(quick: bool) -> None:
+    is_illust_allowed = require('illust_helpers', 'is_illust_allowed')
+    if is_illust_allowed is None:
+        return
+    # 没有 tag_rules 的版本中 is_illust_allowed 直接接收屏蔽tag列表, 只测试普通规则
+    tag_filter_cls = getattr(MODULES.get('tag_rules'), 'TagFilter', None)
+    rng = random.Random(42)
+    group_count = 500 if quick else 5000
+    illusts = [make_illust(rng, 100000 + i) for i in range(50 if quick else 200)]
+    for rule_count, wildcard_ratio in ((10, 0.0), (10, 0.3), (100, 0.3)):
+        if tag_filter_cls is None and wildcard_ratio:
+            continue
+        rules = [(make_rules(rng, rule_count, wildcard_ratio), make_rules(rng, rule_count // 10, wildcard_ratio))
+                 for _ in range(group_count)]
+        if tag_filter_cls is not None:
+            # 规则在群设置修改时才编译, 检查作品时只使用编译好的规则
+            groups = [(rng.random() < 0.3, tag_filter_cls(blocked, allowed)) for blocked, allowed in rules]
+        else:
+            groups = [(rng.random() < 0.3, blocked) for blocked, _ in rules]
+
+        def run():
+            allowed = 0
+            for illust in illusts:
+                for r18_enabled, tag_filter in groups:
+                    allowed += is_illust_allowed(illust, r18_enabled, tag_filter)
+            return allowed
+
+        bench('is_illust_allowed', run, 3, groups=group_count, illusts=len(illusts),
+              rules=rule_count, wildcard_ratio=wildcard_ratio)
+        if tag_filter_cls is not None:
+            bench('TagFilter', lambda: [tag_filter_cls(blocked, allowed) for blocked, allowed in rules], 3,
+                  groups=group_count, rules=rule_count, wildcard_ratio=wildcard_ratio)
+
+
+def bench_image_urls(quick: bool) -> None:
+    get_image_urls = require('illust_helpers', 'get_image_urls')
+    if get_image_urls is None:
+        return
+    rng = random.Random(42)
+    count = 1000 if quick else 10000
+    for page_count in (1, 10):
+        illusts = [make_illust(rng, i, page_count=page_count) for i in range(count)]
+        for quality in ('medium', 'large', 'original'):
+            bench('get_image_urls', lambda: [get_image_urls(i, quality) for i in illusts], 5,
+                  illusts=count, page_count=page_count, quality=quality)
+
+
+def bench_pixel_noise(quick: bool) -> None:
+    add_pixel_noise = require('imaging', 'add_pixel_noise')
+    if add_pixel_noise is None:
+        return
+    size = 600 if quick else 1200
+    img = make_image(size, size)
+    for fmt in ('JPEG', 'PNG', 'WEBP'):
+        data = encode(img, fmt)
+        bench('add_pixel_noise', lambda: add_pixel_noise(data), 3 if quick else 5,
+              format=fmt, size=size, input_bytes=len(data))
+
+
+def bench_downscale(quick: bool) -> None:
+    downscale_image = require('imaging', 'downscale_image')
+    if downscale_image is None:
+        return
+    size = 1600 if quick else 3000
+    data = encode(make_image(size, size), 'JPEG')
+    for max_edge, fmt in ((1200, None), (1200, 'WEBP'), (0, 'WEBP')):
+        bench('downscale_image', lambda: downscale_image(data, max_edge, fmt), 3,
+              size=size, max_edge=max_edge, format=fmt)
+
+
+def bench_ugoira(quick: bool) -> None:
+    render_ugoira = require('imaging', 'render_ugoira')
+    if render_ugoira is None:
+        return
+    cases = [(20, 300)] if quick else [(20, 300), (60, 600), (150, 600)]
+    variants = [
+        ('GIF', False, False),
+        ('GIF', True, False),
+        ('GIF', True, True),
+        ('WEBP', False, False),
+        ('WEBP', False, True),
+    ]
+    for frames, size in cases:
+        zip_data = make_ugoira_zip(frames, size)
+        frames_info = [{'delay': 60}] * frames
+        for mode, global_palette, delta in variants:
+            kwargs = supported_kwargs(render_ugoira, {'global_palette': global_palette, 'delta_frames': delta},
+                                      image_mode=mode, max_frames=600, pixel_noise=False,
+                                      quantize_threads=os.cpu_count() or 1, dither=False, delta_tolerance=8)
+            if kwargs is None:
+                print(f"跳过 render_ugoira {mode} global_palette={global_palette} delta_frames={delta}: "
+                      f"被测试的版本不支持", file=sys.stderr)
+                continue
+            bench('render_ugoira',
+                  lambda: render_ugoira(zip_data, frames_info, **kwargs),
+                  1 if quick else 3,
+                  frames=frames, size=size, mode=mode, global_palette=global_palette, delta_frames=delta)
+
+
+BENCHMARKS = {
+    'filters': bench_filters,
+    'image_urls': bench_image_urls,
+    'pixel_noise': bench_pixel_noise,
+    'downscale': bench_downscale,
+    'ugoira': bench_ugoira,
+}
+
+
+# ---------- 结果 ----------
+
+def git_revision(plugin_dir: str) -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=plugin_dir,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: Dict) -> str:
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(before_path: str, after_path: str) -> None:
+    """按测试名和参数对比两次结果的中位耗时"""
+    with open(before_path, encoding='utf-8') as f:
+        before = {result_key(r): r for r in json.load(f)['results']}
+    with open(after_path, encoding='utf-8') as f:
+        after = json.load(f)['results']
+    for result in after:
+        old = before.get(result_key(result))
+        if not old:
+            continue
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+        print(f"{result['name']:<25} {json.dumps(result['params'], ensure_ascii=False):<70} "
+              f"{old['median_ms']:>10.3f} -> {result['median_ms']:>10.3f} ms  x{ratio:.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='pixiv插件性能测试')
+    parser.add_argument('--quick', action='store_true', help='减少数据规模和重复次数')
+    parser.add_argument('--filter', default='', help='只运行名字包含该字符串的测试组')
+    parser.add_argument('-o', '--output', help='结果JSON的保存路径, 默认输出到标准输出')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='比较两次测试的结果')
+    parser.add_argument('--plugin-dir', default=PLUGIN_DIR, help='被测试的插件目录, 默认为脚本所在的插件目录')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    plugin_dir = os.path.abspath(args.plugin_dir)
+    load_modules(plugin_dir)
+
+    for name, func in BENCHMARKS.items():
+        if args.filter in name:
+            func(args.quick)
+
+    try:
+        import PIL
+        pillow_version = PIL.__version__
+    except ImportError:
+        pillow_version = None
+    report = {
+        'meta': {
+            'revision': git_revision(plugin_dir),
+            'plugin_dir': plugin_dir,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': pillow_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': args.quick,
+        },
+        'results': RESULTS,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
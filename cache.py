@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+插件使用的缓存
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .priority import current_priority
+
+
+class MediaCache:
+    """
+    处理后图片的磁盘缓存, 以任意字符串为键, 文件名为键的哈希。
+    命中时会更新文件的修改时间, 清理时按修改时间删除长时间没有使用的文件
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存, 不存在时返回None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        """写入缓存, 先写临时文件再重命名, 避免读到写了一半的文件"""
+        if not data:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def cleanup(self, max_age_hours: float) -> int:
+        """删除超过 max_age_hours 没有被使用的缓存, 返回删除的文件数量"""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        expire_before = time.time() - max_age_hours * 3600
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if os.path.isfile(path) and os.path.getmtime(path) < expire_before:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+class TTLCache:
+    """
+    按接口区分有效期的内存LRU缓存, 用于缓存Pixiv API的返回结果。
+    超过 max_entries 时淘汰最久没有使用的条目, 可以保存到JSON文件中以便重启后继续使用
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        # {"接口名:键": (过期时间戳, 值)}, 按最近使用顺序排列
+        self._data: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        # {接口名: [命中次数, 未命中次数]}
+        self._stats: Dict[str, List[int]] = {}
+
+    def get(self, endpoint: str, key: str) -> Optional[Any]:
+        """读取缓存, 不存在或已过期时返回None"""
+        stats = self._stats.setdefault(endpoint, [0, 0])
+        full_key = f"{endpoint}:{key}"
+        item = self._data.get(full_key)
+        if item is None or item[0] < time.time():
+            if item is not None:
+                del self._data[full_key]
+            stats[1] += 1
+            return None
+        self._data.move_to_end(full_key)
+        stats[0] += 1
+        return item[1]
+
+    def put(self, endpoint: str, key: str, value: Any, ttl: float) -> None:
+        """写入缓存, ttl 单位为秒"""
+        full_key = f"{endpoint}:{key}"
+        self._data[full_key] = (time.time() + ttl, value)
+        self._data.move_to_end(full_key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Tuple[int, int, float]]:
+        """返回各接口的 (命中次数, 未命中次数, 命中率)"""
+        result = {}
+        for endpoint, (hits, misses) in self._stats.items():
+            total = hits + misses
+            result[endpoint] = (hits, misses, hits / total if total else 0.0)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def load(self, path: str) -> None:
+        """从JSON文件加载缓存, 跳过已经过期的条目"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        now = time.time()
+        for full_key, expires_at, value in items:
+            if expires_at > now:
+                self._data[full_key] = (expires_at, value)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def save(self, path: str) -> None:
+        """把未过期的缓存保存到JSON文件"""
+        now = time.time()
+        items = [[k, exp, v] for k, (exp, v) in self._data.items() if exp > now]
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def single_flight(key_func: Callable[..., Hashable]):
+    """
+    装饰器: 参数相同的并发调用共享同一个正在进行的请求。
+    key_func 接收被装饰方法除 self 以外的参数, 返回用于判断请求是否相同的键;
+    请求完成后立即移除, 所以不会返回过期数据, 调用方不能修改返回的对象。
+    共享的请求以发起者的优先级排队, 优先级更高的调用方不加入低优先级的请求,
+    而是按自己的优先级重新发起, 之后的调用方加入优先级更高的这个请求
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            key = (func.__name__, key_func(*args, **kwargs))
+            priority = current_priority.get()
+            entry = self.inflight_requests.get(key)
+            if entry is None or priority < entry[1]:
+                entry = (asyncio.ensure_future(func(self, *args, **kwargs)), priority)
+                self.inflight_requests[key] = entry
+
+                def remove(_, entry=entry):
+                    if self.inflight_requests.get(key) is entry:
+                        del self.inflight_requests[key]
+
+                entry[0].add_done_callback(remove)
+            future = entry[0]
+            # shield: 某个调用方被取消时不影响其他等待同一请求的调用方
+            return await asyncio.shield(future)
+        return wrapper
+    return decorator
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+多实例部署: 多个机器人进程共享同一个SQLite数据库
+- 画师按ID的哈希分成若干分片, 每个实例租用一部分分片, 只请求自己分片内的画师, 租约过期后由其他实例接管
+- 每个实例把自己所在群的订阅和设置发布到数据库, 其他实例检查到更新时按群的设置过滤
+- 推送给其他实例所在群的作品写入发件箱, 由群所在的实例取出发送
+- 每个 (作品, 群) 只能被认领一次, 避免分片交接或关注动态和单独请求同时发现作品时重复推送
+所有方法都是阻塞的, 需要在线程池中调用
+"""
+import json
+import math
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    shard INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS groups (
+    group_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (group_id, owner)
+);
+CREATE TABLE IF NOT EXISTS claims (
+    illust_id TEXT NOT NULL,
+    group_id TEXT NOT NULL,
+    claimed REAL NOT NULL,
+    PRIMARY KEY (illust_id, group_id)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    group_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    artist_name TEXT,
+    illusts TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_owner ON outbox (owner);
+"""
+
+
+def artist_shard(user_id, shard_count: int) -> int:
+    """画师所在的分片"""
+    return zlib.crc32(str(user_id).encode('utf-8')) % shard_count
+
+
+class ClusterStore:
+    """
+    多实例共享的SQLite存储
+    :param db_path: 数据库路径, 所有实例必须指向同一个本地文件
+    :param instance_id: 实例ID, 重启后需要保持不变, 群的归属和分片租约都按实例ID记录
+    :param shard_count: 画师分片数量, 所有实例必须相同
+    :param lease_seconds: 分片租约的有效期, 实例停止续约超过这个时间后分片由其他实例接管
+    """
+
+    def __init__(self, db_path: str, instance_id: str, shard_count: int = 16, lease_seconds: float = 300):
+        self.db_path = db_path
+        self.instance_id = instance_id
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+        # 当前持有的分片, 由 heartbeat_and_refresh_leases 更新
+        self.owned_shards: Set[int] = set()
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次调用使用新的连接, 用完立即关闭, 可以在任意线程中调用; WAL模式下读写互不阻塞
+        # isolation_level=None 为自动提交模式, 需要多条语句原子执行时显式 BEGIN/COMMIT
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def heartbeat_and_refresh_leases(self) -> Set[int]:
+        """
+        更新心跳并续约/领取分片, 返回当前持有的分片。
+        每个实例最多持有 ceil(分片数 / 存活实例数) 个分片, 实例增加后多出的分片在续约时释放, 由新实例领取
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR REPLACE INTO instances (id, heartbeat) VALUES (?, ?)', (self.instance_id, now))
+            live = conn.execute('SELECT COUNT(*) FROM instances WHERE heartbeat > ?',
+                                (now - self.lease_seconds,)).fetchone()[0]
+            fair_share = math.ceil(self.shard_count / max(live, 1))
+
+            rows = conn.execute('SELECT shard, owner, expires FROM leases').fetchall()
+            leases = {shard: (owner, expires) for shard, owner, expires in rows}
+            mine = sorted(shard for shard, (owner, expires) in leases.items()
+                          if owner == self.instance_id and expires > now)
+            # 超出公平份额的分片直接释放
+            for shard in mine[fair_share:]:
+                conn.execute('DELETE FROM leases WHERE shard = ? AND owner = ?', (shard, self.instance_id))
+            mine = mine[:fair_share]
+
+            free = [shard for shard in range(self.shard_count)
+                    if shard not in leases or leases[shard][1] <= now]
+            for shard in free[:max(fair_share - len(mine), 0)]:
+                mine.append(shard)
+
+            expires = now + self.lease_seconds
+            for shard in mine:
+                conn.execute('INSERT OR REPLACE INTO leases (shard, owner, expires) VALUES (?, ?, ?)',
+                             (shard, self.instance_id, expires))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        self.owned_shards = set(mine)
+        return self.owned_shards
+
+    def owns_artist(self, user_id) -> bool:
+        """画师是否在本实例持有的分片中"""
+        return artist_shard(user_id, self.shard_count) in self.owned_shards
+
+    def publish_groups(self, groups: Dict[str, Dict]) -> None:
+        """用本实例的群订阅和设置替换数据库中本实例发布的群"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM groups WHERE owner = ?', (self.instance_id,))
+            conn.executemany(
+                'INSERT INTO groups (group_id, owner, settings, updated) VALUES (?, ?, ?, ?)',
+                [(str(group_id), self.instance_id, json.dumps(settings, ensure_ascii=False), now)
+                 for group_id, settings in groups.items()]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def load_groups(self) -> Dict[str, Tuple[str, Dict]]:
+        """
+        读取所有实例发布的群, 返回 {群号: (负责发送的实例ID, 群设置)}。
+        多个实例在同一个群时由实例ID最小的实例负责发送
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT group_id, owner, settings FROM groups ORDER BY owner DESC').fetchall()
+        return {group_id: (owner, json.loads(settings)) for group_id, owner, settings in rows}
+
+    def claim_deliveries(self, pairs: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """
+        认领 (作品ID, 群号) 的推送, 返回本次认领成功的部分。
+        已经被任意实例认领过的推送不会再返回, 所有认领在同一个事务中完成
+        """
+        now = time.time()
+        claimed = set()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for illust_id, group_id in pairs:
+                cursor = conn.execute('INSERT OR IGNORE INTO claims (illust_id, group_id, claimed) VALUES (?, ?, ?)',
+                                      (str(illust_id), str(group_id), now))
+                if cursor.rowcount:
+                    claimed.add((str(illust_id), str(group_id)))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return claimed
+
+    def enqueue(self, owner: str, group_id, user_id, artist_name: Optional[str], illusts: List[Dict]) -> None:
+        """把需要其他实例发送的作品写入发件箱"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'INSERT INTO outbox (owner, group_id, user_id, artist_name, illusts, created) VALUES (?, ?, ?, ?, ?, ?)',
+                (owner, str(group_id), str(user_id), artist_name, json.dumps(illusts, ensure_ascii=False), time.time())
+            )
+
+    def take_outbox(self, limit: int = 50) -> List[Dict]:
+        """取出并删除发给本实例的待发送作品"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                'SELECT id, group_id, user_id, artist_name, illusts FROM outbox WHERE owner = ? ORDER BY id LIMIT ?',
+                (self.instance_id, limit)
+            ).fetchall()
+            conn.executemany('DELETE FROM outbox WHERE id = ?', [(row[0],) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return [
+            {'group_id': group_id, 'user_id': user_id, 'artist_name': artist_name, 'illusts': json.loads(illusts)}
+            for _, group_id, user_id, artist_name, illusts in rows
+        ]
+
+    def prune(self, claim_max_age_days: float = 30) -> None:
+        """删除过期的认领记录和长时间没有心跳的实例"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute('DELETE FROM claims WHERE claimed < ?', (now - claim_max_age_days * 86400,))
+            conn.execute('DELETE FROM instances WHERE heartbeat < ?', (now - claim_max_age_days * 86400,))
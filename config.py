@@ -8,11 +8,138 @@ MAX_DISPLAY_WORKS = 3
 # 注意: original质量的图片体积较大，可能导致发送失败
 IMAGE_QUALITY = 'large'
 
+# 单条推送消息中图片的总大小预算, 单位: MB, 0 表示不限制
+# 超出预算时会按 original -> large -> medium 逐级降低画质 (通过HEAD请求获取图片大小)
+IMAGE_BYTE_BUDGET_MB = 0
+
+# 图片的发送方式, 可选值: 'base64', 'file', 'http'
+# 'base64': 图片编码为base64字符串直接放在消息中, 兼容性最好, 但体积会增大三分之一, 多图时会产生大量字符串复制
+# 'file': 图片写入暂存目录, 以 file:/// 地址发送, 要求OneBot实现(如go-cqhttp)和机器人运行在同一台机器上
+# 'http': 图片写入暂存目录, 并在本地启动一个静态文件HTTP服务, 以http地址发送
+IMAGE_SEND_MODE = 'base64'
+
+IMAGE_SPOOL_DIR = None  # 图片暂存目录, None 表示使用插件目录下的 image_spool 文件夹
+
+IMAGE_SPOOL_MAX_AGE_HOURS = 6  # 暂存图片的保留时间, 单位为小时, 超过后会被自动清理
+
+IMAGE_HTTP_HOST = '127.0.0.1'  # 'http' 模式下静态文件服务监听的地址
+
+IMAGE_HTTP_PORT = 8765  # 'http' 模式下静态文件服务监听的端口
+
+# 'http' 模式下OneBot实现访问静态文件服务使用的地址, 例如 "http://192.168.1.2:8765"
+# None 表示使用 http://IMAGE_HTTP_HOST:IMAGE_HTTP_PORT
+IMAGE_HTTP_PUBLIC_URL = None
+
+# 发送前缩小图片, 图片最长边超过该像素值时会等比缩小, 0 表示不缩放
+# pixiv的原图经常在4000px/10MB以上, 聊天软件中看不出区别, 而且容易被OneBot实现拒绝
+IMAGE_MAX_EDGE = 0
+
+# 发送前把静态图片重新编码为指定格式, 可选值: None(保持原格式), 'JPEG', 'WEBP'
+IMAGE_REENCODE_FORMAT = None
+
+IMAGE_REENCODE_QUALITY = 85  # 重新编码时 JPEG/WEBP 的质量
+
+MEDIA_CACHE_DIR = None  # 缩放/转码后图片的缓存目录, None 表示使用插件目录下的 media_cache 文件夹
+
+MEDIA_CACHE_MAX_AGE_HOURS = 72  # 图片缓存的保留时间, 单位为小时
+
+# Pixiv API 返回结果的缓存有效期, 单位为秒, 不在表中或者为0的接口不缓存
+# 定时检查获取画师作品时总是会请求最新数据, 缓存只用于预览画师等命令
+API_CACHE_TTL = {
+    'illust_detail': 3600,  # 作品详情, 发布后基本不会变化
+    'user_detail': 6 * 3600,  # 画师信息
+    'user_illusts': 600,  # 画师作品列表
+    'ugoira_metadata': 7 * 24 * 3600,  # 动图帧信息, 不会变化
+}
+
+API_CACHE_MAX_ENTRIES = 1000  # API缓存的最大条目数, 超出后淘汰最久没有使用的条目
+
+API_CACHE_PERSIST = False  # 是否把API缓存保存到磁盘(api_cache.json), 重启后继续使用
+
+API_MAX_CONCURRENCY = 3  # 同时进行的Pixiv API请求数量上限, 所有功能共享
+
+# Pixiv API请求速率控制 (AIMD): 所有API请求共享, 每次请求成功后速率增加 API_RATE_INCREASE,
+# 被限流 (Rate Limit 错误或 HTTP 429) 时速率乘以 API_RATE_DECREASE, 速率单位为每秒请求数
+API_RATE_INITIAL = 1.0  # 启动时的速率
+
+API_RATE_MIN = 0.2  # 速率下限
+
+API_RATE_MAX = 4.0  # 速率上限
+
+API_RATE_INCREASE = 0.05  # 每次请求成功后增加的速率
+
+API_RATE_DECREASE = 0.5  # 被限流时速率乘以的系数
+
+API_RATE_LIMIT_RETRIES = 2  # 被限流的请求降速后重试的次数
+
+NAME_RESOLVE_WAIT_SECONDS = 5  # 查看订阅列表时等待获取画师名字的最长时间, 超时的画师先显示占位符
+
+ARTIST_NAME_REFRESH_DAYS = 7  # 画师名字缓存超过该天数没有确认过时, 由后台任务重新获取
+
+ARTIST_NAME_REFRESH_BATCH = 50  # 后台任务每小时最多刷新的画师名字数量
+
+API_IO_WORKERS = 4  # 执行阻塞的Pixiv API请求和文件清理的线程数, 应不小于 API_MAX_CONCURRENCY
+
+# 图片缩放、像素修改和动图合成使用的工作者数量, 这些操作比较耗CPU
+IMAGE_CPU_WORKERS = 2
+
+# 图片处理的执行方式, 可选值: 'thread', 'process'
+# 'thread' 使用线程池, Pillow 编解码时大部分时间会释放GIL, 多张图片也能并行处理
+# 'process' 使用进程池, 不受GIL影响; 子进程以 spawn 方式启动, 避免在已有多个线程的机器人进程中 fork 导致死锁,
+# 但每个子进程启动时会重新导入机器人的启动脚本, 启动较慢、占用更多内存; 进程池不可用时会自动换成线程池
+IMAGE_WORKER_MODE = 'thread'
+
 # 是否启用“轻微修改图片像素以避免被判重复图片”的功能
 ENABLE_PIXEL_NOISE = True
 
 CHECK_INTERVAL_HOURS = 3  # 检查更新的时间间隔，单位为小时
 
+# 获取画师作品/关注动态时最多翻的页数(每页30个作品), 遇到检查时间窗口之外的作品时会提前停止翻页
+MAX_FETCH_PAGES = 3
+
+# 单独请求画师作品的检查方式, 可选值: 'burst', 'staggered'
+# 'burst' 每隔 CHECK_INTERVAL_HOURS 小时集中检查一次全部画师
+# 'staggered' 每个画师在检查周期内分到一个固定的时间点, 每隔 STAGGER_SLICE_MINUTES 分钟检查一批到期的画师,
+# API请求和推送均匀分布在整个周期内; 关注动态仍然每隔 CHECK_INTERVAL_HOURS 小时检查一次
+SWEEP_MODE = 'burst'
+
+STAGGER_SLICE_MINUTES = 5  # 错峰检查的时间片长度, 单位为分钟
+
+# 停机补推: 定时检查的时间窗口从上一次成功检查的时间开始, 机器人停机期间发布的作品会在重启后补推
+CATCHUP_MAX_HOURS = 72  # 补推最多回溯的小时数, 更早的作品直接跳过, 0 表示不补推, 每次只检查 CHECK_INTERVAL_HOURS
+
+CATCHUP_ON_STARTUP = True  # 启动时发现错过了定时检查就立即补推一次, 否则等到下一次定时检查时再补推
+
+CATCHUP_STARTUP_DELAY_SECONDS = 60  # 启动后等待多少秒再开始补发和补推
+
+CATCHUP_SUMMARY_THRESHOLD = 5  # 补推时单个画师的作品超过这个数量就合并为一条摘要, 只完整推送最新的作品, 0 表示不合并
+
+CATCHUP_PUSH_INTERVAL_SECONDS = 10  # 补推时每推送完一个画师额外等待的秒数, 避免短时间内大量推送
+
+# 是否启用推送日志, 检查中途进程退出时, 重启后只补发没有完成的推送, 不会重复推送或漏推
+ENABLE_DELIVERY_JOURNAL = True
+
+DELIVERY_JOURNAL_FSYNC_BATCH = 20  # 推送日志每攒够多少条"已发送"记录写盘一次, 待推送记录总是立即写盘
+
+# 多实例部署: 开启后多个机器人进程通过同一个SQLite数据库分工, 每个画师在所有实例中只被请求一次,
+# 推送给其他实例所在群的作品通过数据库转交给该实例发送。所有实例必须运行在同一台机器上 (或者使用支持文件锁的共享磁盘)
+# 想让实例之间共享处理好的图片, 可以把各实例的 MEDIA_CACHE_DIR 设置为同一个目录
+CLUSTER_ENABLED = False
+
+CLUSTER_DB_PATH = None  # 共享数据库的路径, None 表示使用插件目录下的 cluster.db, 多个实例的插件目录不同时必须设置为同一个路径
+
+CLUSTER_INSTANCE_ID = ''  # 实例ID, 各实例必须不同且重启后保持不变, 为空时使用主机名, 同一台机器上运行多个实例时必须设置
+
+CLUSTER_SHARD_COUNT = 16  # 画师分片数量, 所有实例必须相同, 应不少于实例数量
+
+CLUSTER_LEASE_SECONDS = 300  # 分片租约的有效期, 单位为秒, 实例停止运行超过这个时间后它的分片由其他实例接管
+
+TRACE_RUN_HISTORY = 10  # 保存最近多少次检查的各阶段耗时, 用 `pixiv慢操作` 命令查看, 0 表示关闭耗时追踪
+
+TRACE_MAX_SPANS_PER_RUN = 20000  # 单次检查最多记录的阶段数量, 超过后不再记录, 避免订阅很多时占用过多内存
+
+PROFILE_SAMPLE_INTERVAL_MS = 5  # `pixiv性能分析` 命令开启的采样分析器的采样间隔, 单位为毫秒
+
 PGET_DAILY_LIMIT = 10  # 单用户pixiv获取插画命令每日获取作品的上限
 
 PREVIEW_ILLUSTRATOR_LIMIT = 10  # 单用户预览画师信息命令每日使用上限
@@ -23,11 +150,33 @@ CHAIN_REPLY = True  # 是否启用合并转发回复模式
 
 RANK_LIMIT = 5  # 每次推送排行榜时最多展示的作品数量
 
+RANKING_PUSH_HOUR = 12  # 每天推送订阅榜单的时间(小时), Pixiv的排行榜大约在北京时间11点更新
+
+RANKING_PUSH_MINUTE = 30  # 每天推送订阅榜单的时间(分钟)
+
+RANKING_PUSH_LIMIT = 10  # 订阅榜单时只推送前多少名中新上榜的作品
+
 # 是否启用“推送机器人账号关注的画师”功能
 # 开启后，各群管理员才能通过指令选择是否接收推送
 # 出于隐私和性能考虑，默认关闭
 ENABLE_FOLLOWING_SUBSCRIPTION = False
 
+# 是否启用“关注同步”模式
+# 开启后机器人账号会(公开)关注所有群订阅的画师, 之后只需请求关注动态即可检查全部订阅画师的更新,
+# API请求次数只与动态数量有关, 与订阅画师的数量无关
+# 取消订阅时只会取关由插件自己关注的画师, 不会影响账号原本的关注
+# 每次同步前都会重新获取关注列表, 在插件之外被取关的画师在重新关注之前单独检查
+ENABLE_FOLLOW_SYNC = False
+
+FOLLOW_SYNC_BATCH_SIZE = 20  # 每次检查时最多执行的关注/取关操作数量, 剩余的留到下次检查
+
+FOLLOW_SYNC_INTERVAL_SECONDS = 2  # 每次关注/取关操作之间的间隔, 单位为秒
+
+# 快速通道的检查间隔, 单位为分钟, 0 表示关闭
+# 开启关注推送或关注同步后, 快速通道会每隔几分钟增量检查一次关注动态, 让关注画师的新作品在几分钟内推送,
+# 没有被关注动态覆盖的画师仍然按 CHECK_INTERVAL_HOURS 定时检查
+FAST_LANE_INTERVAL_MINUTES = 0
+
 # 发送的动图的文件格式, 可选值: 'GIF', 'WEBP', WEBP格式在手机上可能是静态的
 UGOIRA_IMAGE_MODE = "GIF"
 
@@ -35,4 +184,36 @@ UGOIRA_IMAGE_MODE = "GIF"
 UGOIRA_IMAGE_SIZE_LIMIT = 30
 
 # 动图最大帧数限制
-UGORIA_MAX_FRAMES = 600
\ No newline at end of file
+UGORIA_MAX_FRAMES = 600
+
+# GIF格式的动图是否使用全局调色板: 从抽样帧生成一个共享的调色板, 再多线程并行量化每一帧,
+# 比逐帧单独生成调色板快很多, 文件通常也更小; 颜色变化很大的动图可能出现轻微的色带
+# 开启后生成的动图和之前不同, 默认关闭
+UGOIRA_GIF_GLOBAL_PALETTE = False
+
+UGOIRA_QUANTIZE_THREADS = 4  # 使用全局调色板时并行量化的线程数
+
+UGOIRA_GIF_DITHER = False  # 使用全局调色板时是否抖动, 抖动后渐变更平滑, 但文件会大很多, 编码也更慢
+
+# 是否对动图进行差分优化: 合并和上一帧相同的帧, 只有局部变化的帧只保留变化区域,
+# 静止时间较长或只有一小块区域在动的动图体积会小很多, 超过 UGOIRA_IMAGE_SIZE_LIMIT 的情况也会减少
+# 抖动会让每一帧的噪点都不同, 变化区域几乎覆盖整帧, 所以开启差分优化时不会抖动 (忽略 UGOIRA_GIF_DITHER);
+# 逐帧单独生成调色板时颜色也会逐帧变化, 建议同时开启 UGOIRA_GIF_GLOBAL_PALETTE。开启后生成的动图和之前不同, 默认关闭
+UGOIRA_DELTA_FRAMES = False
+
+UGOIRA_DEDUP_TOLERANCE = 8  # 差分优化时认为像素没有变化的最大差异(0-255), 用于忽略JPEG压缩噪点, 0 表示只合并完全相同的像素
+
+# 单个图片或动图ZIP的下载大小上限, 单位: MB, 响应头或已下载的大小超过上限时立即中止下载, 0 表示不限制
+DOWNLOAD_MAX_MB = 50
+
+# 下载内容超过这个大小后写入临时文件而不是保存在内存中, 单位: MB, 0 表示总是保存在内存中
+DOWNLOAD_SPOOL_THRESHOLD_MB = 8
+
+# 同时进行的图片和动图ZIP下载数量上限, 超过时按优先级排队 (用户命令 > 订阅推送 > 后台任务)
+DOWNLOAD_MAX_CONCURRENCY = 6
+
+# 推送流水线中已经处理好但还没有发送的作品数量上限, 处理好一个作品就立即发送, 不需要等全部作品处理完
+PIPELINE_MAX_PENDING = 2
+
+# 作品较多以合并转发推送时, 每条合并转发最多包含的作品数量, 超过时分成多条发送
+FORWARD_MAX_WORKS = 10
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+分块下载: 限制单个文件的最大体积, 超过阈值的内容写入临时文件, 避免大文件整个读入内存
+"""
+import asyncio
+import os
+import tempfile
+from typing import Awaitable, Callable, Optional, Union
+
+import aiohttp
+
+
+class DownloadTooLarge(Exception):
+    """下载内容超过大小上限"""
+
+    def __init__(self, size: int, max_bytes: int):
+        super().__init__(f"文件大小 {size / 1024 / 1024:.1f}MB 超过上限 {max_bytes / 1024 / 1024:.1f}MB")
+        self.size = size
+        self.max_bytes = max_bytes
+
+
+def _create_spool_file(spool_dir: Optional[str], data: bytes):
+    """创建临时文件并写入已经读取的内容, 返回 (文件路径, 文件对象)"""
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+    fd, spool_path = tempfile.mkstemp(suffix='.part', dir=spool_dir)
+    spool_file = os.fdopen(fd, 'wb')
+    try:
+        spool_file.write(data)
+    except BaseException:
+        spool_file.close()
+        os.remove(spool_path)
+        raise
+    return spool_path, spool_file
+
+
+async def read_limited(resp: aiohttp.ClientResponse, max_bytes: int = 0, spool_threshold: int = 0,
+                       chunk_size: int = 256 * 1024, spool_dir: Optional[str] = None,
+                       run_blocking: Optional[Callable[..., Awaitable]] = None) -> Union[bytes, str]:
+    """
+    分块读取响应体
+    :param max_bytes: 大小上限, 超过时抛出 DownloadTooLarge, 0 表示不限制。
+        响应头中的 Content-Length 已经超过上限时不读取响应体直接抛出
+    :param spool_threshold: 读取的内容超过这个字节数后改为写入临时文件, 0 表示总是保存在内存中
+    :param spool_dir: 临时文件目录, None 表示使用系统临时目录
+    :param run_blocking: 执行临时文件读写的协程函数, 调用方式为 run_blocking(func, *args),
+        例如 NamedExecutor.run, None 表示使用事件循环默认的线程池, 文件读写不会阻塞事件循环
+    :return: 内容较小时返回 bytes, 否则返回临时文件路径, 由调用方负责用 discard_source 删除
+    """
+    if max_bytes > 0 and resp.content_length is not None and resp.content_length > max_bytes:
+        raise DownloadTooLarge(resp.content_length, max_bytes)
+
+    if run_blocking is None:
+        async def run_blocking(func, *args):
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    buffer = bytearray()
+    spool_file = None
+    spool_path = None
+    total = 0
+    try:
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            total += len(chunk)
+            if 0 < max_bytes < total:
+                raise DownloadTooLarge(total, max_bytes)
+            if spool_file is None and 0 < spool_threshold < total:
+                buffer += chunk
+                spool_path, spool_file = await run_blocking(_create_spool_file, spool_dir, bytes(buffer))
+                buffer = bytearray()
+            elif spool_file is not None:
+                await run_blocking(spool_file.write, chunk)
+            else:
+                buffer += chunk
+        if spool_file is not None:
+            await run_blocking(spool_file.close)
+    except BaseException:
+        # 出错或者被取消时直接清理, 不再等待执行器, 保证临时文件一定被删除
+        if spool_file is not None:
+            spool_file.close()
+            os.remove(spool_path)
+        raise
+
+    if spool_file is not None:
+        return spool_path
+    return bytes(buffer)
+
+
+def read_source(source: Union[bytes, str]) -> bytes:
+    """把 read_limited 的结果读成 bytes"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    return source
+
+
+def discard_source(source: Union[bytes, str, None]) -> None:
+    """删除 read_limited 生成的临时文件"""
+    if isinstance(source, str):
+        try:
+            os.remove(source)
+        except OSError:
+            pass
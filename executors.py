@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+插件自己的线程池/进程池, 不和其他插件共用事件循环的默认线程池
+"""
+import asyncio
+import multiprocessing
+import pickle
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from .tracing import span
+
+
+class NamedExecutor:
+    """
+    带名字和排队统计的执行器
+    - pending: 已提交但还没有完成的任务数(包括正在执行的)
+    - max_pending: 出现过的最大 pending, 用于判断池子大小是否合适
+    """
+
+    def __init__(self, name: str, executor: Executor, workers: int):
+        self.name = name
+        self.executor = executor
+        self.workers = workers
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+
+    async def run(self, func, *args, **kwargs):
+        """在执行器中运行函数并等待结果"""
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        try:
+            # 耗时包括在执行器中排队的时间
+            with span(f"{self.name}:{getattr(func, '__name__', 'call')}"):
+                return await asyncio.get_event_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> str:
+        """返回执行器的统计文本"""
+        queued = max(self.pending - self.workers, 0)
+        return (f"{self.name}: 工作者 {self.workers}, 进行中 {self.pending}, 排队 {queued}, "
+                f"最大进行中 {self.max_pending}, 已完成 {self.completed}")
+
+    def shutdown(self) -> None:
+        """关闭执行器, 不等待正在执行的任务"""
+        self.executor.shutdown(wait=False)
+
+
+class ImageExecutor(NamedExecutor):
+    """
+    图片处理用的进程池或线程池, 进程池不可用(例如进程被系统杀死)时自动换成线程池继续工作
+    """
+
+    def __init__(self, name: str, workers: int, use_processes: bool = False):
+        executor = self._create_process_pool(workers) if use_processes else None
+        self.use_processes = executor is not None
+        super().__init__(name, executor or ThreadPoolExecutor(workers, thread_name_prefix=name), workers)
+
+    @staticmethod
+    def _create_process_pool(workers: int):
+        try:
+            # 机器人进程中已经有API线程池、推送日志和采样分析等线程, fork 可能继承被其他线程持有的锁而死锁
+            return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        except (OSError, NotImplementedError, ImportError):
+            # 部分平台不支持多进程, 例如没有 /dev/shm 的容器
+            return None
+
+    async def run(self, func, *args, **kwargs):
+        try:
+            return await super().run(func, *args, **kwargs)
+        except (BrokenProcessPool, pickle.PicklingError):
+            # 进程被杀死或者任务无法序列化到子进程时换成线程池重试
+            if not self.use_processes:
+                raise
+            self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+            self.use_processes = False
+            return await super().run(func, *args, **kwargs)
+
+    def stats(self) -> str:
+        return f"{super().stats()}, {'进程池' if self.use_processes else '线程池'}"
+
+
+def create_api_executor(name: str, workers: int) -> NamedExecutor:
+    """创建用于阻塞API请求和文件操作的线程池"""
+    return NamedExecutor(name, ThreadPoolExecutor(workers, thread_name_prefix=name), workers)
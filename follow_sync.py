@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+关注同步模式的状态和关注/取关操作, 不依赖 hoshino 和插件配置
+pixivpy3 的 user_follow_add/user_follow_delete 返回解析后的JSON (JsonDict), 成功时为空字典, 失败时包含 error
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Set, Tuple
+
+
+def is_api_success(result) -> bool:
+    """关注/取关等没有返回数据的接口是否执行成功"""
+    return isinstance(result, dict) and 'error' not in result
+
+
+class FollowSync:
+    """
+    机器人账号的关注状态
+    :param following: 机器人账号当前关注的画师, None 表示还没有从Pixiv拉取过关注列表
+    :param managed: 其中由插件添加的画师, 取关时只会取关这些画师
+    """
+
+    def __init__(self, following: Optional[Set[str]] = None, managed: Iterable[str] = ()):
+        self.following = set(following) if following is not None else None
+        self.managed = set(managed)
+        # following 是否已经在本进程中和Pixiv上的关注列表核对过, 没有核对过时不认为任何画师被关注动态覆盖
+        self.verified = False
+
+    def reconcile(self, following: Set[str]) -> Set[str]:
+        """
+        用Pixiv上完整的关注列表替换本地记录, 返回在插件之外被取关的画师。
+        这些画师不再由插件管理, 仍然被订阅时下次同步会重新关注
+        """
+        removed = (self.following or set()) - following
+        self.following = set(following)
+        self.managed &= self.following
+        self.verified = True
+        return removed
+
+    def invalidate(self) -> None:
+        """关注列表获取失败, 在下一次核对成功之前所有画师都单独请求"""
+        self.verified = False
+
+    def covered(self) -> Set[str]:
+        """核对过的关注列表中的画师, 这些画师的新作品会出现在关注动态中"""
+        if not self.verified or self.following is None:
+            return set()
+        return set(self.following)
+
+    def plan(self, desired: Set[str]) -> Tuple[List[str], List[str]]:
+        """返回 (需要关注的画师, 需要取关的画师), 只会取关由插件添加且不再被订阅的画师"""
+        return sorted(desired - (self.following or set())), sorted(self.managed - desired)
+
+    async def apply(self, call_api: Callable[..., Awaitable[Any]], desired: Set[str], batch_size: int,
+                    interval: float = 0, is_rate_limited: Callable[[Any], bool] = lambda result: False
+                    ) -> Tuple[int, int, List[Tuple[str, str, Any]]]:
+        """
+        执行最多 batch_size 个关注/取关操作, 剩下的留到下次同步, 被限流时立即停止。
+        :param call_api: 执行API的协程函数, 参数为 (方法名, 画师ID)
+        :return: (成功关注的数量, 成功取关的数量, [(方法名, 画师ID, 失败的返回结果)])
+        """
+        to_follow, to_unfollow = self.plan(desired)
+        operations = [('user_follow_add', user_id) for user_id in to_follow] + \
+                     [('user_follow_delete', user_id) for user_id in to_unfollow]
+        followed = unfollowed = 0
+        failures = []
+        for index, (api_method, user_id) in enumerate(operations[:max(batch_size, 0)]):
+            if index and interval > 0:
+                await asyncio.sleep(interval)
+            try:
+                result = await call_api(api_method, user_id)
+            except Exception as e:
+                result = e
+            if not is_api_success(result):
+                failures.append((api_method, user_id, result))
+                if is_rate_limited(result):
+                    break
+                continue
+            if api_method == 'user_follow_add':
+                self.following = (self.following or set()) | {user_id}
+                self.managed.add(user_id)
+                followed += 1
+            else:
+                if self.following is not None:
+                    self.following.discard(user_id)
+                self.managed.discard(user_id)
+                unfollowed += 1
+        return followed, unfollowed, failures
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+Pixiv API请求速率控制: 所有API请求共享一个按速率放行的调度器,
+请求成功时加性提高速率, 遇到限流 (Rate Limit 错误或 HTTP 429) 时乘性降低速率 (AIMD),
+让请求速率保持在接近实际限制但不触发限流的水平。
+排队的请求按优先级放行, 用户命令的请求排在后台请求前面
+"""
+import asyncio
+import time
+from typing import Any, Optional
+
+from .priority import PriorityWaitQueue, current_priority, format_waiting
+
+# 表示被限流的错误信息, Pixiv在 error.message 中返回 "Rate Limit"
+RATE_LIMIT_MESSAGES = ('rate limit', 'too many requests')
+
+
+def get_status_code(exception: Exception) -> Optional[int]:
+    """从异常中取出HTTP状态码, 兼容 requests 的 HTTPError 和带 status_code/status 属性的异常, 没有时返回None"""
+    for source in (exception, getattr(exception, 'response', None)):
+        for attr in ('status_code', 'status'):
+            status = getattr(source, attr, None)
+            if isinstance(status, int):
+                return status
+    return None
+
+
+def is_rate_limited(result: Any) -> bool:
+    """
+    判断API的返回结果 (解析后的JSON) 或异常是否表示被限流。
+    只看HTTP状态码和错误信息本身, 不在整个错误文本里找 "429" 之类的数字, 以免作品ID或URL中的数字被误判
+    """
+    if isinstance(result, dict):
+        error = result.get('error')
+        if not error:
+            return False
+        if isinstance(error, dict):
+            messages = [error.get(key) for key in ('message', 'reason', 'user_message')]
+        else:
+            messages = [error]
+    elif isinstance(result, Exception):
+        if get_status_code(result) == 429:
+            return True
+        messages = [result]
+    else:
+        return False
+    error_msg = ' '.join(str(message) for message in messages if message).lower()
+    return any(keyword in error_msg for keyword in RATE_LIMIT_MESSAGES)
+
+
+class AimdGovernor:
+    """
+    AIMD速率控制器
+    :param initial_rate: 初始速率, 单位为每秒请求数
+    :param min_rate: 速率下限
+    :param max_rate: 速率上限
+    :param increase: 每次请求成功后速率增加的量
+    :param decrease: 遇到限流时速率乘以的系数, 0~1 之间
+    :param cooldown: 降低速率后的冷却时间 (秒), 期间其他并发请求的限流不再重复降速,
+        因为它们是在降速之前发出的
+    """
+
+    def __init__(self, initial_rate: float = 1.0, min_rate: float = 0.2, max_rate: float = 5.0,
+                 increase: float = 0.05, decrease: float = 0.5, cooldown: float = 5.0):
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(initial_rate, self.min_rate), self.max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        # 下一个请求最早可以发出的时间 (time.monotonic)
+        self._next_slot = 0.0
+        self._last_decrease = float('-inf')
+        self._waiters = PriorityWaitQueue()
+        self._dispatcher: Optional[asyncio.Future] = None
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    async def acquire(self) -> None:
+        """
+        等待放行, 相邻两次放行之间至少间隔 1/rate 秒。
+        需要等待时按当前 contextvar 中的优先级排队, 每个时间点放行排在最前面的请求
+        """
+        now = time.monotonic()
+        if not self._waiters and self._next_slot <= now:
+            self._next_slot = now + 1 / self.rate
+            return
+        future = self._waiters.push(current_priority.get())
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+        self.waited_seconds += time.monotonic() - now
+
+    async def _dispatch(self) -> None:
+        """依次在每个时间点放行优先级最高的请求, 队列空了就退出"""
+        while self._waiters:
+            # 等待期间速率可能被降低, 醒来后重新计算
+            wait = self._next_slot - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            waiter = self._waiters.pop()
+            if waiter is None:
+                break
+            waiter.set_result(None)
+            self._next_slot = time.monotonic() + 1 / self.rate
+
+    def on_success(self) -> None:
+        """请求成功, 加性提高速率"""
+        self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def on_throttled(self) -> None:
+        """遇到限流, 乘性降低速率, 并把下一次放行推迟一个新的间隔"""
+        self.throttled += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.rate = max(self.rate * self.decrease, self.min_rate)
+        self._next_slot = max(self._next_slot, now + 1 / self.rate)
+
+    def stats(self) -> str:
+        return (f"API速率: {self.rate:.2f} 次/秒 (范围 {self.min_rate}~{self.max_rate}), "
+                f"遇到限流 {self.throttled} 次, 累计等待 {self.waited_seconds:.1f}s, "
+                f"排队: {format_waiting(self._waiters.counts())}")
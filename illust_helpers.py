@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+作品数据相关的纯函数, 不依赖 hoshino 和插件配置, 方便单独测试性能
+"""
+from typing import List
+
+
+def collect_illust_tags(illust: dict) -> List[str]:
+    """返回作品的全部tag以及翻译后的tag, 统一为小写"""
+    tags = illust.get('tags') or []
+    illust_tags = [tag.get('name', '').lower() for tag in tags]
+    # 也检查翻译后的tag
+    for tag in tags:
+        if tag.get('translated_name'):
+            illust_tags.append(tag['translated_name'].lower())
+    return illust_tags
+
+
+def is_illust_allowed(illust: dict, r18_enabled: bool, tag_filter=None) -> bool:
+    """
+    检查作品是否符合群设置
+    :param r18_enabled: 群是否允许R18内容
+    :param tag_filter: 群编译好的tag规则 (tag_rules.TagFilter), None 表示没有规则
+    """
+    # 检查R18限制, x_restrict: 0=全年龄, 1=R18, 2=R18G
+    if not r18_enabled and illust.get('x_restrict', 0) != 0:
+        return False
+
+    # 检查屏蔽和允许的tag（不区分大小写）
+    if tag_filter:
+        return tag_filter.allows(collect_illust_tags(illust))
+
+    return True
+
+
+def get_image_urls(illust: dict, quality: str) -> List[str]:
+    """
+    获取作品的所有图片URL
+    :param quality: 图片画质, 'original', 'large', 'medium', 'square_medium'
+    """
+    urls: List[str] = []
+    page_count = illust.get('page_count', 1)
+
+    def get_image_url(image_urls: dict) -> str:
+        """
+        根据 quality 获取单张图片URL的辅助函数
+        """
+        if not image_urls:
+            return ""
+        check_order = [quality, 'large', 'medium', 'square_medium']
+
+        for q in check_order:
+            u = image_urls.get(q)
+            if u:
+                return u
+        return ""
+
+    if page_count > 1:
+        # 多图情况下, 从 meta_pages 中逐页获取
+        meta_pages = illust.get('meta_pages') or []
+        for page in meta_pages:
+            url = get_image_url(page.get('image_urls', {}))
+            if url:
+                urls.append(url)
+    else:
+        # 单页, 原图在 meta_single_page, 其他画质在作品本身的 image_urls 中
+        original_url = (illust.get('meta_single_page') or {}).get('original_image_url')
+        url = original_url if quality == 'original' else ""
+        url = url or get_image_url(illust.get('image_urls', {})) or original_url
+        if url:
+            urls.append(url)
+    return urls
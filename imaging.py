@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+图片处理相关的纯函数, 不依赖 hoshino, 参数全部显式传入, 方便放到工作线程/进程中执行
+"""
+import io
+import random
+from typing import List, Optional, Tuple, Union
+
+
+def _open_source(source: Union[bytes, str]):
+    """source 可以是图片数据或者文件路径, 文件路径时由PIL/zipfile直接读取文件, 不需要先整个读入内存"""
+    return source if isinstance(source, str) else io.BytesIO(source)
+
+
+def _read_source(source: Union[bytes, str]) -> bytes:
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    return source
+
+
+def tweak_pil_image(img: 'Image.Image') -> 'Image.Image':
+    """
+    轻微修改图片的一个像素，让同一张图的字节流不完全相同。
+
+    """
+    try:
+        if img.mode not in ("RGB", "RGBA", "P"):
+            return img
+
+        # 做一个拷贝，避免调用方原对象被部分修改
+        new_img = img.copy()
+        pixels = new_img.load()
+        if pixels is None:
+            return img
+
+        width, height = new_img.size
+        if width <= 0 or height <= 0:
+            return img
+
+        x = random.randint(0, width - 1)
+        y = random.randint(0, height - 1)
+
+        if new_img.mode in ("RGB", "RGBA"):
+            px = pixels[x, y]
+            if new_img.mode == "RGB":
+                r, g, b = px
+                pixels[x, y] = ((r + 1) % 256, g, b)
+            else:
+                r, g, b, a = px
+                pixels[x, y] = ((r + 1) % 256, g, b, a)
+        elif new_img.mode == "P":
+            val = pixels[x, y]
+            pixels[x, y] = (val + 1) % 256
+
+        return new_img
+    except Exception:
+        # 修改失败时发送原图, 不影响推送
+        return img
+
+
+def add_pixel_noise(data: bytes) -> bytes:
+    """对编码后的图片进行轻微像素修改并重新编码"""
+    # PIL 导入较慢, 在第一次使用时才导入, 不拖慢机器人启动
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+    mutated = tweak_pil_image(img)
+    buf = io.BytesIO()
+    fmt = mutated.format or img.format or "PNG"
+    mutated.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def _gif_color_table(data: bytes) -> Optional[Tuple[int, int]]:
+    """返回GIF全局调色板的 (起始位置, 字节数), 没有全局调色板时返回第一帧的局部调色板, 都没有时返回None"""
+    if data[:6] not in (b'GIF87a', b'GIF89a') or len(data) < 13:
+        return None
+    packed = data[10]
+    pos = 13
+    if packed & 0x80:
+        return pos, 3 * (2 << (packed & 0x07))
+
+    # 跳过扩展块, 找到第一帧的图像描述符
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21:
+            pos += 2
+            while pos < len(data) and data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        elif block == 0x2C and pos + 10 <= len(data):
+            packed = data[pos + 9]
+            if packed & 0x80:
+                return pos + 10, 3 * (2 << (packed & 0x07))
+            return None
+        else:
+            return None
+    return None
+
+
+def add_ugoira_noise(data: bytes) -> bytes:
+    """
+    对合成好的动图 (或者回退使用的静态图) 进行轻微修改, 让每次发送的字节流都不相同。
+    GIF只修改调色板中一个颜色的最低位, 不需要重新编码所有帧;
+    其他格式的动图解码后修改首帧和随机一帧再重新编码, 静态图交给 add_pixel_noise
+    """
+    table = _gif_color_table(data)
+    if table is not None:
+        start, size = table
+        if start + size <= len(data):
+            mutated = bytearray(data)
+            mutated[start + random.randrange(size // 3) * 3] ^= 1
+            return bytes(mutated)
+
+    from PIL import Image, ImageSequence
+
+    img = Image.open(io.BytesIO(data))
+    if not getattr(img, 'is_animated', False):
+        return add_pixel_noise(data)
+
+    images = []
+    durations = []
+    for frame in ImageSequence.Iterator(img):
+        images.append(frame.convert('RGBA'))
+        durations.append(frame.info.get('duration', 37))
+    frame_idx = random.randint(0, len(images) - 1)
+    images[0] = tweak_pil_image(images[0])
+    images[frame_idx] = tweak_pil_image(images[frame_idx])
+
+    buf = io.BytesIO()
+    # 和 render_ugoira 合成WEBP时的参数一致
+    images[0].save(buf, format=img.format or 'WEBP', save_all=True, append_images=images[1:],
+                   duration=durations, loop=0, quality=90, method=1)
+    return buf.getvalue()
+
+
+def downscale_image(data: Union[bytes, str], max_edge: int = 0, fmt: Optional[str] = None, quality: int = 85) -> bytes:
+    """
+    把图片缩小到最长边不超过 max_edge, 并按 fmt 重新编码
+    :param data: 原始图片数据或图片文件路径
+    :param max_edge: 最长边的像素上限, 0 表示不缩放
+    :param fmt: 重新编码的格式, 例如 'JPEG', 'WEBP', None 表示保持原格式
+    :param quality: JPEG/WEBP 的编码质量
+    :return: 处理后的图片数据, 不需要处理或处理后反而更大时返回原始数据
+    """
+    from PIL import Image
+
+    img = Image.open(_open_source(data))
+    # 动图交给动图流程处理, 这里只处理静态图
+    if getattr(img, 'is_animated', False):
+        return _read_source(data)
+
+    need_resize = max_edge > 0 and max(img.size) > max_edge
+    out_fmt = (fmt or img.format or 'PNG').upper()
+    if not need_resize and out_fmt == (img.format or '').upper():
+        return _read_source(data)
+
+    if need_resize:
+        # JPEG 可以在解码时直接按 1/2, 1/4, 1/8 缩小, 比完整解码后再缩放快得多
+        img.draft('RGB', (max_edge, max_edge))
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    if out_fmt == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    buf = io.BytesIO()
+    if out_fmt in ('JPEG', 'WEBP'):
+        img.save(buf, format=out_fmt, quality=quality, optimize=True)
+    else:
+        img.save(buf, format=out_fmt, optimize=True)
+    result = buf.getvalue()
+
+    # 只转换格式时, 结果比原图还大就没有意义
+    if not need_resize:
+        original = _read_source(data)
+        if len(result) >= len(original):
+            return original
+    return result
+
+
+def _changed_bbox(previous, current, tolerance: int):
+    """返回两帧之间差异超过 tolerance 的区域, 没有差异时返回None"""
+    from PIL import ImageChops
+
+    diff = ImageChops.difference(previous, current)
+    if tolerance <= 0:
+        return diff.getbbox()
+
+    # 取各通道差异的最大值, 再按 4x4 的块求平均: 孤立的JPEG压缩噪点会被平均掉, 真正变化的细线仍然超过阈值
+    mask = diff.getchannel(0)
+    for band in range(1, len(diff.getbands())):
+        mask = ImageChops.lighter(mask, diff.getchannel(band))
+    block = 4
+    bbox = mask.reduce(block).point(lambda v: 255 if v > tolerance else 0).getbbox()
+    if bbox is None:
+        return None
+    width, height = current.size
+    return (bbox[0] * block, bbox[1] * block, min(bbox[2] * block, width), min(bbox[3] * block, height))
+
+
+def optimize_delta_frames(images: list, durations: List[int], tolerance: int = 0):
+    """
+    动图帧的差分优化
+    - 和上一帧相同(每个通道的差异都不超过 tolerance)的帧直接合并到上一帧, 持续时间相加
+    - 只有一部分区域变化的帧, 变化区域以外的像素替换为上一帧的像素, 消除JPEG压缩噪点带来的细微差异,
+      这样GIF/WebP编码器逐帧比较时只会编码真正变化的矩形区域, 并自行处理帧的处置方式
+    :return: (优化后的帧列表, 对应的持续时间列表)
+    """
+    frames = [img if img.mode == 'RGB' else img.convert('RGB') for img in images]
+    out_frames = [frames[0]]
+    out_durations = [durations[0]]
+    # 和最后输出的帧比较, 缓慢变化累积超过 tolerance 时仍然会被编码
+    previous = frames[0]
+    full_box = (0, 0) + previous.size
+    for frame, duration in zip(frames[1:], durations[1:]):
+        if frame.size != previous.size:
+            out_frames.append(frame)
+            out_durations.append(duration)
+            previous = frame
+            full_box = (0, 0) + frame.size
+            continue
+
+        bbox = _changed_bbox(previous, frame, tolerance)
+        if bbox is None:
+            out_durations[-1] += duration
+            continue
+        if tolerance > 0 and bbox != full_box:
+            merged = previous.copy()
+            merged.paste(frame.crop(bbox), bbox[:2])
+            frame = merged
+        out_frames.append(frame)
+        out_durations.append(duration)
+        previous = frame
+    return out_frames, out_durations
+
+
+def quantize_with_global_palette(images: list, threads: int = 1, dither: bool = False, sample_count: int = 8) -> list:
+    """
+    用同一个调色板量化全部帧
+    - 从均匀抽取的 sample_count 帧生成一个256色的全局调色板
+    - 在 threads 个线程中并行把每一帧映射到这个调色板, PIL的颜色转换会释放GIL, 可以同时使用多个核心
+    - dither=True 时使用抖动, 渐变更平滑, 但抖动产生的噪点会让文件明显变大, 编码也更慢
+    PIL默认对每一帧单独生成调色板并且串行处理, 是动图合成的主要CPU开销
+    :return: 调色板相同的 'P' 模式帧列表
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+
+    step = max(len(images) // sample_count, 1)
+    samples = images[::step][:sample_count]
+    # 只用于统计颜色, 把抽样帧缩小后拼在一起, 生成调色板的耗时与帧的分辨率无关
+    thumb = 128
+    montage = Image.new('RGB', (thumb * len(samples), thumb))
+    for i, frame in enumerate(samples):
+        montage.paste(frame.convert('RGB').resize((thumb, thumb)), (i * thumb, 0))
+    palette = montage.quantize(colors=256, method=Image.MEDIANCUT)
+
+    dither_method = Image.FLOYDSTEINBERG if dither else Image.NONE
+
+    def quantize(frame):
+        return frame.convert('RGB').quantize(palette=palette, dither=dither_method)
+
+    if threads <= 1:
+        return [quantize(frame) for frame in images]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(quantize, images))
+
+
+def render_ugoira(zip_data: Union[bytes, str], frames_info: list, image_mode: str = 'GIF', max_frames: int = 600,
+                  pixel_noise: bool = False, global_palette: bool = False, quantize_threads: int = 1,
+                  dither: bool = False, delta_frames: bool = False, delta_tolerance: int = 0) -> bytes:
+    """
+    解压Ugoira的ZIP并合成动图
+    :param zip_data: ZIP文件数据或ZIP文件路径
+    :param frames_info: ugoira_metadata 中的帧信息, 包含每一帧的 delay
+    :param image_mode: 输出格式, 'GIF' 或 'WEBP'
+    :param max_frames: 最多使用的帧数
+    :param pixel_noise: 是否对首帧和随机一帧进行像素修改
+    :param global_palette: GIF格式时是否使用全局调色板并行量化, 见 quantize_with_global_palette
+    :param quantize_threads: 并行量化使用的线程数
+    :param dither: 使用全局调色板时是否抖动, 进行差分优化时忽略
+    :param delta_frames: 是否进行差分优化, 见 optimize_delta_frames
+    :param delta_tolerance: 差分优化时认为像素没有变化的最大差异
+    :return: 动图数据, ZIP中没有帧时返回空bytes, ZIP损坏等错误直接抛出
+    """
+    import zipfile
+    from PIL import Image
+
+    with zipfile.ZipFile(_open_source(zip_data)) as zip_file:
+        # 获取并排序帧文件
+        frame_files = sorted(
+            [f for f in zip_file.namelist() if f.endswith(('.jpg', '.png'))]
+        )[:max_frames]
+
+        if not frame_files:
+            return b""
+
+        images: List[Image.Image] = []
+        durations: List[int] = []
+
+        # 读取所有帧
+        for i, frame_name in enumerate(frame_files):
+            with zip_file.open(frame_name) as frame_file:
+                img = Image.open(io.BytesIO(frame_file.read()))
+                images.append(img)
+            # 获取这一帧的持续时间
+            duration = frames_info[i]['delay'] if i < len(frames_info) else 37
+            durations.append(duration)
+
+    if delta_frames:
+        images, durations = optimize_delta_frames(images, durations, delta_tolerance)
+        # 抖动的噪点每一帧都不同, 编码器比较出的变化区域几乎是整帧, 会抵消差分优化的效果
+        dither = False
+
+    # 像素修改防止图片被夹, 在差分优化之后进行, 修改的像素不会被当成噪点消除
+    if pixel_noise:
+        frame_idx = random.randint(0, len(images) - 1)
+        images[0] = tweak_pil_image(images[0])
+        images[frame_idx] = tweak_pil_image(images[frame_idx])
+
+    # 合成GIF
+    gif_buffer = io.BytesIO()
+    # webp在手机端可能显示为静态图片, 默认情况下请选择GIF格式, 但是GIF的体积通常较大
+    if image_mode.upper() == 'WEBP':
+        images[0].save(
+            gif_buffer,
+            format='WEBP',
+            save_all=True,
+            append_images=images[1:],
+            duration=durations,
+            loop=0,
+            quality=90,
+            method=1
+        )
+    elif global_palette:
+        frames = quantize_with_global_palette(images, quantize_threads, dither)
+        # 所有帧的调色板相同, 只写入一个全局调色板; optimize=False 避免PIL再逐帧重新整理调色板
+        frames[0].save(
+            gif_buffer,
+            format='GIF',
+            save_all=True,
+            append_images=frames[1:],
+            duration=durations,
+            loop=0,
+            optimize=False
+        )
+    else:
+        images[0].save(
+            gif_buffer,
+            format='GIF',
+            save_all=True,
+            append_images=images[1:],
+            duration=durations,
+            loop=0
+        )
+
+    return gif_buffer.getvalue()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+推送日志: 以追加方式记录每个 (作品, 群) 的推送状态, 进程在检查中途退出时, 重启后可以只补发没有完成的推送
+"""
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+# 推送状态
+STATE_PENDING = 'pending'  # 已经确定要推送, 还没有发送
+STATE_SENT = 'sent'  # 已发送
+STATE_FAILED = 'failed'  # 发送失败, 不再重试
+
+
+class DeliveryJournal:
+    """
+    追加写入的JSONL推送日志, 每行一条 {"run", "illust", "group", "state", ...} 记录,
+    同一个 (作品, 群) 以最后一条记录的状态为准。
+    写入先进入缓冲区, 攒够 fsync_batch 条或者调用 flush 时才写盘并 fsync, 避免每条记录都等待磁盘
+    """
+
+    def __init__(self, path: str, fsync_batch: int = 20):
+        self.path = path
+        self.fsync_batch = max(fsync_batch, 1)
+        self._buffer: List[str] = []
+
+    @staticmethod
+    def new_run_id(prefix: str = 'check') -> str:
+        """生成一次检查的ID"""
+        return f"{prefix}-{int(time.time() * 1000)}"
+
+    def record(self, run_id: str, illust_id, group_id, state: str, **extra) -> None:
+        """追加一条记录, extra 中可以保存补发时需要的信息, 例如画师ID和名字"""
+        entry = {'run': run_id, 'illust': str(illust_id), 'group': str(group_id), 'state': state}
+        entry.update(extra)
+        self._buffer.append(json.dumps(entry, ensure_ascii=False))
+        if len(self._buffer) >= self.fsync_batch:
+            self.flush()
+
+    def flush(self) -> None:
+        """把缓冲区写入文件并 fsync"""
+        if not self._buffer:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(self._buffer) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer.clear()
+
+    def _replay(self) -> Dict[Tuple[str, str], Dict]:
+        """读取日志, 返回每个 (作品, 群) 的最后一条记录, 忽略进程退出时写了一半的行"""
+        latest = {}
+        if not os.path.exists(self.path):
+            return latest
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    latest[(entry['illust'], entry['group'])] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return latest
+
+    def load_pending(self) -> List[Dict]:
+        """返回还没有完成的推送记录"""
+        self.flush()
+        return [entry for entry in self._replay().values() if entry['state'] == STATE_PENDING]
+
+    def compact(self) -> int:
+        """重写日志, 只保留还没有完成的推送, 返回保留的记录数"""
+        pending = self.load_pending()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in pending:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return len(pending)
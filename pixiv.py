@@ -1,31 +1,88 @@
+import time
+_PLUGIN_LOAD_START = time.perf_counter()  # 用于统计插件的加载耗时
+
 import base64
+import copy
 import os
 import json
 import asyncio
+import math
 import re
+import socket
+import sqlite3
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Tuple, Union, Any, Coroutine
+from typing import Dict, List, Tuple, Union, Any, Coroutine, AsyncIterator, Set, Optional, Hashable
 import nonebot
 from hoshino import Service, priv
 from hoshino.typing import CQEvent
-from pixivpy3 import AppPixivAPI
 from .config import PROXY_URL, MAX_DISPLAY_WORKS, IMAGE_QUALITY, CHECK_INTERVAL_HOURS, ENABLE_FOLLOWING_SUBSCRIPTION, \
-    ENABLE_PIXEL_NOISE, UGOIRA_IMAGE_MODE, UGOIRA_IMAGE_SIZE_LIMIT, UGORIA_MAX_FRAMES
+    ENABLE_PIXEL_NOISE, UGOIRA_IMAGE_MODE, UGOIRA_IMAGE_SIZE_LIMIT, UGORIA_MAX_FRAMES, MAX_FETCH_PAGES, \
+    ENABLE_FOLLOW_SYNC, FOLLOW_SYNC_BATCH_SIZE, FOLLOW_SYNC_INTERVAL_SECONDS, \
+    FAST_LANE_INTERVAL_MINUTES, IMAGE_BYTE_BUDGET_MB, \
+    IMAGE_SEND_MODE, IMAGE_SPOOL_DIR, IMAGE_SPOOL_MAX_AGE_HOURS, IMAGE_HTTP_HOST, IMAGE_HTTP_PORT, IMAGE_HTTP_PUBLIC_URL, \
+    IMAGE_MAX_EDGE, IMAGE_REENCODE_FORMAT, IMAGE_REENCODE_QUALITY, MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_AGE_HOURS, \
+    API_CACHE_TTL, API_CACHE_MAX_ENTRIES, API_CACHE_PERSIST, \
+    API_MAX_CONCURRENCY, NAME_RESOLVE_WAIT_SECONDS, ARTIST_NAME_REFRESH_DAYS, ARTIST_NAME_REFRESH_BATCH, \
+    API_IO_WORKERS, IMAGE_CPU_WORKERS, IMAGE_WORKER_MODE, \
+    CATCHUP_MAX_HOURS, CATCHUP_ON_STARTUP, CATCHUP_STARTUP_DELAY_SECONDS, CATCHUP_SUMMARY_THRESHOLD, \
+    CATCHUP_PUSH_INTERVAL_SECONDS, ENABLE_DELIVERY_JOURNAL, DELIVERY_JOURNAL_FSYNC_BATCH, SWEEP_MODE, STAGGER_SLICE_MINUTES, \
+    DOWNLOAD_MAX_MB, DOWNLOAD_SPOOL_THRESHOLD_MB, DOWNLOAD_MAX_CONCURRENCY, PIPELINE_MAX_PENDING, FORWARD_MAX_WORKS, \
+    UGOIRA_GIF_GLOBAL_PALETTE, UGOIRA_QUANTIZE_THREADS, UGOIRA_GIF_DITHER, \
+    UGOIRA_DELTA_FRAMES, UGOIRA_DEDUP_TOLERANCE, \
+    CLUSTER_ENABLED, CLUSTER_DB_PATH, CLUSTER_INSTANCE_ID, CLUSTER_SHARD_COUNT, CLUSTER_LEASE_SECONDS, \
+    TRACE_RUN_HISTORY, TRACE_MAX_SPANS_PER_RUN, PROFILE_SAMPLE_INTERVAL_MS, \
+    API_RATE_INITIAL, API_RATE_MIN, API_RATE_MAX, API_RATE_INCREASE, API_RATE_DECREASE, API_RATE_LIMIT_RETRIES
 import aiohttp
-import zipfile
-import io
-from PIL import Image  # 新增：用于GIF合成
-import random
 from .utils import send_to_group
+from .spool import ImageSpool
+from .cache import MediaCache, TTLCache, single_flight
+from .imaging import downscale_image, add_pixel_noise, add_ugoira_noise, render_ugoira
+from .executors import ImageExecutor, create_api_executor
+from .journal import DeliveryJournal, STATE_PENDING, STATE_SENT, STATE_FAILED
+from .download import DownloadTooLarge, read_limited, read_source, discard_source
+from .illust_helpers import is_illust_allowed, get_image_urls
+from .tag_rules import TagFilter
+from .follow_sync import FollowSync
+from .cluster import ClusterStore
+from .tracing import Tracer, SamplingProfiler, span, traced_sleep
+from .governor import AimdGovernor, is_rate_limited
+from .priority import PrioritySemaphore, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, with_priority, format_waiting
 
 # 插件配置
 PIXIV_REFRESH_TOKEN_PATH = os.path.join(os.path.dirname(__file__), 'refresh-token.json')
 PIXIV_SUBSCRIPTION_PATH = os.path.join(os.path.dirname(__file__), 'subscriptions.json')
 PIXIV_ARTIST_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'artist_names.json')
+PIXIV_FOLLOW_SYNC_PATH = os.path.join(os.path.dirname(__file__), 'follow_sync.json')
+PIXIV_PUSH_STATE_PATH = os.path.join(os.path.dirname(__file__), 'push_state.json')
+PIXIV_API_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'api_cache.json')
+PIXIV_DELIVERY_JOURNAL_PATH = os.path.join(os.path.dirname(__file__), 'delivery_journal.jsonl')
+PIXIV_PROFILE_DIR = os.path.join(os.path.dirname(__file__), 'profiles')
+PIXIV_RANKING_SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), 'ranking_snapshots.json')
+
+# 下载pixiv图片时使用的请求头, i.pximg.net 会校验 Referer
+PIXIV_IMAGE_HEADERS = {
+    'Referer': 'https://www.pixiv.net/',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# 图片超出单条消息体积预算时依次尝试的画质, square_medium 是裁剪过的正方形缩略图, 不参与降级
+IMAGE_QUALITY_FALLBACK_ORDER = ['original', 'large', 'medium']
+
+# 记录最近推送过的作品ID数量上限, 用于快速通道和定时检查之间的去重
+PUSHED_IDS_LIMIT = 5000
 
 if IMAGE_QUALITY not in ['large', 'medium', 'square_medium', 'original']:
     IMAGE_QUALITY = 'large'  # 默认值
 
+if IMAGE_SEND_MODE not in ['base64', 'file', 'http']:
+    IMAGE_SEND_MODE = 'base64'  # 默认值
+
+if SWEEP_MODE not in ['burst', 'staggered']:
+    SWEEP_MODE = 'burst'  # 默认值
+
 HELP_TEXT = """
 🎨 pixiv画师订阅插件
 [pixiv订阅画师 画师ID/主页URL] 订阅画师
@@ -33,8 +90,10 @@ HELP_TEXT = """
 [pixiv订阅列表] 查看订阅列表
 [pixiv开启r18] 允许推送R18内容
 [pixiv关闭r18] 屏蔽R18内容
-[pixiv屏蔽tag tag名] 屏蔽包含指定tag的作品
+[pixiv屏蔽tag tag名] 屏蔽包含指定tag的作品, 以 glob: 开头时为通配符 (* 和 ?), 例如 glob:*水着*
 [pixiv取消屏蔽tag tag名] 取消屏蔽指定tag
+[pixiv允许tag tag名] 只推送包含指定tag的作品, 同样支持 glob: 通配符
+[pixiv取消允许tag tag名] 取消允许指定tag
 [pixiv开启关注推送] 订阅机器人账号关注的全部画师
 [pixiv关闭关注推送] 取消订阅机器人账号关注的画师
 [pixiv群设置] 查看当前群的设置
@@ -44,72 +103,127 @@ HELP_TEXT = """
 sv = Service('pixiv-subscription', help_=HELP_TEXT, enable_on_default=True)
 
 
-def tweak_pil_image(img: Image.Image) -> Image.Image:
-    """
-    轻微修改图片的一个像素，让同一张图的字节流不完全相同。
-
-    """
-    try:
-        if img.mode not in ("RGB", "RGBA", "P"):
-            return img
-
-        # 做一个拷贝，避免调用方原对象被部分修改
-        new_img = img.copy()
-        pixels = new_img.load()
-        if pixels is None:
-            return img
-
-        width, height = new_img.size
-        if width <= 0 or height <= 0:
-            return img
-
-        x = random.randint(0, width - 1)
-        y = random.randint(0, height - 1)
-
-        if new_img.mode in ("RGB", "RGBA"):
-            px = pixels[x, y]
-            if new_img.mode == "RGB":
-                r, g, b = px
-                pixels[x, y] = ((r + 1) % 256, g, b)
-            else:
-                r, g, b, a = px
-                pixels[x, y] = ((r + 1) % 256, g, b, a)
-        elif new_img.mode == "P":
-            val = pixels[x, y]
-            pixels[x, y] = (val + 1) % 256
-
-        return new_img
-    except Exception as e:
-        sv.logger.error(f"修改图片像素失败: {e}")
-        return img
-
 class PixivSubscriptionManager:
     def __init__(self):
+        """只加载本地数据, 不进行任何网络请求, 登录Pixiv由 start 在事件循环启动后进行"""
         self.api = None
+        self._start_task: Optional[asyncio.Future] = None
+        # single_flight 使用的正在进行中的请求 {(方法名, 键): (Future, 发起者的优先级)}
+        self.inflight_requests: Dict[Hashable, Tuple[asyncio.Future, int]] = {}
         self.subscriptions = self.load_subscriptions()
         self.refresh_token = self.load_refresh_token()
-        self.artist_names = self.load_artist_names()
-        self.init_api()
+        # artist_names: {画师ID: 名字}, artist_names_updated: {画师ID: 最后一次确认名字的时间戳}
+        self.artist_names, self.artist_names_updated = self.load_artist_names()
+        self.artist_names_dirty = False
+        # 全局API并发预算, 所有Pixiv API请求共享, 排队时按请求的优先级放行
+        self.api_semaphore = PrioritySemaphore(API_MAX_CONCURRENCY)
+        # 图片和动图ZIP的下载并发限制, 同样按优先级放行
+        self.download_semaphore = PrioritySemaphore(DOWNLOAD_MAX_CONCURRENCY)
+        # 全局API速率控制, 所有Pixiv API请求按它的速率放行, 被限流时自动降速
+        self.api_governor = AimdGovernor(API_RATE_INITIAL, API_RATE_MIN, API_RATE_MAX,
+                                         increase=API_RATE_INCREASE, decrease=API_RATE_DECREASE)
+        # 插件自己的执行器: 阻塞的API请求和图片编解码各用一个池子, 互不抢占, 也不占用事件循环默认的线程池
+        self.api_executor = create_api_executor('pixiv-api', API_IO_WORKERS)
+        self.image_executor = ImageExecutor('pixiv-image', IMAGE_CPU_WORKERS,
+                                            use_processes=IMAGE_WORKER_MODE == 'process')
+        # 关注同步模式的状态: 机器人账号当前关注的画师, 以及其中由插件添加的画师
+        self.follow_sync = FollowSync(*self.load_follow_sync_state())
+        # 推送状态: 最近推送过的作品ID (按推送顺序), 快速通道已处理到的关注动态作品ID, 上一次成功完成定时检查的时间戳
+        # 以及每个画师最后一次被单独检查的时间戳 (错峰检查使用)
+        self.pushed_ids, self.fast_lane_last_id, self.last_check_time, self.artist_last_checked = \
+            self.load_push_state()
+        # 每个画师最后一次被单独请求的时间戳, 不论成功与否, 只用于错峰检查排队, 不需要持久化
+        self.artist_last_attempt: Dict[str, float] = {}
+        # 各排行榜模式上一次推送时的作品ID {模式: {'ids': [...], 'time': 时间戳}}
+        self.ranking_snapshots = self.load_ranking_snapshots()
+        # 最近一次关注动态是否完整覆盖了检查窗口, 是的话错峰检查可以跳过已关注的画师
+        self.follow_feed_complete = False
+        # 定时检查和启动补推不能同时进行, 见 check_lock
+        self._check_lock: Optional[asyncio.Lock] = None
+        # Pixiv API返回结果的缓存, 各接口的有效期见 API_CACHE_TTL
+        self.api_cache = TTLCache(API_CACHE_MAX_ENTRIES)
+        if API_CACHE_PERSIST:
+            try:
+                self.api_cache.load(PIXIV_API_CACHE_PATH)
+            except Exception as e:
+                sv.logger.error(f"加载API缓存失败: {e}")
+        # 推送日志, 进程在检查中途退出时, 重启后只补发没有完成的推送
+        self.journal = DeliveryJournal(PIXIV_DELIVERY_JOURNAL_PATH, DELIVERY_JOURNAL_FSYNC_BATCH) \
+            if ENABLE_DELIVERY_JOURNAL else None
+        # 多实例部署的共享存储, 没有开启时为 None
+        self.cluster = ClusterStore(
+            CLUSTER_DB_PATH or os.path.join(os.path.dirname(__file__), 'cluster.db'),
+            CLUSTER_INSTANCE_ID or socket.gethostname(),
+            shard_count=CLUSTER_SHARD_COUNT,
+            lease_seconds=CLUSTER_LEASE_SECONDS
+        ) if CLUSTER_ENABLED else None
+        # 所有实例发布的群 {群号: (负责发送的实例ID, 群设置)}, 由 sync_cluster 定时刷新
+        self.cluster_groups: Dict[str, Tuple[str, Dict]] = {}
+        # 各群编译好的tag规则, 群的规则修改时删除, 下次使用时重新编译
+        self.tag_filters: Dict[str, TagFilter] = {}
+        # 最近几次检查的各阶段耗时
+        self.tracer = Tracer(TRACE_RUN_HISTORY, TRACE_MAX_SPANS_PER_RUN)
+        # 为 True 时对下一次检查进行采样分析
+        self.profile_next_run = False
+        # 缩放/转码后图片的磁盘缓存, 同一张图再次发送时不需要重新下载和处理
+        self.media_cache = MediaCache(MEDIA_CACHE_DIR or os.path.join(os.path.dirname(__file__), 'media_cache'))
+        # 图片以文件或本地HTTP地址发送时使用的暂存目录
+        self.image_spool = ImageSpool(
+            IMAGE_SPOOL_DIR or os.path.join(os.path.dirname(__file__), 'image_spool'),
+            mode=IMAGE_SEND_MODE,
+            http_host=IMAGE_HTTP_HOST,
+            http_port=IMAGE_HTTP_PORT,
+            public_url=IMAGE_HTTP_PUBLIC_URL
+        )
+
+    async def start(self) -> None:
+        """初始化API并登录Pixiv, 在线程池中执行, 不阻塞事件循环"""
+        start_time = time.perf_counter()
+        await self.api_executor.run(self.init_api)
         sv.logger.info("正在使用refresh_token登录Pixiv...")
-        status, msg = self.login(self.refresh_token)
-        sv.logger.info(msg)
+        status, msg = await self.api_executor.run(self.login)
+        sv.logger.info(f"{msg}, 耗时 {time.perf_counter() - start_time:.2f}s")
+
+    @property
+    def check_lock(self) -> asyncio.Lock:
+        """
+        定时检查、错峰检查和启动补推共用的锁, 第一次使用时才创建:
+        管理器在插件导入时创建, 这时机器人的事件循环还不存在, Python 3.10 以前 asyncio.Lock 会绑定创建时的事件循环
+        """
+        if self._check_lock is None:
+            self._check_lock = asyncio.Lock()
+        return self._check_lock
+
+    async def ensure_started(self) -> None:
+        """等待 start 完成, 还没有开始时立即开始"""
+        if self._start_task is None:
+            self._start_task = asyncio.ensure_future(self.start())
+        await asyncio.shield(self._start_task)
 
     @staticmethod
-    def load_artist_names() -> Dict[str, str]:
-        """加载画师名字缓存"""
+    def load_artist_names() -> Tuple[Dict[str, str], Dict[str, float]]:
+        """加载画师名字缓存, 兼容只保存了 {画师ID: 名字} 的旧格式"""
         if os.path.exists(PIXIV_ARTIST_CACHE_PATH):
             try:
                 with open(PIXIV_ARTIST_CACHE_PATH, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    data = json.load(f)
+                if isinstance(data.get('names'), dict):
+                    return data['names'], data.get('updated_at', {})
+                # 旧格式没有更新时间, 视为需要刷新
+                return data, {}
             except Exception as e:
                 sv.logger.error(f"加载画师名字缓存失败: {e}")
-        return {}
+        return {}, {}
 
     def save_artist_names(self) -> None:
         """保存画师名字缓存"""
         try:
             with open(PIXIV_ARTIST_CACHE_PATH, 'w', encoding='utf-8') as f:
-                json.dump(self.artist_names, f, ensure_ascii=False, indent=2)
+                json.dump({
+                    'names': self.artist_names,
+                    'updated_at': self.artist_names_updated
+                }, f, ensure_ascii=False, indent=2)
+            self.artist_names_dirty = False
         except Exception as e:
             sv.logger.error(f"保存画师名字缓存失败: {e}")
 
@@ -119,15 +233,209 @@ class PixivSubscriptionManager:
         if not name:
             return
 
-        # 只有当名字不存在或者名字发生变化时才保存
+        # 名字没变时只更新确认时间, 由后台刷新任务统一保存, 避免每次检查都写文件
+        self.artist_names_updated[user_id] = time.time()
+        self.artist_names_dirty = True
+
+        # 只有当名字不存在或者名字发生变化时才立即保存
         if user_id not in self.artist_names or self.artist_names[user_id] != name:
             self.artist_names[user_id] = name
             self.save_artist_names()
 
+    def get_stale_artist_ids(self, user_ids, max_age_days: float) -> List[str]:
+        """返回名字缺失或者超过 max_age_days 没有确认过的画师ID, 最久没确认的排在前面"""
+        expire_before = time.time() - max_age_days * 24 * 3600
+        stale = [
+            str(user_id) for user_id in user_ids
+            if self.artist_names_updated.get(str(user_id), 0) < expire_before
+        ]
+        return sorted(stale, key=lambda user_id: self.artist_names_updated.get(user_id, 0))
+
+    async def resolve_artist_names(self, user_ids) -> None:
+        """并发获取画师名字, 并发数受全局API并发预算限制, 结果通过 get_user_info 写入名字缓存"""
+        await asyncio.gather(*(self.get_user_info(user_id) for user_id in user_ids), return_exceptions=True)
+
     def get_artist_name(self, user_id: Union[str, int]) -> str:
         """获取缓存的名字，如果没有则返回None"""
         return self.artist_names.get(str(user_id))
 
+    @staticmethod
+    def load_follow_sync_state() -> Tuple[Optional[Set[str]], Set[str]]:
+        """加载关注同步状态, following 为 None 表示还没有从Pixiv拉取过关注列表"""
+        if os.path.exists(PIXIV_FOLLOW_SYNC_PATH):
+            try:
+                with open(PIXIV_FOLLOW_SYNC_PATH, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                following = data.get('following')
+                return (set(following) if following is not None else None), set(data.get('managed', []))
+            except Exception as e:
+                sv.logger.error(f"加载关注同步状态失败: {e}")
+        return None, set()
+
+    def save_follow_sync_state(self) -> None:
+        """保存关注同步状态"""
+        try:
+            with open(PIXIV_FOLLOW_SYNC_PATH, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'following': sorted(self.follow_sync.following)
+                    if self.follow_sync.following is not None else None,
+                    'managed': sorted(self.follow_sync.managed)
+                }, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            sv.logger.error(f"保存关注同步状态失败: {e}")
+
+    @staticmethod
+    def load_push_state() -> Tuple['OrderedDict[str, None]', Optional[int], Optional[float], Dict[str, float]]:
+        """加载推送状态"""
+        if os.path.exists(PIXIV_PUSH_STATE_PATH):
+            try:
+                with open(PIXIV_PUSH_STATE_PATH, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                pushed_ids = OrderedDict((str(i), None) for i in data.get('pushed_ids', []))
+                return pushed_ids, data.get('fast_lane_last_id'), data.get('last_check_time'), \
+                    data.get('artist_last_checked', {})
+            except Exception as e:
+                sv.logger.error(f"加载推送状态失败: {e}")
+        return OrderedDict(), None, None, {}
+
+    def save_push_state(self) -> None:
+        """保存推送状态"""
+        try:
+            with open(PIXIV_PUSH_STATE_PATH, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'pushed_ids': list(self.pushed_ids),
+                    'fast_lane_last_id': self.fast_lane_last_id,
+                    'last_check_time': self.last_check_time,
+                    'artist_last_checked': self.artist_last_checked
+                }, f, ensure_ascii=False)
+        except Exception as e:
+            sv.logger.error(f"保存推送状态失败: {e}")
+
+    @staticmethod
+    def load_ranking_snapshots() -> Dict[str, Dict]:
+        """加载排行榜快照"""
+        if os.path.exists(PIXIV_RANKING_SNAPSHOT_PATH):
+            try:
+                with open(PIXIV_RANKING_SNAPSHOT_PATH, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                sv.logger.error(f"加载排行榜快照失败: {e}")
+        return {}
+
+    def save_ranking_snapshots(self) -> None:
+        """保存排行榜快照"""
+        try:
+            with open(PIXIV_RANKING_SNAPSHOT_PATH, 'w', encoding='utf-8') as f:
+                json.dump(self.ranking_snapshots, f, ensure_ascii=False)
+        except Exception as e:
+            sv.logger.error(f"保存排行榜快照失败: {e}")
+
+    def diff_ranking(self, mode: str, illusts: List[Dict], limit: int) -> List[Tuple[int, Dict]]:
+        """
+        返回排行榜前 limit 名中上一次快照里没有的作品 [(名次, 作品)], 并用这次的完整榜单更新快照。
+        快照保存获取到的整页榜单, 之前在 limit 名以外、这次升进前 limit 名的作品不算新上榜
+        """
+        previous = set(self.ranking_snapshots.get(mode, {}).get('ids', []))
+        new_entries = [
+            (rank, illust) for rank, illust in enumerate(illusts[:limit], start=1)
+            if str(illust.get('id')) not in previous
+        ]
+        self.ranking_snapshots[mode] = {
+            'ids': [str(illust.get('id')) for illust in illusts],
+            'time': time.time()
+        }
+        self.save_ranking_snapshots()
+        return new_entries
+
+    def claim_unpushed(self, illusts: List[Dict]) -> List[Dict]:
+        """
+        过滤掉已经推送过的作品, 并把剩下的作品标记为已推送。
+        过滤和标记之间没有 await, 快速通道和定时检查同时运行时同一个作品只会被其中一个推送
+        """
+        unpushed = []
+        for illust in illusts:
+            illust_id = str(illust.get('id'))
+            if illust_id in self.pushed_ids:
+                continue
+            self.pushed_ids[illust_id] = None
+            unpushed.append(illust)
+
+        if unpushed:
+            while len(self.pushed_ids) > PUSHED_IDS_LIMIT:
+                self.pushed_ids.popitem(last=False)
+            self.save_push_state()
+        return unpushed
+
+    def get_check_window_hours(self, check_time: datetime, since: Optional[float] = None) -> Tuple[float, bool]:
+        """
+        计算本次定时检查需要回溯的小时数, 从上一次成功检查的时间开始, 最多回溯 CATCHUP_MAX_HOURS 小时。
+        返回 (小时数, 是否为停机补推), 没有记录或关闭了补推时回溯 CHECK_INTERVAL_HOURS
+        :param since: 上一次检查的时间戳, 默认使用上一次成功完成定时检查的时间
+        """
+        if since is None:
+            since = self.last_check_time
+        if since is None or CATCHUP_MAX_HOURS <= 0:
+            return CHECK_INTERVAL_HOURS, False
+
+        gap_hours = (check_time.timestamp() - since) / 3600
+        # 定时任务本身会有几分钟的误差, 间隔明显超过检查周期才认为中间有停机
+        if gap_hours <= CHECK_INTERVAL_HOURS * 1.5:
+            return max(gap_hours, CHECK_INTERVAL_HOURS), False
+
+        if gap_hours > CATCHUP_MAX_HOURS:
+            sv.logger.warning(f"距离上次检查已经 {gap_hours:.1f} 小时, 只补推最近 {CATCHUP_MAX_HOURS} 小时的作品")
+        return min(gap_hours, max(CATCHUP_MAX_HOURS, CHECK_INTERVAL_HOURS)), True
+
+    def mark_artist_checked(self, user_id: str, check_time: datetime) -> None:
+        """记录画师已经检查到 check_time, 由调用方统一保存推送状态"""
+        self.artist_last_checked[str(user_id)] = check_time.timestamp()
+
+    def mark_artist_attempted(self, user_id: str, check_time: datetime) -> None:
+        """记录画师在 check_time 被请求过, 请求失败的画师 (例如已经注销) 等到下一个时间点再重试"""
+        self.artist_last_attempt[str(user_id)] = check_time.timestamp()
+
+    def get_due_artists(self, user_ids, now: float, interval_seconds: float) -> List[str]:
+        """
+        错峰检查: 每个画师按ID的哈希在检查周期内分到一个固定的时间点,
+        返回最近一次时间点已经过去、但在那之后还没有被检查过的画师, 等待最久的排在前面。
+        请求失败的画师同样按最后一次请求的时间排队, 不会一直排在最前面占满每个时间片的名额
+        """
+        due = []
+        for user_id in user_ids:
+            offset = zlib.crc32(str(user_id).encode('utf-8')) % int(interval_seconds)
+            latest_slot = now - (now - offset) % interval_seconds
+            last_checked = max(self.artist_last_checked.get(str(user_id), self.last_check_time) or 0,
+                               self.artist_last_attempt.get(str(user_id), 0))
+            if last_checked < latest_slot:
+                due.append((last_checked, str(user_id)))
+        return [user_id for _, user_id in sorted(due)]
+
+    def record_delivery(self, run_id: Optional[str], illust_id, group_id, state: str, **extra) -> None:
+        """在推送日志中记录一个作品在一个群的推送状态, 没有开启推送日志或没有 run_id 时不记录"""
+        if self.journal is None or not run_id:
+            return
+        try:
+            self.journal.record(run_id, illust_id, group_id, state, **extra)
+        except OSError as e:
+            sv.logger.error(f"写入推送日志失败: {e}")
+
+    def flush_journal(self, compact: bool = False) -> None:
+        """把推送日志写盘, compact=True 时同时删除已经完成的记录"""
+        if self.journal is None:
+            return
+        try:
+            if compact:
+                self.journal.compact()
+            else:
+                self.journal.flush()
+        except OSError as e:
+            sv.logger.error(f"写入推送日志失败: {e}")
+
+    def mark_check_succeeded(self, check_time: datetime) -> None:
+        """记录定时检查成功完成, 下一次检查从 check_time 开始"""
+        self.last_check_time = check_time.timestamp()
+        self.save_push_state()
+
     @staticmethod
     def load_refresh_token() -> str:
         """加载refresh_token"""
@@ -158,8 +466,11 @@ class PixivSubscriptionManager:
             json.dump(self.subscriptions, f, ensure_ascii=False, indent=2)
 
     def init_api(self) -> None:
-        """初始化API"""
+        """初始化API, pixivpy3 导入较慢, 在这里才导入"""
         try:
+            from pixivpy3 import AppPixivAPI
+
+
             # 准备请求参数
             kwargs = {}
             if PROXY_URL:
@@ -183,6 +494,9 @@ class PixivSubscriptionManager:
         if not self.refresh_token:
             return False, "未设置refresh_token"
 
+        if self.api is None:
+            self.init_api()
+
         try:
             self.api.auth(refresh_token=self.refresh_token)
             return True, "Pixiv登录成功"
@@ -196,7 +510,9 @@ class PixivSubscriptionManager:
                 'artists': [],
                 'r18_enabled': False,
                 'blocked_tags': [],
-                'push_following_enabled': False
+                'allowed_tags': [],
+                'push_following_enabled': False,
+                'ranking_modes': []
             }
         # 兼容旧配置，如果旧配置没有这个键则添加默认值
         elif 'push_following_enabled' not in self.subscriptions[group_id]:
@@ -256,6 +572,7 @@ class PixivSubscriptionManager:
 
         if tag not in self.subscriptions[group_id]['blocked_tags']:
             self.subscriptions[group_id]['blocked_tags'].append(tag)
+            self.tag_filters.pop(group_id, None)
             self.save_subscriptions()
             return True
         return False
@@ -265,6 +582,7 @@ class PixivSubscriptionManager:
         if (group_id in self.subscriptions and
                 tag in self.subscriptions[group_id]['blocked_tags']):
             self.subscriptions[group_id]['blocked_tags'].remove(tag)
+            self.tag_filters.pop(group_id, None)
             self.save_subscriptions()
             return True
         return False
@@ -275,47 +593,111 @@ class PixivSubscriptionManager:
             return self.subscriptions[group_id].get('blocked_tags', [])
         return []
 
-    def get_group_settings(self, group_id: str) -> Dict:
-        """获取群设置"""
+    def add_ranking_subscription(self, group_id: str, mode: str) -> bool:
+        """订阅排行榜"""
         self.ensure_group_settings(group_id)
-        return self.subscriptions[group_id]
+        modes = self.subscriptions[group_id].setdefault('ranking_modes', [])
+        if mode not in modes:
+            modes.append(mode)
+            self.save_subscriptions()
+            return True
+        return False
 
+    def remove_ranking_subscription(self, group_id: str, mode: str) -> bool:
+        """取消订阅排行榜"""
+        if group_id in self.subscriptions and mode in self.subscriptions[group_id].get('ranking_modes', []):
+            self.subscriptions[group_id]['ranking_modes'].remove(mode)
+            self.save_subscriptions()
+            return True
+        return False
 
-    def is_illust_allowed(self, illust: dict, group_id: Union[str, int]) -> bool:
-        """检查作品是否允许在指定群推送"""
-        if isinstance(group_id, int):
-            group_id = str(group_id)
-        # 检查R18限制
-        if not self.is_r18_enabled(group_id):
-            # x_restrict: 0=全年龄, 1=R18, 2=R18G
-            x_restrict = illust.get('x_restrict', 0)
-            if x_restrict != 0:
-                return False
+    def get_ranking_subscriptions(self, group_id: str) -> List[str]:
+        """获取群订阅的排行榜模式"""
+        if group_id in self.subscriptions:
+            return self.subscriptions[group_id].get('ranking_modes', [])
+        return []
+
+    def get_ranking_subscribers(self) -> Dict[str, List[str]]:
+        """构建排行榜模式到订阅群列表的映射表"""
+        subscribers = {}
+        for group_id, group_data in self.subscriptions.items():
+            for mode in group_data.get('ranking_modes', []):
+                subscribers.setdefault(mode, []).append(group_id)
+        return subscribers
+
+    def add_allowed_tag(self, group_id: str, tag: str) -> bool:
+        """添加允许tag, 群有允许tag时只推送匹配其中至少一个的作品"""
+        self.ensure_group_settings(group_id)
+        allowed_tags = self.subscriptions[group_id].setdefault('allowed_tags', [])
+        if tag not in allowed_tags:
+            allowed_tags.append(tag)
+            self.tag_filters.pop(group_id, None)
+            self.save_subscriptions()
+            return True
+        return False
+
+    def remove_allowed_tag(self, group_id: str, tag: str) -> bool:
+        """移除允许tag"""
+        if group_id in self.subscriptions and tag in self.subscriptions[group_id].get('allowed_tags', []):
+            self.subscriptions[group_id]['allowed_tags'].remove(tag)
+            self.tag_filters.pop(group_id, None)
+            self.save_subscriptions()
+            return True
+        return False
+
+    def get_tag_filter(self, group_id: str) -> TagFilter:
+        """获取群编译好的tag规则, 其他实例所在的群使用该群发布到集群的设置"""
+        tag_filter = self.tag_filters.get(group_id)
+        if tag_filter is None:
+            settings = self.subscriptions.get(group_id)
+            if settings is None:
+                settings = self.cluster_groups.get(group_id, (None, {}))[1]
+            tag_filter = TagFilter(settings.get('blocked_tags', []), settings.get('allowed_tags', []))
+            self.tag_filters[group_id] = tag_filter
+        return tag_filter
 
-        # 检查屏蔽tag
-        blocked_tags = self.get_blocked_tags(group_id)
-        if blocked_tags:
-            illust_tags = []
-            if 'tags' in illust:
-                illust_tags = [tag.get('name', '').lower() for tag in illust['tags']]
-                # 也检查翻译后的tag
-                for tag in illust['tags']:
-                    if 'translated_name' in tag and tag['translated_name']:
-                        illust_tags.append(tag['translated_name'].lower())
+    def get_group_settings(self, group_id: str) -> Dict:
+        """获取群设置"""
+        self.ensure_group_settings(group_id)
+        return self.subscriptions[group_id]
 
-            # 检查是否包含屏蔽的tag（不区分大小写）
-            for blocked_tag in blocked_tags:
-                if blocked_tag.lower() in illust_tags:
-                    return False
+    def get_all_subscribed_artists(self) -> Set[str]:
+        """获取所有群订阅画师的并集"""
+        artists = set()
+        for group_data in self.subscriptions.values():
+            artists.update(str(user_id) for user_id in group_data.get('artists', []))
+        return artists
 
-        return True
+    def get_follow_covered_artists(self) -> Set[str]:
+        """关注同步模式下, 返回可以完全由关注动态覆盖的画师ID, 本次同步没有核对过关注列表时返回空集合"""
+        if not ENABLE_FOLLOW_SYNC:
+            return set()
+        return self.follow_sync.covered()
 
+    def is_illust_allowed(self, illust: dict, group_id: Union[str, int]) -> bool:
+        """检查作品是否允许在指定群推送, 其他实例所在的群按该群发布到集群的设置检查"""
+        group_id = str(group_id)
+        settings = self.subscriptions.get(group_id)
+        if settings is None:
+            settings = self.cluster_groups.get(group_id, (None, {}))[1]
+        return is_illust_allowed(illust, settings.get('r18_enabled', False), self.get_tag_filter(group_id))
+
+    def get_group_deliverer(self, group_id: Union[str, int]) -> Optional[str]:
+        """集群模式下返回负责向群发送消息的其他实例ID, 由本实例发送或者没有开启集群模式时返回 None"""
+        if self.cluster is None:
+            return None
+        owner = self.cluster_groups.get(str(group_id), (None, {}))[0]
+        if owner is None or owner == self.cluster.instance_id:
+            return None
+        return owner
+
+    @single_flight(lambda user_id: str(user_id))
     async def get_user_info(self, user_id: str):
         """获取用户信息"""
         result = None
         try:
-            result = await self.__exec_and_retry_with_login(
-                self.api.user_detail,
+            result = await self.cached_api_call(
+                'user_detail',
                 user_id
             )
             if 'error' in result or 'user' not in result: # 表示请求失败
@@ -328,53 +710,84 @@ class PixivSubscriptionManager:
             sv.logger.error(f"获取用户信息失败: {e}; Return response:{result}")
         return None
 
+    async def iter_illust_pages(self, api_method: str, *args, max_pages: int = MAX_FETCH_PAGES,
+                                items_key: str = 'illusts', fresh: bool = False, **kwargs) -> AsyncIterator[Dict]:
+        """
+        按 next_url 逐页请求作品列表, 每拿到一页就 yield 一次API的原始返回结果,
+        调用方处理到已处理过的作品时直接 break 即可停止翻页, 最多请求 max_pages 页
+        :param api_method: AppPixivAPI 的方法名, 例如 'user_illusts'
+        :param items_key: 返回结果中列表数据的键名, 例如关注列表接口为 'user_previews'
+        :param fresh: 是否跳过API缓存
+        """
+        for page in range(max(max_pages, 1)):
+            result = await self.cached_api_call(api_method, *args, fresh=fresh, **kwargs)
+            # 请求成功但列表为空 (例如画师没有插画作品) 也是有效的结果, 交给调用方处理
+            if not isinstance(result, dict) or 'error' in result or not isinstance(result.get(items_key), list):
+                # 第一页就失败说明请求本身有问题, 后续页失败只是提前结束翻页
+                if page == 0:
+                    sv.logger.error(f"获取作品列表失败: {result}")
+                else:
+                    sv.logger.warning(f"获取第 {page + 1} 页作品失败, 停止翻页: {result}")
+                return
+
+            yield result
+
+            next_url = result.get('next_url')
+            if not next_url or not result[items_key]:
+                return
+            # next_url 中已经包含了 user_id/offset 等全部参数
+            args, kwargs = (), self.api.parse_qs(next_url)
+
     async def get_new_illusts_with_user_info(self, user_id: str, start_time: datetime, interval_hours: float) -> Tuple[
         Dict, List[Dict]]:
-        """获取指定时间窗口内的新作品, 返回查询的用户信息和新作品列表"""
+        """获取指定时间窗口内的新作品, 返回查询的用户信息和新作品列表, 请求失败时用户信息为空"""
         try:
             # 计算检查的时间范围
             check_start = start_time - timedelta(hours=interval_hours)
             check_end = start_time
 
-
-            # 默认会返回30个作品, 足够大多数场景使用
-            result = await self.__exec_and_retry_with_login(
-                self.api.user_illusts,
-                user_id
-            )
-
-            if not result or 'illusts' not in result or not result['illusts'] or 'user' not in result or not result[
-                'user']:
-                raise ValueError(result)
-
+            user_info = {}
             new_illusts = []
-            for illust in result['illusts']:
-                try:
-                    # 直接解析并转换为UTC
-                    create_date_utc = datetime.fromisoformat(illust['create_date']).astimezone(timezone.utc)
+            # 每页30个作品, 画师在时间窗口内连投超过30个作品时继续翻页, 直到遇到窗口外的作品
+            # 定时检查必须拿到最新数据, 否则缓存期间发布的作品会落在两次检查的时间窗口之间
+            async for result in self.iter_illust_pages('user_illusts', user_id, fresh=True):
+                if not result.get('user'):
+                    raise ValueError(result)
+                user_info = result['user']
+
+                reached_window_start = False
+                for illust in result['illusts']:
+                    try:
+                        # 直接解析并转换为UTC
+                        create_date_utc = datetime.fromisoformat(illust['create_date']).astimezone(timezone.utc)
 
-                    # 检查作品是否在时间窗口内
-                    if check_start < create_date_utc <= check_end:
-                        new_illusts.append(illust)
-                    elif create_date_utc <= check_start:
-                        # 由于作品按时间倒序排列，如果当前作品已经超出时间范围，后续作品也会超出
-                        break
+                        # 检查作品是否在时间窗口内
+                        if check_start < create_date_utc <= check_end:
+                            new_illusts.append(illust)
+                        elif create_date_utc <= check_start:
+                            # 由于作品按时间倒序排列，如果当前作品已经超出时间范围，后续作品也会超出
+                            reached_window_start = True
+                            break
+
+                    except (ValueError, TypeError) as e:
+                        sv.logger.error(f"解析时间失败: {e}, 原始时间: {illust.get('create_date', 'unknown')}")
+                        continue
 
-                except (ValueError, TypeError) as e:
-                    sv.logger.error(f"解析时间失败: {e}, 原始时间: {illust.get('create_date', 'unknown')}")
-                    continue
+                if reached_window_start:
+                    break
 
-            return result['user'], new_illusts
+            return user_info, new_illusts
 
         except Exception as e:
             sv.logger.error(f"获取作品列表失败: {e}")
             return {}, []
 
+    @single_flight(lambda illust_id: str(illust_id))
     async def get_illust_by_id(self, illust_id: str) -> Dict:
         """根据作品ID获取作品详情"""
         try:
-            result = await self.__exec_and_retry_with_login(
-                self.api.illust_detail,
+            result = await self.cached_api_call(
+                'illust_detail',
                 illust_id
             )
             if not result or 'illust' not in result or not result['illust']:
@@ -384,6 +797,7 @@ class PixivSubscriptionManager:
             sv.logger.error(f"获取作品详情失败: {e}")
             return {}
 
+    @single_flight(lambda mode: mode)
     async def get_ranking(self, mode: str) -> Union[Dict[Any, Any]]:
         """
         用于获取并发送指定模式的排行榜。
@@ -391,7 +805,7 @@ class PixivSubscriptionManager:
         """
         try:
             result = await self.__exec_and_retry_with_login(
-                self.api.illust_ranking,
+                'illust_ranking',
                 mode
             )
 
@@ -413,8 +827,8 @@ class PixivSubscriptionManager:
         :param user_id: 画师用户ID
         """
         try:
-            result = await self.__exec_and_retry_with_login(
-                self.api.user_illusts,
+            result = await self.cached_api_call(
+                'user_illusts',
                 user_id
             )
 
@@ -431,231 +845,351 @@ class PixivSubscriptionManager:
     async def get_illust_follow(self, start_time: datetime, interval_hours: float) -> List[Dict]:
         """
         获取当前bot关注画师在指定时间窗口内的新作品。
-        API本身返回最近作品，此函数在此基础上进行时间过滤。
+        API本身返回最近作品，此函数在此基础上进行时间过滤, 一页不够时按 next_url 继续翻页。
         """
-        try:
-            # 调用API获取原始的关注动态列表
-            result = await self.__exec_and_retry_with_login(
-                self.api.illust_follow
-            )
-
-            # 检查API返回是否有效
-            if not isinstance(result, dict) or 'illusts' not in result or not result.get('illusts'):
-                sv.logger.error(f"获取Pixiv关注作品列表失败或列表为空: {result}")
-                return []  # 失败或无内容时返回空列表
+        new_illusts, _ = await self.fetch_illust_follow_window(start_time, interval_hours)
+        return new_illusts
 
+    async def fetch_illust_follow_window(self, start_time: datetime, interval_hours: float) -> Tuple[List[Dict], bool]:
+        """
+        同 get_illust_follow, 额外返回关注动态是否完整覆盖了整个时间窗口。
+        翻到页数上限仍未到达窗口起点, 或者请求失败时返回 False, 此时调用方不能认为动态中没出现的画师没有更新
+        """
+        try:
             # 准备时间和用于存放结果的容器
             check_start = start_time - timedelta(hours=interval_hours)
             check_end = start_time
             new_illusts_in_window = []
+            complete = False
 
-            # 遍历API返回的所有作品，并根据时间窗口进行过滤
-            for illust in result['illusts']:
-                try:
-                    # 解析作品创建时间字符串
-                    create_date_utc = datetime.fromisoformat(illust['create_date']).astimezone(timezone.utc)
+            # 逐页获取关注动态, 每拿到一页就先过滤这一页
+            async for result in self.iter_illust_pages('illust_follow'):
+                reached_window_start = False
 
-                    # 判断作品是否在检查时间窗口内
-                    if check_start < create_date_utc <= check_end:
-                        new_illusts_in_window.append(illust)
+                # 遍历这一页的所有作品，并根据时间窗口进行过滤
+                for illust in result['illusts']:
+                    try:
+                        # 解析作品创建时间字符串
+                        create_date_utc = datetime.fromisoformat(illust['create_date']).astimezone(timezone.utc)
+
+                        # 判断作品是否在检查时间窗口内
+                        if check_start < create_date_utc <= check_end:
+                            new_illusts_in_window.append(illust)
+                        elif create_date_utc <= check_start:
+                            reached_window_start = True
+
+                    except (ValueError, TypeError, KeyError) as e:
+                        sv.logger.warning(f"解析或过滤关注作品时跳过一个项目: {e}, 作品ID: {illust.get('id')}")
+                        continue
+
+                # 这一页已经出现了窗口之外的作品, 后面的页只会更旧, 不再翻页
+                if reached_window_start:
+                    complete = True
+                    break
+                # 没有下一页说明动态已经全部获取
+                complete = not result.get('next_url')
 
-                except (ValueError, TypeError, KeyError) as e:
-                    sv.logger.warning(f"解析或过滤关注作品时跳过一个项目: {e}, 作品ID: {illust.get('id')}")
-                    continue
             # 返回经过时间过滤后的新作品列表
-            return new_illusts_in_window
+            return new_illusts_in_window, complete
 
         except Exception as e:
             sv.logger.error(f"获取Pixiv关注作品时发生未知异常: {e}")
-            return []  # 确保任何未知异常都返回一个安全的空列表
+            return [], False  # 确保任何未知异常都返回一个安全的空列表
 
-    @staticmethod
-    async def download_image_as_base64(url: str) -> str:
-        """下载图片并转换为base64编码, 根据ENABLE_PIXEL_NOISE配置项决定是否进行像素修改"""
+    async def get_illust_follow_since(self, last_id: int) -> List[Dict]:
+        """获取关注动态中作品ID大于 last_id 的全部作品, 遇到已处理过的作品时停止翻页"""
+        new_illusts = []
         try:
-            headers = {
-                'Referer': 'https://www.pixiv.net/',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
+            async for result in self.iter_illust_pages('illust_follow'):
+                reached_last_id = False
+                for illust in result['illusts']:
+                    if int(illust.get('id', 0)) > last_id:
+                        new_illusts.append(illust)
+                    else:
+                        reached_last_id = True
+                if reached_last_id:
+                    break
+        except Exception as e:
+            sv.logger.error(f"获取Pixiv关注作品时发生未知异常: {e}")
+        return new_illusts
+
+    async def fetch_following_ids(self) -> Optional[Set[str]]:
+        """获取机器人账号公开关注的全部画师ID, 失败或者没有获取完整时返回None"""
+        await self.ensure_started()
+        bot_user_id = getattr(self.api, 'user_id', 0)
+        if not bot_user_id:
+            return None
+        following = set()
+        last_result = None
+        # 关注列表需要完整获取, 不受 MAX_FETCH_PAGES 限制
+        async for result in self.iter_illust_pages('user_following', bot_user_id,
+                                                   max_pages=1000, items_key='user_previews'):
+            last_result = result
+            for preview in result['user_previews']:
+                user_id = (preview.get('user') or {}).get('id')
+                if user_id:
+                    following.add(str(user_id))
+        # 中途某一页失败时 iter_illust_pages 会提前结束, 不完整的列表不能用来判断画师是否被关注
+        if last_result is None or last_result.get('next_url'):
+            return None
+        return following
+
+    async def sync_following(self) -> None:
+        """
+        让机器人账号的关注列表覆盖所有群订阅的画师。
+        每次先从Pixiv重新获取关注列表, 在插件之外被取关的画师不再视为被关注动态覆盖;
+        每次最多执行 FOLLOW_SYNC_BATCH_SIZE 个关注/取关操作, 剩下的留到下次检查,
+        取关时只会取关由插件自己添加的画师, 不会影响账号原本的关注
+        """
+        following = await self.fetch_following_ids()
+        if following is None:
+            self.follow_sync.invalidate()
+            sv.logger.error("获取机器人账号关注列表失败, 本次跳过关注同步, 所有画师单独检查")
+            return
+        removed = self.follow_sync.reconcile(following)
+        if removed:
+            sv.logger.info(f"机器人账号在插件之外取关了 {len(removed)} 个画师, 仍被订阅的画师会重新关注")
+
+        desired = self.get_all_subscribed_artists()
+        to_follow, to_unfollow = self.follow_sync.plan(desired)
+        if to_follow or to_unfollow:
+            followed, unfollowed, failures = await self.follow_sync.apply(
+                self.__exec_and_retry_with_login,
+                desired,
+                FOLLOW_SYNC_BATCH_SIZE,
+                interval=FOLLOW_SYNC_INTERVAL_SECONDS,
+                is_rate_limited=self.is_rate_limited
+            )
+            for api_method, user_id, result in failures:
+                action = '关注' if api_method == 'user_follow_add' else '取消关注'
+                reason = '认证失败' if self.is_auth_error(result) else '被限流' if self.is_rate_limited(result) else ''
+                sv.logger.warning(f"{action}画师 {user_id} 失败{f' ({reason})' if reason else ''}: {result}")
+            sv.logger.info(f"关注同步完成, 待关注 {len(to_follow)} 个, 待取关 {len(to_unfollow)} 个, "
+                           f"本次成功关注 {followed} 个, 取关 {unfollowed} 个")
+        self.save_follow_sync_state()
+
+    async def to_cq_image(self, data: bytes) -> str:
+        """根据 IMAGE_SEND_MODE 把图片数据转换为CQ码, data为空时返回空字符串"""
+        if not data:
+            return ""
+        if IMAGE_SEND_MODE != 'base64':
+            try:
+                path = await self.api_executor.run(self.image_spool.write, data)
+                file_uri = await self.image_spool.to_file_uri(path)
+                return f"[CQ:image,file={file_uri}]"
+            except Exception as e:
+                sv.logger.error(f"写入图片暂存目录失败, 改为使用base64发送: {e}")
+        return f"[CQ:image,file=base64://{base64.b64encode(data).decode('utf-8')}]"
 
-            async with aiohttp.ClientSession(
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=30)
-            ) as session:
-                async with session.get(url, proxy=PROXY_URL) as resp:
-                    if resp.status != 200:
-                        sv.logger.error(f"下载图片失败, HTTP {resp.status}: {url}")
-                        return ""
+    async def download_image_as_cq(self, url: str) -> str:
+        """下载图片并转换为CQ码, 失败时返回空字符串"""
+        return await self.to_cq_image(await self.download_image_bytes(url))
 
-                    raw_data = await resp.read()
+    async def download_ugoira_as_cq(self, illust) -> str:
+        """下载Ugoira并合成动图, 转换为CQ码, 失败时返回空字符串"""
+        return await self.to_cq_image(await self.download_ugoira_bytes(illust))
 
-                    # 如果禁用了图片修改，直接返回原图base64
-                    if not ENABLE_PIXEL_NOISE:
-                        return base64.b64encode(raw_data).decode("utf-8")
+    async def download_image_as_base64(self, url: str) -> str:
+        """下载图片并转换为base64编码, 根据ENABLE_PIXEL_NOISE配置项决定是否进行像素修改"""
+        data = await self.download_image_bytes(url)
+        return base64.b64encode(data).decode("utf-8") if data else ""
 
-                    # 进行轻微像素修改防止风控
-                    try:
-                        img = Image.open(io.BytesIO(raw_data))
-                        mutated = tweak_pil_image(img)
-                        buf = io.BytesIO()
-                        fmt = mutated.format or img.format or "PNG"
-                        mutated.save(buf, format=fmt)
-                        processed_bytes = buf.getvalue()
-                    except Exception as e:
-                        sv.logger.error(f"图片处理异常: {e}, URL: {url}")
-                        processed_bytes = raw_data
-                    return base64.b64encode(processed_bytes).decode("utf-8")
+    async def download_image_bytes(self, url: str) -> bytes:
+        """
+        下载图片, 按 IMAGE_MAX_EDGE/IMAGE_REENCODE_FORMAT 缩放转码,
+        再根据ENABLE_PIXEL_NOISE配置项决定是否进行像素修改, 失败时返回空bytes
+        """
+        data = await self._get_transformed_image(url)
+
+        # 如果禁用了图片修改，直接返回
+        if not data or not ENABLE_PIXEL_NOISE:
+            return data
 
+        # 进行轻微像素修改防止风控, 编解码比较耗CPU, 放到图片处理执行器中执行
+        try:
+            return await self.image_executor.run(add_pixel_noise, data)
         except Exception as e:
-            sv.logger.error(f"下载图片异常: {e}, URL: {url}")
-            return ""
+            sv.logger.error(f"图片处理异常: {e}, URL: {url}")
+            return data
 
-    @staticmethod
-    def get_image_urls(illust: dict) -> List[str]:
+    @single_flight(lambda url: url)
+    async def _get_transformed_image(self, url: str) -> bytes:
         """
-        获取作品的所有图片URL
+        获取缩放转码后的图片, 处理结果会写入磁盘缓存, 命中缓存时不再下载,
+        多个群同时请求同一张图片时只下载一次, 像素修改在此之后对每个调用方单独进行。
+        不缩放转码时直接下载原图, 原图不写入缓存
         """
-        urls: List[str] = []
-        page_count = illust.get('page_count', 1)
-
-        def get_image_url(image_urls: dict) -> str:
-            """
-            根据 IMAGE_QUALITY 获取单张图片URL的辅助函数
-            """
-            if not image_urls:
-                return ""
-            check_order = [IMAGE_QUALITY, 'large', 'medium', 'square_medium']
-
-            for quality in check_order:
-                u = image_urls.get(quality)
-                if u:
-                    return u
-            return ""
+        if IMAGE_MAX_EDGE <= 0 and not IMAGE_REENCODE_FORMAT:
+            return await self._download_raw_image(url)
 
-        if page_count > 1:
-            # 多图情况下, 从 meta_pages 中逐页获取
-            meta_pages = illust.get('meta_pages') or []
-            for page in meta_pages:
-                url = get_image_url(page.get('image_urls', {}))
-                if url:
-                    urls.append(url)
-        else:
-            # 单页, 图片信息在 meta_single_page
-            meta_single_page = illust.get('meta_single_page', {})
-            url = meta_single_page.get('original_image_url')
-            if url:
-                urls.append(url)
-        return urls
+        cache_key = f"{url}|{IMAGE_MAX_EDGE}|{IMAGE_REENCODE_FORMAT}|{IMAGE_REENCODE_QUALITY}"
+        cached = await self.api_executor.run(self.media_cache.get, cache_key)
+        if cached:
+            return cached
 
-    # 下载Ugoira并合成GIF base64
-    @staticmethod
-    async def _download_ugoira_zip(zip_url: str) -> bytes:
-        """下载Ugoira的ZIP文件"""
-        headers = {
-            'Referer': 'https://www.pixiv.net/',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
+        # 较大的原图下载到临时文件, 只把文件路径交给图片处理进程, 不在内存中复制整张原图
+        source = await self._download_source(url)
+        if not source:
+            return b""
         try:
-            async with aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=60)) as session:
-                async with session.get(zip_url, proxy=PROXY_URL) as resp:
-                    if resp.status != 200:
-                        sv.logger.error(f"下载Ugoira ZIP失败, HTTP {resp.status}: {zip_url}")
-                        return b""
-                    return await resp.read()
+            data = await self.image_executor.run(
+                downscale_image,
+                source,
+                IMAGE_MAX_EDGE,
+                IMAGE_REENCODE_FORMAT,
+                IMAGE_REENCODE_QUALITY
+            )
         except Exception as e:
-            sv.logger.error(f"下载ZIP网络异常: {e}, URL: {zip_url}")
-            return b""
-
-    @staticmethod
-    def _process_ugoira_zip_to_gif(zip_data: bytes, frames_info: list) -> bytes:
-        """辅助方法：解压ZIP并合成GIF"""
+            sv.logger.error(f"图片缩放转码失败, 使用原图: {e}, URL: {url}")
+            return await self.api_executor.run(read_source, source)
+        finally:
+            discard_source(source)
 
         try:
-            with io.BytesIO(zip_data) as zip_buffer:
-                with zipfile.ZipFile(zip_buffer) as zip_file:
-                    # 获取并排序帧文件
-                    frame_files = sorted(
-                        [f for f in zip_file.namelist() if f.endswith(('.jpg', '.png'))]
-                    )[:UGORIA_MAX_FRAMES]
-
-                    if not frame_files:
-                        return b""
-
-                    images: List[Image.Image] = []
-                    durations: List[int] = []
-
-                    # 读取所有帧
-                    for i, frame_name in enumerate(frame_files):
-                        with zip_file.open(frame_name) as frame_file:
-                            img = Image.open(io.BytesIO(frame_file.read()))
-                            images.append(img)
-                        # 获取这一帧的持续时间
-                        duration = frames_info[i]['delay'] if i < len(frames_info) else 37
-                        durations.append(duration)
-
-                    # 像素修改防止图片被夹
-                    if ENABLE_PIXEL_NOISE:
-                        try:
-                            if images:
-                                frame_idx = random.randint(0, len(images) - 1)
-                                images[0] = tweak_pil_image(images[0])
-                                images[frame_idx] = tweak_pil_image(images[frame_idx])
-                                sv.logger.info(f"已修改Ugoira帧 {frame_idx} 的像素")
-                        except Exception as e:
-                            sv.logger.error(f"Ugoira像素修改失败: {e}")
-
-                    # 合成GIF
-                    gif_buffer = io.BytesIO()
-                    # webp在手机端可能显示为静态图片, 默认情况下请选择GIF格式, 但是GIF的体积通常较大
-                    if UGOIRA_IMAGE_MODE.upper() == 'WEBP':
-                        images[0].save(
-                            gif_buffer,
-                            format='WEBP',
-                            save_all=True,
-                            append_images=images[1:],
-                            duration=durations,
-                            loop=0,
-                            quality=90,
-                            method=1
-                        )
-                    else:
-                        images[0].save(
-                            gif_buffer,
-                            format='GIF',
-                            save_all=True,
-                            append_images=images[1:],
-                            duration=durations,
-                            loop=0
+            await self.api_executor.run(self.media_cache.put, cache_key, data)
+        except OSError as e:
+            sv.logger.warning(f"写入图片缓存失败: {e}")
+        return data
+
+    async def _download_raw_image(self, url: str) -> bytes:
+        """下载原始图片数据, 失败时返回空bytes"""
+        source = await self._download_source(url)
+        try:
+            # 超过 DOWNLOAD_SPOOL_THRESHOLD_MB 的图片保存在临时文件中, 在线程池中读取
+            if isinstance(source, str):
+                return await self.api_executor.run(read_source, source)
+            return source
+        finally:
+            discard_source(source)
+
+    async def _download_source(self, url: str, timeout: float = 30) -> Union[bytes, str]:
+        """
+        分块下载pixiv的图片或ZIP文件, Content-Length 或已读取的大小超过 DOWNLOAD_MAX_MB 时立即中止,
+        超过 DOWNLOAD_SPOOL_THRESHOLD_MB 的内容写入临时文件。
+        返回 bytes 或临时文件路径, 调用方用完后需要调用 discard_source, 失败时返回空bytes。
+        同时进行的下载数量不超过 DOWNLOAD_MAX_CONCURRENCY, 排队时按优先级放行
+        """
+        with span('download') as attrs:
+            try:
+                async with self.download_semaphore, aiohttp.ClientSession(
+                        headers=PIXIV_IMAGE_HEADERS,
+                        timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as session:
+                    async with session.get(url, proxy=PROXY_URL) as resp:
+                        if resp.status != 200:
+                            sv.logger.error(f"下载失败, HTTP {resp.status}: {url}")
+                            return b""
+                        source = await read_limited(
+                            resp,
+                            max_bytes=int(DOWNLOAD_MAX_MB * 1024 * 1024),
+                            spool_threshold=int(DOWNLOAD_SPOOL_THRESHOLD_MB * 1024 * 1024),
+                            run_blocking=self.api_executor.run
                         )
+                        attrs['bytes'] = os.path.getsize(source) if isinstance(source, str) else len(source)
+                        return source
+            except DownloadTooLarge as e:
+                sv.logger.warning(f"{e}, 放弃下载: {url}")
+            except Exception as e:
+                sv.logger.error(f"下载异常: {e}, URL: {url}")
+        return b""
 
-                    return gif_buffer.getvalue()
+    @staticmethod
+    def get_image_urls(illust: dict, quality: str = None) -> List[str]:
+        """
+        获取作品的所有图片URL
+        :param quality: 图片画质, 默认使用 IMAGE_QUALITY
+        """
+        return get_image_urls(illust, quality or IMAGE_QUALITY)
 
-        except zipfile.BadZipFile:
-            sv.logger.error("ZIP文件损坏")
+    @staticmethod
+    async def get_content_length(url: str) -> Optional[int]:
+        """通过HEAD请求获取图片大小, 服务器没有返回 Content-Length 或请求失败时返回None"""
+        try:
+            async with aiohttp.ClientSession(
+                    headers=PIXIV_IMAGE_HEADERS,
+                    timeout=aiohttp.ClientTimeout(total=10)
+            ) as session:
+                async with session.head(url, proxy=PROXY_URL) as resp:
+                    if resp.status != 200:
+                        return None
+                    return resp.content_length
         except Exception as e:
-            sv.logger.error(f"GIF合成过程异常: {e}")
+            sv.logger.warning(f"获取图片大小失败: {e}, URL: {url}")
+            return None
 
-        return b""
+    async def get_budgeted_image_urls(self, illust: dict, max_pages: int) -> List[str]:
+        """
+        获取作品前 max_pages 张图片的URL, 保证它们的总大小不超过 IMAGE_BYTE_BUDGET_MB。
+        总大小超出预算时按 original -> large -> medium 逐级降低画质, 最低一级仍超出时也照常返回
+        """
+        urls = self.get_image_urls(illust)[:max_pages]
+        if IMAGE_BYTE_BUDGET_MB <= 0 or not urls:
+            return urls
+        if IMAGE_QUALITY not in IMAGE_QUALITY_FALLBACK_ORDER:
+            return urls
+
+        budget = IMAGE_BYTE_BUDGET_MB * 1024 * 1024
+        start = IMAGE_QUALITY_FALLBACK_ORDER.index(IMAGE_QUALITY)
+        for quality in IMAGE_QUALITY_FALLBACK_ORDER[start:]:
+            urls = self.get_image_urls(illust, quality)[:max_pages]
+            sizes = await asyncio.gather(*(self.get_content_length(url) for url in urls))
+            # 拿不到大小的图片不计入总大小
+            total = sum(size or 0 for size in sizes)
+            if total <= budget:
+                return urls
+            sv.logger.info(f"作品 {illust.get('id')} 的 {quality} 画质共 {total / 1024 / 1024:.2f}MB, "
+                           f"超出 {IMAGE_BYTE_BUDGET_MB}MB 预算, 尝试降低画质")
+        return urls
 
+    # 下载Ugoira并合成GIF base64
     async def download_ugoira_as_gif_base64(self, illust) -> str:
         """下载Ugoira ZIP，合成GIF，转为base64"""
+        data = await self.download_ugoira_bytes(illust)
+        return base64.b64encode(data).decode('utf-8') if data else ""
+
+    async def download_ugoira_bytes(self, illust) -> bytes:
+        """
+        下载Ugoira ZIP并合成动图, 动图无法生成或超过大小限制时回退到静态封面图,
+        再根据ENABLE_PIXEL_NOISE配置项决定是否进行像素修改, 失败时返回空bytes
+        """
+        data = await self._get_ugoira_bytes(illust)
+        if not data or not ENABLE_PIXEL_NOISE:
+            return data
+
+        # 缓存和合并请求的都是未修改的动图, 像素修改对每个调用方单独进行
+        try:
+            return await self.image_executor.run(add_ugoira_noise, data)
+        except Exception as e:
+            sv.logger.error(f"动图处理异常: {e}, 作品ID: {illust.get('id')}")
+            return data
+
+    @single_flight(lambda illust: str(illust.get('id')))
+    async def _get_ugoira_bytes(self, illust) -> bytes:
+        """合成Ugoira动图, 结果写入磁盘缓存, 多个群同时请求同一个作品时只合成一次, 返回未进行像素修改的数据"""
         illust_id = illust.get('id')
         if not illust_id:
-            return ""
+            return b""
+
+        # 动图合成最耗CPU, 合成结果总是写入磁盘缓存, 重启后补发或其他命令再次发送时直接使用
+        cache_key = f"ugoira:{illust_id}|{UGOIRA_IMAGE_MODE}|{UGORIA_MAX_FRAMES}|" \
+                    f"{UGOIRA_GIF_GLOBAL_PALETTE}|{UGOIRA_GIF_DITHER}|{UGOIRA_DELTA_FRAMES}|{UGOIRA_DEDUP_TOLERANCE}"
+        gif_bytes = await self.api_executor.run(self.media_cache.get, cache_key)
+        if gif_bytes:
+            return await self._check_ugoira_size(illust, gif_bytes)
 
         # 获取pixiv动图元数据
         try:
-            metadata = await self.__exec_and_retry_with_login(
-                self.api.ugoira_metadata,
+            metadata = await self.cached_api_call(
+                'ugoira_metadata',
                 illust_id
             )
         except Exception as e:
             sv.logger.error(f"获取 Ugoira 元数据异常: {e}")
-            return ""
+            return b""
 
         if not metadata or 'ugoira_metadata' not in metadata:
             sv.logger.error(f"获取 Ugoira 元数据失败: {illust_id}")
-            return ""
+            return b""
 
         u_meta = metadata['ugoira_metadata']
         zip_urls = u_meta.get('zip_urls', {})
@@ -666,39 +1200,64 @@ class PixivSubscriptionManager:
             sv.logger.error(f"无效的 Ugoira ZIP URL: {zip_url}")
             fallback_url = illust.get('meta_single_page', {}).get('original_image_url')
             if fallback_url:
-                return await self.download_image_as_base64(fallback_url)
-            return ""
+                return await self._get_transformed_image(fallback_url)
+            return b""
 
-        # 下载ZIP
-        zip_data = await self._download_ugoira_zip(zip_url)
+        # 下载ZIP, 较大的ZIP保存为临时文件, 合成时由图片处理进程直接读取文件
+        zip_data = await self._download_source(zip_url, timeout=60)
         if not zip_data:
-            return ""
+            return b""
 
-        # 在线程池中处理图像合成, 避免阻塞事件循环
+        # 在图片处理执行器中合成动图, 避免阻塞事件循环, 也不会占用API请求的线程
         frames_info = u_meta.get('frames') or []
-        gif_bytes = await asyncio.get_event_loop().run_in_executor(
-            None,
-            self._process_ugoira_zip_to_gif,
-            zip_data,
-            frames_info
-        )
+        render_start = time.perf_counter()
+        try:
+            gif_bytes = await self.image_executor.run(
+                render_ugoira,
+                zip_data,
+                frames_info,
+                UGOIRA_IMAGE_MODE,
+                UGORIA_MAX_FRAMES,
+                False,
+                UGOIRA_GIF_GLOBAL_PALETTE,
+                UGOIRA_QUANTIZE_THREADS,
+                UGOIRA_GIF_DITHER,
+                UGOIRA_DELTA_FRAMES,
+                UGOIRA_DEDUP_TOLERANCE
+            )
+            encoder = 'GIF全局调色板' if UGOIRA_IMAGE_MODE.upper() == 'GIF' and UGOIRA_GIF_GLOBAL_PALETTE \
+                else UGOIRA_IMAGE_MODE.upper()
+            sv.logger.info(f"动图 {illust_id} 合成完成 ({encoder}), {len(frames_info)} 帧, "
+                           f"耗时 {time.perf_counter() - render_start:.2f}s, 大小 {len(gif_bytes) / 1024 / 1024:.2f}MB")
+        except Exception as e:
+            sv.logger.error(f"动图合成过程异常: {e}, 作品ID: {illust_id}")
+            gif_bytes = b""
+        finally:
+            discard_source(zip_data)
 
         if not gif_bytes:
-            return ""
+            return b""
+
+        try:
+            await self.api_executor.run(self.media_cache.put, cache_key, gif_bytes)
+        except OSError as e:
+            sv.logger.warning(f"写入动图缓存失败: {e}")
+        return await self._check_ugoira_size(illust, gif_bytes)
 
-        # 检查大小限制
+    async def _check_ugoira_size(self, illust: dict, gif_bytes: bytes) -> bytes:
+        """动图超过 UGOIRA_IMAGE_SIZE_LIMIT 时回退到静态封面图"""
         if len(gif_bytes) > UGOIRA_IMAGE_SIZE_LIMIT * 1024 * 1024:
             sv.logger.warning(f"GIF太大 ({len(gif_bytes) / 1024 / 1024:.2f}MB)，回退到第一帧静态图")
             fallback_url = illust.get('meta_single_page', {}).get('original_image_url')
             if fallback_url:
-                return await self.download_image_as_base64(fallback_url)
-            return ""
+                return await self._get_transformed_image(fallback_url)
+            return b""
 
-        return base64.b64encode(gif_bytes).decode('utf-8')
+        return gif_bytes
 
     @staticmethod
     def is_auth_error(exception) -> bool:
-        """判断是否是认证相关的错误"""
+        """判断API的返回结果或异常是否是认证相关的错误, 返回结果为解析后的JSON, 错误信息在 error 中"""
         error_msg = str(exception).lower()
         auth_error_keywords = [
             'invalid_grant',
@@ -709,34 +1268,161 @@ class PixivSubscriptionManager:
         ]
         return any(keyword in error_msg for keyword in auth_error_keywords)
 
-    async def __exec_and_retry_with_login(self, api_func, *args, **kwargs):
+    @staticmethod
+    def is_rate_limited(result) -> bool:
+        """判断API的返回结果 (解析后的JSON) 或异常是否表示被限流"""
+        return is_rate_limited(result)
+
+    async def cached_api_call(self, api_method: str, *args, fresh: bool = False, **kwargs):
+        """
+        带缓存地执行 Pixivpy3 API 函数, 有效期按接口名从 API_CACHE_TTL 中读取, 没有配置的接口不缓存。
+        fresh=True 时跳过读取缓存, 但仍然会用新结果更新缓存
+        """
+        endpoint = api_method
+        ttl = API_CACHE_TTL.get(endpoint, 0)
+        if ttl <= 0:
+            return await self.__exec_and_retry_with_login(api_method, *args, **kwargs)
+
+        key = json.dumps([[str(a) for a in args], {k: str(v) for k, v in kwargs.items()}], sort_keys=True)
+        if not fresh:
+            cached = self.api_cache.get(endpoint, key)
+            if cached is not None:
+                return cached
+
+        result = await self.__exec_and_retry_with_login(api_method, *args, **kwargs)
+        # 只缓存成功的结果
+        if isinstance(result, dict) and result and 'error' not in result:
+            self.api_cache.put(endpoint, key, result, ttl)
+        return result
+
+    def save_api_cache(self) -> None:
+        """开启了 API_CACHE_PERSIST 时把API缓存保存到磁盘"""
+        if not API_CACHE_PERSIST:
+            return
+        try:
+            self.api_cache.save(PIXIV_API_CACHE_PATH)
+        except Exception as e:
+            sv.logger.error(f"保存API缓存失败: {e}")
+
+    def format_api_cache_stats(self) -> str:
+        """生成API缓存命中率的统计文本"""
+        lines = [f"API缓存条目: {len(self.api_cache)}/{API_CACHE_MAX_ENTRIES}"]
+        for endpoint, (hits, misses, ratio) in sorted(self.api_cache.stats().items()):
+            lines.append(f"{endpoint}: 命中 {hits} 次, 未命中 {misses} 次, 命中率 {ratio:.1%}")
+        return '\n'.join(lines)
+
+    async def _run_api(self, api_method: str, *args, **kwargs):
+        """
+        在线程池中执行 Pixivpy3 API 函数, 同时进行的请求数不超过 API_MAX_CONCURRENCY,
+        请求按 api_governor 的速率放行, 被限流时降低速率并重试 API_RATE_LIMIT_RETRIES 次
+        """
+        # 启动时的登录在后台进行, 第一次请求需要等待登录完成
+        await self.ensure_started()
+        api_func = getattr(self.api, api_method)
+        # 包括等待并发预算和速率控制的时间, 嵌套的执行器 span 为实际请求的时间
+        with span('api', method=api_method):
+            for _ in range(API_RATE_LIMIT_RETRIES + 1):
+                error = None
+                async with self.api_semaphore:
+                    await self.api_governor.acquire()
+                    try:
+                        result = await self.api_executor.run(api_func, *args, **kwargs)
+                    except Exception as e:
+                        result, error = None, e
+                if not self.is_rate_limited(error if error is not None else result):
+                    if error is not None:
+                        raise error
+                    self.api_governor.on_success()
+                    return result
+                self.api_governor.on_throttled()
+                sv.logger.warning(f"{api_method} 被限流, API速率降低到 {self.api_governor.rate:.2f} 次/秒")
+            if error is not None:
+                raise error
+            return result
+
+    async def __exec_and_retry_with_login(self, api_method: str, *args, **kwargs):
         """执行 Pixivpy3 API 函数，如果遇到认证错误则自动重新登录并重试一次"""
-        result = await asyncio.get_event_loop().run_in_executor(
-            None, api_func, *args
-        )
+        result = await self._run_api(api_method, *args, **kwargs)
 
         # 检查返回结果是否包含认证错误
         if self.is_auth_error(result):
             # 重新登录
-            success, msg = await asyncio.get_event_loop().run_in_executor(
-                None, self.login, self.refresh_token
-            )
+            success, msg = await self.api_executor.run(self.login, self.refresh_token)
             if success:
                 # 重新执行API函数
-                result = await asyncio.get_event_loop().run_in_executor(
-                    None, api_func, *args
-                )
+                result = await self._run_api(api_method, *args, **kwargs)
                 return result
             else:
-                sv.logger.error(f"重新登录失败: {msg}, {api_func}, {args}, {kwargs}无法执行, result: {result}")
+                sv.logger.error(f"重新登录失败: {msg}, {api_method}, {args}, {kwargs}无法执行, result: {result}")
                 return result  # 返回原始错误结果
         return result
 
-# 创建管理器实例
+    def format_runtime_stats(self) -> str:
+        """生成执行器排队情况等运行状态的统计文本"""
+        return '\n'.join([
+            self.api_executor.stats(),
+            self.image_executor.stats(),
+            self.api_governor.stats(),
+            f"API并发排队: {format_waiting(self.api_semaphore.waiting())}, "
+            f"下载排队: {format_waiting(self.download_semaphore.waiting())}",
+            f"进行中的合并请求: {len(self.inflight_requests)}",
+        ] + ([
+            f"集群实例: {self.cluster.instance_id}, 持有分片 {len(self.cluster.owned_shards)}/{self.cluster.shard_count}, "
+            f"集群中的群 {len(self.cluster_groups)} 个"
+        ] if self.cluster is not None else []))
+
+    @contextmanager
+    def profile_run(self, name: str):
+        """profile_next_run 为 True 时对这次检查进行采样分析, 结束后把结果写入 profiles 目录"""
+        if not self.profile_next_run:
+            yield
+            return
+        self.profile_next_run = False
+        profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = os.path.join(PIXIV_PROFILE_DIR, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.folded")
+            try:
+                stacks = profiler.write(path)
+                sv.logger.info(f"采样分析结果已保存到 {path}, 共 {stacks} 种调用栈")
+            except OSError as e:
+                sv.logger.error(f"保存采样分析结果失败: {e}")
+
+    async def shutdown(self) -> None:
+        """机器人关闭时保存缓存并释放执行器和本地HTTP服务"""
+        if self.artist_names_dirty:
+            self.save_artist_names()
+        self.save_api_cache()
+        self.flush_journal()
+        try:
+            await self.image_spool.stop_http_server()
+        except Exception as e:
+            sv.logger.error(f"关闭图片HTTP服务失败: {e}")
+        self.api_executor.shutdown()
+        self.image_executor.shutdown()
+
+# 创建管理器实例, 这里不会进行网络请求
 manager = PixivSubscriptionManager()
+sv.logger.info(f"pixiv-subscription 插件加载完成, 耗时 {(time.perf_counter() - _PLUGIN_LOAD_START) * 1000:.0f}ms")
+
+
+@nonebot.on_startup
+async def start_manager():
+    """机器人启动后在后台登录Pixiv, 不阻塞其他插件的加载"""
+    asyncio.ensure_future(manager.ensure_started())
+    asyncio.ensure_future(recover_after_restart())
+    if manager.cluster is not None:
+        # 尽快领取分片, 不用等到第一次定时同步
+        asyncio.ensure_future(sync_cluster())
+    # 机器人关闭时释放插件自己的执行器
+    nonebot.get_bot().server_app.after_serving(manager.shutdown)
 
 
 @sv.on_prefix('pixiv订阅画师')
+@with_priority(PRIORITY_INTERACTIVE)
 async def subscribe_artist(bot, ev: CQEvent):
     """订阅画师"""
     if not priv.check_priv(ev, priv.ADMIN):
@@ -807,6 +1493,7 @@ async def unsubscribe_artist(bot, ev: CQEvent):
 
 
 @sv.on_prefix('pixiv订阅列表')
+@with_priority(PRIORITY_INTERACTIVE)
 async def list_subscriptions(bot, ev: CQEvent):
     """查看订阅列表"""
     group_id = str(ev.group_id)
@@ -816,23 +1503,29 @@ async def list_subscriptions(bot, ev: CQEvent):
         await bot.send(ev, "当前群没有订阅任何画师")
         return
 
-    sub_list = []
+    # 缓存中没有名字的画师并发获取, 最多等待 NAME_RESOLVE_WAIT_SECONDS 秒,
+    # 没获取完的先显示占位符, 在后台继续获取, 下次查看时就会显示名字。
+    # 画师较多时会有大量请求, 而且回复后仍在继续, 以后台优先级执行, 不挤占其他用户命令
+    missing = [user_id for user_id in subscriptions if not manager.get_artist_name(user_id)]
+    if missing:
+        resolve_task = asyncio.ensure_future(
+            with_priority(PRIORITY_BACKGROUND)(manager.resolve_artist_names)(missing)
+        )
+        await asyncio.wait([resolve_task], timeout=NAME_RESOLVE_WAIT_SECONDS)
 
+    sub_list = []
+    unresolved = 0
     for user_id in subscriptions:
-        # 尝试从缓存获取
         name = manager.get_artist_name(user_id)
-        # 如果缓存没有，调用API
         if not name:
-            user_info = await manager.get_user_info(user_id)
-            if user_info and 'name' in user_info:
-                name = user_info['name']
-            # 延时避免请求过快
-            await asyncio.sleep(0.5)
-
+            name = "(画师名获取中)"
+            unresolved += 1
         sub_list.append(f"{name} ({user_id})")
 
     msg = "当前订阅的画师:\n"
     msg += "\n".join(sub_list)
+    if unresolved:
+        msg += f"\n有 {unresolved} 个画师的名字仍在获取中, 请稍后再查看"
 
     await bot.send(ev, msg)
 
@@ -849,9 +1542,48 @@ async def set_pixiv_token(bot, ev: CQEvent):
         await bot.send(ev, "请输入refresh_token\n例：重设pixiv登录token your_refresh_token")
         return
 
-    success, msg = manager.login(refresh_token)
+    success, msg = await manager.api_executor.run(manager.login, refresh_token)
     await bot.send(ev, msg)
 
+@sv.on_prefix('pixiv缓存统计')
+async def show_cache_stats(bot, ev: CQEvent):
+    """查看API缓存命中率 (仅超级用户)"""
+    if not priv.check_priv(ev, priv.SUPERUSER):
+        await bot.send(ev, "只有超级用户才能查看缓存统计")
+        return
+
+    await bot.send(ev, manager.format_api_cache_stats())
+
+@sv.on_prefix('pixiv运行状态')
+async def show_runtime_stats(bot, ev: CQEvent):
+    """查看执行器的排队情况 (仅超级用户)"""
+    if not priv.check_priv(ev, priv.SUPERUSER):
+        await bot.send(ev, "只有超级用户才能查看运行状态")
+        return
+
+    await bot.send(ev, manager.format_runtime_stats())
+
+@sv.on_prefix('pixiv慢操作')
+async def show_slowest_spans(bot, ev: CQEvent):
+    """查看最近几次检查的耗时和最慢的阶段 (仅超级用户), 可以指定显示的数量"""
+    if not priv.check_priv(ev, priv.SUPERUSER):
+        await bot.send(ev, "只有超级用户才能查看检查耗时")
+        return
+
+    arg = ev.message.extract_plain_text().strip()
+    limit = int(arg) if arg.isdigit() else 10
+    await bot.send(ev, manager.tracer.format_report(min(max(limit, 1), 50)))
+
+@sv.on_prefix('pixiv性能分析')
+async def arm_profiler(bot, ev: CQEvent):
+    """对下一次检查进行采样分析 (仅超级用户)"""
+    if not priv.check_priv(ev, priv.SUPERUSER):
+        await bot.send(ev, "只有超级用户才能开启性能分析")
+        return
+
+    manager.profile_next_run = True
+    await bot.send(ev, f"将对下一次检查进行采样分析, 结果保存在 {PIXIV_PROFILE_DIR} 目录")
+
 @sv.on_prefix('pixiv开启关注推送')
 async def enable_push_following(bot, ev: CQEvent):
     """开启机器人账号关注画师的推送 (仅管理员)"""
@@ -911,7 +1643,8 @@ async def block_tag(bot, ev: CQEvent):
 
     tag = ev.message.extract_plain_text().strip()
     if not tag:
-        await bot.send(ev, "请输入要屏蔽的tag\n例：屏蔽tag R-18")
+        await bot.send(ev, "请输入要屏蔽的tag, 以 glob: 开头时可以使用通配符 * 和 ?\n"
+                           "例：屏蔽tag R-18\n例：屏蔽tag glob:*水着*")
         return
 
     group_id = str(ev.group_id)
@@ -940,6 +1673,45 @@ async def unblock_tag(bot, ev: CQEvent):
         await bot.send(ev, f"tag '{tag}' 不在屏蔽列表中")
 
 
+@sv.on_prefix('pixiv允许tag')
+async def allow_tag(bot, ev: CQEvent):
+    """只推送包含指定tag的作品 (仅管理员)"""
+    if not priv.check_priv(ev, priv.ADMIN):
+        await bot.send(ev, "只有群主或管理员才能设置允许tag")
+        return
+
+    tag = ev.message.extract_plain_text().strip()
+    if not tag:
+        await bot.send(ev, "请输入要允许的tag, 设置后只推送包含其中至少一个tag的作品, 以 glob: 开头时可以使用通配符 * 和 ?\n"
+                           "例：允许tag 風景\n例：允许tag glob:*風景*")
+        return
+
+    group_id = str(ev.group_id)
+    if manager.add_allowed_tag(group_id, tag):
+        await bot.send(ev, f"已允许tag: {tag}, 本群只推送包含允许tag的作品")
+    else:
+        await bot.send(ev, f"tag '{tag}' 已在允许列表中")
+
+
+@sv.on_prefix('pixiv取消允许tag')
+async def disallow_tag(bot, ev: CQEvent):
+    """取消允许指定tag (仅管理员)"""
+    if not priv.check_priv(ev, priv.ADMIN):
+        await bot.send(ev, "只有群主或管理员才能设置允许tag")
+        return
+
+    tag = ev.message.extract_plain_text().strip()
+    if not tag:
+        await bot.send(ev, "请输入要取消允许的tag\n例：取消允许tag 風景")
+        return
+
+    group_id = str(ev.group_id)
+    if manager.remove_allowed_tag(group_id, tag):
+        await bot.send(ev, f"已取消允许tag: {tag}")
+    else:
+        await bot.send(ev, f"tag '{tag}' 不在允许列表中")
+
+
 @sv.on_prefix('pixiv群设置')
 async def show_group_settings(bot, ev: CQEvent):
     """查看群设置"""
@@ -960,6 +1732,10 @@ async def show_group_settings(bot, ev: CQEvent):
     else:
         msg += "🚫 屏蔽tag: 无"
 
+    allowed_tags = settings.get('allowed_tags', [])
+    if allowed_tags:
+        msg += f"\n✅ 只推送tag: {', '.join(allowed_tags)}"
+
     await bot.send(ev, msg)
 
 
@@ -970,12 +1746,18 @@ async def force_check_updates(bot, ev: CQEvent):
         await bot.send(ev, "只有超级用户才能强制检查更新")
         return
 
+    if manager.check_lock.locked():
+        await bot.send(ev, "已经有检查正在进行 (定时检查、启动补推或错峰检查), 请稍后再试")
+        return
+
     await bot.send(ev, "开始检查画师更新，请稍候...")
 
     try:
         # 执行检查更新任务
-        await check_updates()
-        await bot.send(ev, "✅ 画师更新检查完成")
+        if await check_updates():
+            await bot.send(ev, "✅ 画师更新检查完成")
+        else:
+            await bot.send(ev, "已经有检查正在进行, 本次没有执行检查")
     except Exception as e:
         sv.logger.error(f"强制检查更新时出错: {e}")
         await bot.send(ev, f"❌ 检查更新时出现错误: {e}")
@@ -988,93 +1770,485 @@ async def construct_group_messages(artist_name: str, filtered_illusts: List[Dict
     - 每个作品最多展示 MAX_DISPLAY_WORKS 张图片。
     - 返回一个消息字符串列表，每个字符串代表一个完整的作品推送。
     """
-    all_messages = []
-    # 对作品按ID升序排序，确保推送时是正序的
-
-    for illust in filtered_illusts:
-        illust_id = illust.get('id', 'N/A')
-        title = illust.get('title', '无标题')
-        tags = [tag.get('name', '') for tag in illust['tags'][:3] if tag.get('name')]
-        # link = f"https://www.pixiv.net/artworks/{illust_id}"
-
-        # 构建基础文本消息
-        message = (
-            f"🎨 {artist_name} 有新作品更新！\n"
-            f"📖 {title}\n"
-            # f"ID: {illust_id}\n"
-            f"🏷️ {', '.join(tags)}"
-            # f"链接: {link}"
-        )
+    return [message async for _, message in iter_rendered_messages(artist_name, filtered_illusts)]
+
+
+async def construct_illust_message(artist_name: str, illust: Dict) -> str:
+    """构建单个作品的推送消息, 包含文字描述和作品的所有图片（或动图）"""
+    illust_id = illust.get('id', 'N/A')
+    title = illust.get('title', '无标题')
+    tags = [tag.get('name', '') for tag in illust['tags'][:3] if tag.get('name')]
+    # link = f"https://www.pixiv.net/artworks/{illust_id}"
+
+    # 构建基础文本消息
+    message = (
+        f"🎨 {artist_name} 有新作品更新！\n"
+        f"📖 {title}\n"
+        # f"ID: {illust_id}\n"
+        f"🏷️ {', '.join(tags)}"
+        # f"链接: {link}"
+    )
+
+    # 获取并处理该作品的所有媒体内容
+    try:
+        illust_type = illust.get('type')
+        if illust_type == 'ugoira':
+            cq_image = await manager.download_ugoira_as_cq(illust)
+            if cq_image:
+                message += f"\n{cq_image}"
+
+        elif illust_type == 'illust':
+            image_urls = manager.get_image_urls(illust)
+            urls_to_download = await manager.get_budgeted_image_urls(illust, MAX_DISPLAY_WORKS)
+
+            for img_url in urls_to_download:
+                cq_image = await manager.download_image_as_cq(img_url)
+                if cq_image:
+                    message += f"\n{cq_image}"
+
+            # 如果图片被截断，在末尾添加提示
+            if len(image_urls) > MAX_DISPLAY_WORKS:
+                message += f"该作品共有 {len(image_urls)} 张图片，仅展示前 {MAX_DISPLAY_WORKS} 张。"
+    except Exception as e:
+        sv.logger.error(f"处理作品 {illust_id} 的媒体时出错: {e}")
+        message += "\n(图片处理失败，请查看后台日志)"
+    return message.strip()
 
-        # 获取并处理该作品的所有媒体内容
-        try:
-            illust_type = illust.get('type')
-            if illust_type == 'ugoira':
-                b64_content = await manager.download_ugoira_as_gif_base64(illust)
-                if b64_content:
-                    message += f"\n[CQ:image,file=base64://{b64_content}]"
-
-            elif illust_type == 'illust':
-                image_urls = manager.get_image_urls(illust)
-                urls_to_download = image_urls[:MAX_DISPLAY_WORKS]
-
-                for img_url in urls_to_download:
-                    b64_content = await manager.download_image_as_base64(img_url)
-                    if b64_content:
-                        message += f"\n[CQ:image,file=base64://{b64_content}]"
-                    await asyncio.sleep(0.5)  # 避免请求过快
-
-                # 如果图片被截断，在末尾添加提示
-                if len(image_urls) > MAX_DISPLAY_WORKS:
-                    message += f"该作品共有 {len(image_urls)} 张图片，仅展示前 {MAX_DISPLAY_WORKS} 张。"
-        except Exception as e:
-            sv.logger.error(f"处理作品 {illust_id} 的媒体时出错: {e}")
-            message += "\n(图片处理失败，请查看后台日志)"
-        # 将构建完成的单个作品消息添加到最终列表中
-        all_messages.append(message.strip())
-        await asyncio.sleep(0.5)  # 避免请求过快
-    return all_messages
+
+async def iter_rendered_messages(artist_name: str, illusts: List[Dict],
+                                 max_pending: int = PIPELINE_MAX_PENDING) -> AsyncIterator[Tuple[Dict, str]]:
+    """
+    按顺序逐个产出 (作品, 消息)。
+    后台任务提前渲染后面的作品并放入有界队列, 调用方拿到一条就可以立即发送, 不需要等全部作品处理完;
+    队列满时渲染暂停, 内存中最多保存 max_pending 条已经渲染但还没有取走的消息
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(max_pending, 1))
+
+    async def produce():
+        for illust in illusts:
+            with span('construct_illust_message', illust_id=illust.get('id'), type=illust.get('type')):
+                message = await construct_illust_message(artist_name, illust)
+            await queue.put((illust, message))
+        await queue.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait([getter, producer], return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                # 渲染任务异常退出, 没有结束标记
+                getter.cancel()
+                producer.result()
+                return
+            item = getter.result()
+            if item is None:
+                return
+            yield item
+    finally:
+        # 调用方中途停止 (例如发送失败) 时不再继续渲染
+        producer.cancel()
+
+
+def build_summary_message(artist_name: str, illusts: List[Dict]) -> str:
+    """把多个作品合并为一条只有标题和链接的摘要消息"""
+    lines = [f"🎨 {artist_name} 在这段时间内更新了 {len(illusts)} 个作品:"]
+    for illust in sorted(illusts, key=lambda i: int(i.get('id', 0))):
+        lines.append(f"📖 {illust.get('title', '无标题')} https://www.pixiv.net/artworks/{illust.get('id')}")
+    return '\n'.join(lines)
 
 
 #调整更新发送方式以适应多图分割发送
 async def process_and_send_updates(bot, user_id: str, artist_name: str,
-                                  new_illusts: List[Dict], target_group_ids: set):
+                                  new_illusts: List[Dict], target_group_ids: set, summary_threshold: int = 0,
+                                  run_id: Optional[str] = None):
     """
     处理单个画师的更新并发送给所有目标群组。
     根据每个群的设置过滤作品，再构造多条消息逐条发送。
+    summary_threshold 大于0且过滤后的作品数超过它时, 改为发送一条摘要消息和最新一个作品的完整消息
+    提供 run_id 时先把全部待推送的 (作品, 群) 写入推送日志, 进程中途退出后重启可以补发
+    集群模式下按 (作品, 群) 在集群中认领, 其他实例负责的群写入发件箱, 由该实例发送
     """
-    # 如果没有新作品，直接返回
-    if not new_illusts:
-        return
+    with span('process_and_send_updates', user_id=user_id, works=len(new_illusts)):
+        # 过滤掉已经被快速通道或其他检查推送过的作品, 集群模式下由集群的认领记录去重
+        if manager.cluster is None:
+            new_illusts = manager.claim_unpushed(new_illusts)
 
-    for group_id in target_group_ids:
-        try:
+        # 如果没有新作品，直接返回
+        if not new_illusts:
+            return
+
+        deliveries = []
+        for group_id in target_group_ids:
             # 针对每个群组，独立过滤作品
             filtered_illusts = [
                 illust for illust in new_illusts if manager.is_illust_allowed(illust, group_id)
             ]
-            if not filtered_illusts:
-                continue
+            if filtered_illusts:
+                deliveries.append((group_id, filtered_illusts))
 
-            # 构造所有消息内容
-            messages_to_send = await construct_group_messages(artist_name, filtered_illusts)
+        if manager.cluster is not None:
+            deliveries = await claim_cluster_deliveries(user_id, artist_name, deliveries)
 
-            # 如果时间窗口内单画师作品过多，合并发送
-            if len(filtered_illusts) > 3:
+        # 作品已经被标记为已推送, 在开始下载和发送之前先把待推送记录写盘
+        for group_id, filtered_illusts in deliveries:
+            for illust in filtered_illusts:
+                manager.record_delivery(run_id, illust.get('id'), group_id, STATE_PENDING,
+                                        user_id=user_id, artist_name=artist_name)
+        manager.flush_journal()
+
+        for group_id, filtered_illusts in deliveries:
+            await deliver_to_group(bot, group_id, user_id, artist_name, filtered_illusts, summary_threshold, run_id)
+
+
+async def claim_cluster_deliveries(user_id: str, artist_name: str,
+                                   deliveries: List[Tuple[str, List[Dict]]]) -> List[Tuple[str, List[Dict]]]:
+    """
+    在集群中认领推送, 只保留本实例认领成功的作品,
+    其中由其他实例负责的群写入发件箱, 返回需要本实例发送的部分
+    """
+    pairs = [(str(illust.get('id')), str(group_id)) for group_id, illusts in deliveries for illust in illusts]
+    claimed = await manager.api_executor.run(manager.cluster.claim_deliveries, pairs)
+
+    local_deliveries = []
+    for group_id, illusts in deliveries:
+        illusts = [illust for illust in illusts if (str(illust.get('id')), str(group_id)) in claimed]
+        if not illusts:
+            continue
+        deliverer = manager.get_group_deliverer(group_id)
+        if deliverer is None:
+            local_deliveries.append((group_id, illusts))
+            continue
+        try:
+            await manager.api_executor.run(manager.cluster.enqueue, deliverer, group_id, user_id, artist_name, illusts)
+        except sqlite3.Error as e:
+            sv.logger.error(f"写入集群发件箱失败, 群 {group_id} 的 {len(illusts)} 个作品不会被推送: {e}")
+    return local_deliveries
+
+
+async def deliver_to_group(bot, group_id: str, user_id: str, artist_name: str, illusts: List[Dict],
+                           summary_threshold: int = 0, run_id: Optional[str] = None) -> None:
+    """构造并发送一个群的推送消息, 在推送日志中记录每个作品的发送结果"""
+    remaining = list(illusts)
+    try:
+        if 0 < summary_threshold < len(illusts):
+            latest = max(illusts, key=lambda i: int(i.get('id', 0)))
+            messages_to_send = [build_summary_message(artist_name, illusts)]
+            messages_to_send += await construct_group_messages(artist_name, [latest])
+            with span('send', group_id=group_id, messages=len(messages_to_send)):
                 await send_to_group(bot, group_id, messages_to_send)
-            else:
-                # 逐条发送
-                for msg in messages_to_send:
+        elif len(illusts) > 3:
+            # 如果时间窗口内单画师作品过多，合并发送
+            # 合并转发必须一次发出, 每攒够 FORWARD_MAX_WORKS 个作品就发送一条, 限制同时保存在内存中的图片数量
+            batch = []
+            async for illust, msg in iter_rendered_messages(artist_name, illusts):
+                batch.append((illust, msg))
+                if len(batch) >= FORWARD_MAX_WORKS:
+                    await send_forward_batch(bot, group_id, batch, run_id, remaining)
+                    batch = []
+            if batch:
+                await send_forward_batch(bot, group_id, batch, run_id, remaining)
+        else:
+            # 逐条发送, 渲染好一条就发送一条, 每发送一条就记录, 中途失败时已发送的作品不会被补发
+            async for illust, msg in iter_rendered_messages(artist_name, illusts):
+                with span('send', group_id=group_id, messages=1):
                     await bot.send_group_msg(group_id=int(group_id), message=msg)
-                    await asyncio.sleep(2)  # 防风控延时
+                manager.record_delivery(run_id, illust.get('id'), group_id, STATE_SENT)
+                remaining.remove(illust)
+                await traced_sleep(2)  # 防风控延时
+        state = STATE_SENT
+    except Exception as e:
+        sv.logger.error(f"向群 {group_id} 发送画师 {user_id} ({artist_name}) 更新消息时出错: {e}")
+        # 发送失败通常是风控或群状态异常, 补发也很可能失败, 所以不再重试
+        state = STATE_FAILED
 
-        except Exception as e:
-            sv.logger.error(f"向群 {group_id} 发送画师 {user_id} ({artist_name}) 更新消息时出错: {e}")
+    for illust in remaining:
+        manager.record_delivery(run_id, illust.get('id'), group_id, state)
+
+async def send_forward_batch(bot, group_id: str, batch: List[Tuple[Dict, str]], run_id: Optional[str],
+                             remaining: List[Dict]) -> None:
+    """以合并转发发送一批已经渲染好的作品消息, 并记录为已发送"""
+    with span('send', group_id=group_id, messages=len(batch), forward=True):
+        await send_to_group(bot, group_id, [msg for _, msg in batch])
+    for illust, _ in batch:
+        manager.record_delivery(run_id, illust.get('id'), group_id, STATE_SENT)
+        remaining.remove(illust)
+
+
+def collect_artist_groups() -> Dict[str, List[str]]:
+    """构建画师ID到订阅群列表的映射表"""
+    artist_to_groups = {}  # {artist_id: [group_id1, group_id2, ...]}
+
+    for group_id, group_data in manager.subscriptions.items():
+        artists = group_data.get('artists', [])
+        for user_id in artists:
+            if user_id not in artist_to_groups:
+                artist_to_groups[user_id] = []
+            artist_to_groups[user_id].append(group_id)
+    return artist_to_groups
+
+
+def collect_polled_artist_groups() -> Dict[str, List[str]]:
+    """
+    构建需要单独请求的画师到订阅群列表的映射表。
+    集群模式下包含所有实例发布的群, 只保留本实例持有的分片中的画师
+    """
+    if manager.cluster is None:
+        return collect_artist_groups()
+
+    artist_to_groups = {}
+    for group_id, (_, settings) in manager.cluster_groups.items():
+        for user_id in settings.get('artists', []):
+            if manager.cluster.owns_artist(user_id):
+                artist_to_groups.setdefault(str(user_id), []).append(group_id)
+    return artist_to_groups
+
+
+def collect_following_push_groups() -> Set[str]:
+    """获取开启了关注画师推送的群"""
+    if not ENABLE_FOLLOWING_SUBSCRIPTION:
+        return set()
+    return {
+        group_id for group_id, setting in manager.subscriptions.items()
+        if setting.get('push_following_enabled', False)
+    }
+
+
+def group_illusts_by_artist(illusts: List[Dict]) -> Dict[str, Dict]:
+    """按画师ID分组作品, 返回 {画师ID: {'user': 画师信息, 'illusts': [作品, ...]}}"""
+    grouped = {}
+    for illust in illusts:
+        user_id = str(illust['user']['id'])
+        if user_id not in grouped:
+            grouped[user_id] = {'user': illust['user'], 'illusts': []}
+        grouped[user_id]['illusts'].append(illust)
+    return grouped
+
+
+async def check_following_feed():
+    """
+    快速通道: 高频增量检查关注动态, 只处理比上次检查更新的作品。
+    一次关注动态请求就能覆盖所有关注的画师, 所以可以几分钟检查一次,
+    没被关注动态覆盖的画师仍由 check_updates 定时兜底。
+    """
+    if not (ENABLE_FOLLOWING_SUBSCRIPTION or ENABLE_FOLLOW_SYNC):
+        return
+
+    bot = nonebot.get_bot()
+
+    # 第一次运行时只记录当前最新的作品ID, 之前的作品交给定时检查处理, 避免启动时刷屏。
+    # 请求失败或关注动态为空时不记录, 下次继续尝试; 之前版本可能保存过 0, 同样视为没有记录
+    if not manager.fast_lane_last_id:
+        latest_id = 0
+        async for result in manager.iter_illust_pages('illust_follow', max_pages=1):
+            latest_id = max((int(i.get('id', 0)) for i in result['illusts']), default=0)
+        if latest_id > 0:
+            manager.fast_lane_last_id = latest_id
+            manager.save_push_state()
+        else:
+            sv.logger.warning("快速通道获取关注动态的起点失败, 下次检查时重试")
+        return
+
+    new_illusts = await manager.get_illust_follow_since(manager.fast_lane_last_id)
+    if not new_illusts:
+        return
+
+    manager.fast_lane_last_id = max(int(i.get('id', 0)) for i in new_illusts)
+    manager.save_push_state()
+
+    # 按ID升序推送, 保证先发布的作品先推送
+    new_illusts.sort(key=lambda i: int(i.get('id', 0)))
+    artist_to_groups = collect_artist_groups()
+    groups_enabling_following = collect_following_push_groups()
+    run_id = DeliveryJournal.new_run_id('fast')
+
+    for user_id, data in group_illusts_by_artist(new_illusts).items():
+        artist_name = data['user']['name']
+        manager.update_artist_name(user_id, artist_name)
+
+        target_group_ids = set(artist_to_groups.get(user_id, [])) | groups_enabling_following
+        if not target_group_ids:
             continue
+        try:
+            await process_and_send_updates(bot, user_id, artist_name, data['illusts'], target_group_ids,
+                                           run_id=run_id)
+        except Exception as e:
+            sv.logger.error(f"快速通道推送画师 {user_id} 更新时出错: {e}")
+    manager.flush_journal()
+
+    sv.logger.info(f"快速通道检查完成, 新作品 {len(new_illusts)} 个")
+
+
+if FAST_LANE_INTERVAL_MINUTES > 0:
+    sv.scheduled_job('interval', minutes=FAST_LANE_INTERVAL_MINUTES)(check_following_feed)
+
+
+@sv.scheduled_job('interval', hours=1)
+async def cleanup_expired_files():
+    """清理图片暂存目录和图片缓存中过期的文件"""
+    if IMAGE_SEND_MODE != 'base64':
+        removed = await manager.api_executor.run(manager.image_spool.cleanup, IMAGE_SPOOL_MAX_AGE_HOURS)
+        if removed:
+            sv.logger.info(f"已清理 {removed} 个过期的暂存图片")
+
+    removed = await manager.api_executor.run(manager.media_cache.cleanup, MEDIA_CACHE_MAX_AGE_HOURS)
+    if removed:
+        sv.logger.info(f"已清理 {removed} 个过期的图片缓存")
+
+    manager.save_api_cache()
+
+    if manager.cluster is not None:
+        try:
+            await manager.api_executor.run(manager.cluster.prune)
+        except sqlite3.Error as e:
+            sv.logger.error(f"清理集群数据库失败: {e}")
+
+
+@sv.scheduled_job('interval', hours=1)
+@with_priority(PRIORITY_BACKGROUND)
+async def refresh_artist_names():
+    """
+    后台刷新订阅画师的名字缓存。
+    定时检查获取作品时已经会顺便更新画师名字, 这里只处理缺失或者超过 ARTIST_NAME_REFRESH_DAYS 天没有确认过的画师
+    """
+    stale = manager.get_stale_artist_ids(manager.get_all_subscribed_artists(), ARTIST_NAME_REFRESH_DAYS)
+    if stale:
+        batch = stale[:ARTIST_NAME_REFRESH_BATCH]
+        await manager.resolve_artist_names(batch)
+        sv.logger.info(f"已刷新 {len(batch)} 个画师的名字缓存, 剩余 {len(stale) - len(batch)} 个待刷新")
+
+    if manager.artist_names_dirty:
+        manager.save_artist_names()
+
+
+async def poll_artist(bot, user_id: str, group_ids: List[str], check_time: datetime, run_id: str) -> bool:
+    """
+    单独请求一个画师从上一次成功检查到 check_time 之间的新作品并推送, 成功后记录画师的检查时间, 返回请求是否成功。
+    失败的画师保留原来的检查时间, 下次请求成功时补推中间的作品
+    """
+    with span('poll_artist', user_id=user_id):
+        manager.mark_artist_attempted(user_id, check_time)
+        since = manager.artist_last_checked.get(user_id, manager.last_check_time)
+        window_hours, is_catchup = manager.get_check_window_hours(check_time, since)
+        try:
+            user_info, new_illusts = await manager.get_new_illusts_with_user_info(
+                user_id,
+                start_time=check_time,
+                interval_hours=window_hours
+            )
+
+            if not user_info:
+                sv.logger.warning(f"请求画师 {user_id} 的作品失败, 等到下一个检查时间点再重试")
+                # 还没有单独记录过的画师跟随整轮检查的时间, 整轮检查时间推进之后仍然要从这里开始补推
+                if since is not None:
+                    manager.artist_last_checked.setdefault(user_id, since)
+                return False
+
+            artist_name = user_info.get('name')
+            # 更新缓存的画师名称
+            manager.update_artist_name(user_id, artist_name)
+            manager.mark_artist_checked(user_id, check_time)
+
+            if not new_illusts:
+                sv.logger.info(f"画师 {user_id} 没有新作品，跳过")
+                return True
+
+            summary_threshold = CATCHUP_SUMMARY_THRESHOLD if is_catchup else 0
+            await process_and_send_updates(bot, user_id, artist_name, new_illusts, set(group_ids), summary_threshold,
+                                           run_id)
+
+            sv.logger.info(f"画师 {user_id} 处理完成")
+            if is_catchup:
+                await traced_sleep(CATCHUP_PUSH_INTERVAL_SECONDS)
+            return True
+        except Exception as e:
+            sv.logger.error(f"获取画师 {user_id} 更新时出错: {e}")
+            import traceback
+            sv.logger.error(f"错误堆栈: {traceback.format_exc()}")
+            return False
+
+
+async def resume_pending_deliveries():
+    """补发上一次进程退出时推送日志中还没有完成的推送, 作品详情和处理好的图片优先从缓存读取"""
+    if manager.journal is None:
+        return
+    try:
+        pending = manager.journal.load_pending()
+    except OSError as e:
+        sv.logger.error(f"读取推送日志失败: {e}")
+        return
+    if not pending:
+        return
+
+    sv.logger.info(f"推送日志中有 {len(pending)} 条没有完成的推送, 开始补发")
+    bot = nonebot.get_bot()
+    # 按 (群, 画师) 分组, 补发的消息和正常推送的格式相同
+    grouped: Dict[Tuple[str, str], List[Dict]] = {}
+    for entry in pending:
+        grouped.setdefault((entry['group'], entry.get('user_id', '')), []).append(entry)
+
+    for (group_id, user_id), entries in grouped.items():
+        run_id = entries[0]['run']
+        illusts = []
+        for entry in entries:
+            illust = await manager.get_illust_by_id(entry['illust'])
+            if illust:
+                illusts.append(illust)
+            else:
+                # 作品可能已经被删除
+                manager.record_delivery(run_id, entry['illust'], group_id, STATE_FAILED)
+        if illusts:
+            artist_name = entries[0].get('artist_name') or manager.get_artist_name(user_id)
+            await deliver_to_group(bot, group_id, user_id, artist_name, illusts, run_id=run_id)
+
+    manager.flush_journal(compact=True)
+
+
+async def recover_after_restart():
+    """
+    启动后先补发推送日志中没有完成的推送, 再检查距离上一次成功检查的时间,
+    中间有停机时立即补推一次, 不用等到下一次定时检查
+    """
+    if manager.journal is None and not CATCHUP_ON_STARTUP:
+        return
+    # 等待其他插件和OneBot连接就绪
+    await asyncio.sleep(CATCHUP_STARTUP_DELAY_SECONDS)
+    await manager.ensure_started()
+
+    async with manager.check_lock:
+        try:
+            await resume_pending_deliveries()
+        except Exception as e:
+            sv.logger.error(f"补发推送时出错: {e}")
+
+    if not CATCHUP_ON_STARTUP or manager.last_check_time is None:
+        return
+
+    _, is_catchup = manager.get_check_window_hours(datetime.now(timezone.utc))
+    if not is_catchup:
+        return
+
+    sv.logger.info("检测到停机期间错过了定时检查, 开始补推")
+    try:
+        await check_updates()
+    except Exception as e:
+        sv.logger.error(f"停机补推时出错: {e}")
+
 
 # todo 处理多图发送
 @sv.scheduled_job('interval', hours=CHECK_INTERVAL_HOURS)
-async def check_updates():
+async def check_updates() -> bool:
+    """定时检查画师更新, 上一次检查还没有结束时跳过本次检查, 返回是否执行了检查"""
+    if manager.check_lock.locked():
+        sv.logger.warning("上一次画师订阅检查还没有结束, 跳过本次检查")
+        return False
+    async with manager.check_lock:
+        with manager.tracer.run('check_updates'), manager.profile_run('check_updates'):
+            await _check_updates()
+    return True
+
+
+async def _check_updates():
     """
     发送画师订阅的更新作品到对应群组的任务
 
@@ -1085,44 +2259,50 @@ async def check_updates():
     4. user_follow获取到时间窗口内的更新之后, 根据群设置过滤内容, 然后根据群是否订阅该画师和是否推送bot关注画师为条件来决定是否发送消息,
         将发送过的画师ID从映射表中删除
     5. 剩下的画师ID再用画师ID去请求一次, 这样就避免了重复请求和重复发送消息的问题
+    6. 时间窗口从上一次成功检查的时间开始, 机器人停机后的第一次检查会补推停机期间的作品,
+        补推时放慢推送速度, 单个画师作品过多时合并为摘要
+    7. 单独请求的画师各自记录成功检查的时间, 请求失败的画师下次从自己上一次成功的时间开始补推;
+        关注动态请求失败时不推进整轮检查的时间, 下次检查重新覆盖这段时间
     """
     start_time = datetime.now()
 
     bot = nonebot.get_bot()
 
-    # 计算本次检查的时间窗口 - 以当前时间为结束点，向前检查CHECK_INTERVAL_HOURS的小时数
+    # 计算本次检查的时间窗口 - 以当前时间为结束点，向前检查到上一次成功检查的时间
     check_time = datetime.now(timezone.utc)
+    window_hours, is_catchup = manager.get_check_window_hours(check_time)
+    summary_threshold = CATCHUP_SUMMARY_THRESHOLD if is_catchup else 0
+    if is_catchup:
+        sv.logger.info(f"本次检查为停机补推, 回溯 {window_hours:.1f} 小时")
+    run_id = DeliveryJournal.new_run_id()
 
     # 收集所有需要检查的画师ID，并记录画师被哪些群订阅
-    artist_to_groups = {}  # {artist_id: [group_id1, group_id2, ...]}
+    artist_to_groups = collect_artist_groups()
 
-    for group_id, group_data in manager.subscriptions.items():
-        artists = group_data.get('artists', [])
-        for user_id in artists:
-            if user_id not in artist_to_groups:
-                artist_to_groups[user_id] = []
-            artist_to_groups[user_id].append(group_id)
+    # 关注动态中出现的画师以及被完整覆盖的已关注画师, 都视为已经检查到 check_time
+    checked_by_feed = set()
+    feed_failed = False
+
+    # 关注同步模式下, 先让机器人账号的关注列表覆盖所有订阅的画师
+    if ENABLE_FOLLOW_SYNC:
+        with span('sync_following'):
+            await manager.sync_following()
 
     # 处理关注推送 (如果开启)
-    if ENABLE_FOLLOWING_SUBSCRIPTION:
-        groups_enabling_following = {
-            group_id for group_id, setting in manager.subscriptions.items()
-            if setting.get('push_following_enabled', False)
-        }
+    if ENABLE_FOLLOWING_SUBSCRIPTION or ENABLE_FOLLOW_SYNC:
+        groups_enabling_following = collect_following_push_groups()
 
         # 获取关注画师在时间窗口内的新作品
-        followed_illusts = await manager.get_illust_follow(
-            start_time=check_time,
-            interval_hours=CHECK_INTERVAL_HOURS
-        )
+        with span('fetch_illust_follow_window', hours=round(window_hours, 1)):
+            followed_illusts, feed_complete = await manager.fetch_illust_follow_window(
+                start_time=check_time,
+                interval_hours=window_hours
+            )
+        # 窗口的终点是当前时间, 只有请求失败时才会既没有作品又没有覆盖完整
+        feed_failed = not followed_illusts and not feed_complete
 
         # 按画师ID分组作品
-        bot_followed_illusts = {}
-        for illust in followed_illusts:
-            user_id = str(illust['user']['id'])
-            if user_id not in bot_followed_illusts:
-                bot_followed_illusts[user_id] = {'user': illust['user'], 'illusts': []}
-            bot_followed_illusts[user_id]['illusts'].append(illust)
+        bot_followed_illusts = group_illusts_by_artist(followed_illusts)
 
         # 处理并发送关注画师的更新
         for user_id, data in bot_followed_illusts.items():
@@ -1132,41 +2312,142 @@ async def check_updates():
 
             # 计算需要通知的所有群组：订阅了该画师的 + 开启了全局关注推送的
             target_group_ids = set(artist_to_groups.get(user_id, [])) | groups_enabling_following
-
-            await process_and_send_updates(bot, user_id, artist_name, new_illusts, target_group_ids)
+            if target_group_ids:
+                await process_and_send_updates(bot, user_id, artist_name, new_illusts, target_group_ids,
+                                               summary_threshold, run_id)
+                if is_catchup:
+                    await traced_sleep(CATCHUP_PUSH_INTERVAL_SECONDS)
 
             # 从待检查列表中移除，避免重复请求
             if user_id in artist_to_groups:
                 del artist_to_groups[user_id]
+                checked_by_feed.add(user_id)
+
+        # 关注动态完整覆盖了时间窗口时, 已关注画师在动态中没有出现就说明没有更新, 不需要再逐个请求
+        # 集群模式下关注动态只覆盖本实例的群, 画师仍然由持有分片的实例单独请求
+        manager.follow_feed_complete = feed_complete and manager.cluster is None
+        if feed_complete:
+            for user_id in manager.get_follow_covered_artists():
+                if artist_to_groups.pop(user_id, None) is not None:
+                    checked_by_feed.add(user_id)
+
+        if manager.cluster is None:
+            for user_id in checked_by_feed:
+                manager.mark_artist_checked(user_id, check_time)
+
+    if manager.cluster is not None:
+        # 集群模式下单独请求的画师按分片分配, 包含其他实例的群,
+        # 关注动态和单独请求发现的同一个作品通过集群的认领记录去重
+        artist_to_groups = collect_polled_artist_groups()
+
+    # 处理剩下的、未被关注推送覆盖的画师, 错峰模式下由 check_staggered_slice 分散检查
+    failed_count = 0
+    if SWEEP_MODE == 'burst':
+        for user_id, group_ids in artist_to_groups.items():
+            if not await poll_artist(bot, user_id, group_ids, check_time, run_id):
+                failed_count += 1
+    if failed_count:
+        sv.logger.warning(f"本次检查有 {failed_count} 个画师请求失败, 下次检查时从各自上一次成功的时间开始补推")
+
+    # 整轮检查结束才记录, 中途崩溃或停机时下次启动会从上一次成功检查的时间继续
+    # 画师各自的检查时间也在这里随推送状态一起保存
+    if feed_failed:
+        sv.logger.warning("获取关注动态失败, 下次检查重新覆盖本次的时间窗口")
+        manager.save_push_state()
+    else:
+        manager.mark_check_succeeded(check_time)
+    manager.flush_journal(compact=True)
 
-    # 处理剩下的、未被关注推送覆盖的画师
-    for user_id, group_ids in artist_to_groups.items():
-        try:
-            user_info, new_illusts = await manager.get_new_illusts_with_user_info(
-                user_id,
-                start_time=check_time,
-                interval_hours=CHECK_INTERVAL_HOURS
-            )
+    end_time = datetime.now()
+    duration = end_time - start_time
+    sv.logger.info(f"画师订阅检查完成，总耗时: {duration}, 结束时间: {end_time}")
+    sv.logger.info(manager.format_api_cache_stats().replace('\n', '; '))
+    manager.save_api_cache()
 
-            artist_name = user_info.get('name')
-            # 更新缓存的画师名称
-            manager.update_artist_name(user_id, artist_name)
 
-            if not new_illusts:
-                sv.logger.info(f"画师 {user_id} 没有新作品，跳过")
-                await asyncio.sleep(3)
-                continue
+async def check_staggered_slice():
+    """
+    错峰检查: 每个画师按ID的哈希在 CHECK_INTERVAL_HOURS 周期内分到固定的时间点,
+    每隔 STAGGER_SLICE_MINUTES 分钟只检查时间点已经到了的画师,
+    API请求、图片处理和推送都均匀分布在整个周期内, 而不是每个周期集中一次
+    """
+    if manager.check_lock.locked():
+        # 整轮检查或上一个时间片还在进行, 到期的画师留给下一个时间片
+        return
+    async with manager.check_lock:
+        bot = nonebot.get_bot()
+        check_time = datetime.now(timezone.utc)
+        interval_seconds = CHECK_INTERVAL_HOURS * 3600
+
+        artist_to_groups = collect_polled_artist_groups()
+        # 关注动态完整覆盖时, 已关注的画师由 check_updates 通过关注动态检查
+        if manager.follow_feed_complete:
+            for user_id in manager.get_follow_covered_artists():
+                artist_to_groups.pop(user_id, None)
+        if not artist_to_groups:
+            return
 
-            await process_and_send_updates(bot, user_id, artist_name, new_illusts, set(group_ids))
+        due = manager.get_due_artists(artist_to_groups, check_time.timestamp(), interval_seconds)
+        # 正常情况下每个时间片到期的画师数约为 画师数 * 片长 / 周期,
+        # 停机后积压的画师每片最多处理两倍的量, 在之后的时间片中逐渐消化, 不会集中爆发
+        limit = max(1, math.ceil(len(artist_to_groups) * STAGGER_SLICE_MINUTES * 60 / interval_seconds)) * 2
+        if not due:
+            return
 
-            sv.logger.info(f"画师 {user_id} 处理完成，等待3秒...")
-            await asyncio.sleep(3)
-        except Exception as e:
-            sv.logger.error(f"获取画师 {user_id} 更新时出错: {e}")
-            import traceback
-            sv.logger.error(f"错误堆栈: {traceback.format_exc()}")
-            continue
+        run_id = DeliveryJournal.new_run_id('slice')
+        # 只追踪有到期画师的时间片
+        with manager.tracer.run('staggered_slice'), manager.profile_run('staggered_slice'):
+            for user_id in due[:limit]:
+                await poll_artist(bot, user_id, artist_to_groups[user_id], check_time, run_id)
 
-    end_time = datetime.now()
-    duration = end_time - start_time
-    sv.logger.info(f"画师订阅检查完成，总耗时: {duration}, 结束时间: {end_time}")
+        manager.save_push_state()
+        manager.flush_journal()
+        sv.logger.info(f"错峰检查完成, 本次检查 {min(len(due), limit)} 个画师, 剩余到期 {max(len(due) - limit, 0)} 个")
+
+
+if SWEEP_MODE == 'staggered':
+    sv.scheduled_job('interval', minutes=STAGGER_SLICE_MINUTES)(check_staggered_slice)
+
+
+async def sync_cluster():
+    """
+    集群模式的定时同步: 更新心跳并续约分片, 发布本实例的群订阅和设置,
+    刷新所有实例发布的群, 然后发送其他实例转交给本实例的推送
+    """
+    store = manager.cluster
+    try:
+        owned = await manager.api_executor.run(store.heartbeat_and_refresh_leases)
+        # 复制一份再交给线程池序列化, 避免和事件循环中修改订阅的命令同时访问
+        await manager.api_executor.run(store.publish_groups, copy.deepcopy(manager.subscriptions))
+        manager.cluster_groups = await manager.api_executor.run(store.load_groups)
+        # 其他实例所在的群的设置可能已经修改, 下次使用时重新编译tag规则
+        for group_id in list(manager.tag_filters):
+            if group_id not in manager.subscriptions:
+                del manager.tag_filters[group_id]
+        entries = await manager.api_executor.run(store.take_outbox)
+    except sqlite3.Error as e:
+        sv.logger.error(f"同步集群数据库失败: {e}")
+        return
+    sv.logger.debug(f"集群同步完成, 持有分片 {sorted(owned)}, 集群中的群 {len(manager.cluster_groups)} 个")
+    if not entries:
+        return
+
+    bot = nonebot.get_bot()
+    run_id = DeliveryJournal.new_run_id('outbox')
+    # 发件箱中的记录取出后就被删除, 先写入推送日志, 发送前进程退出时重启后可以补发
+    for entry in entries:
+        for illust in entry['illusts']:
+            manager.record_delivery(run_id, illust.get('id'), entry['group_id'], STATE_PENDING,
+                                    user_id=entry['user_id'], artist_name=entry['artist_name'])
+    manager.flush_journal()
+
+    for entry in entries:
+        artist_name = entry['artist_name'] or manager.get_artist_name(entry['user_id'])
+        await deliver_to_group(bot, entry['group_id'], entry['user_id'], artist_name, entry['illusts'],
+                               run_id=run_id)
+    manager.flush_journal()
+    sv.logger.info(f"已发送其他实例转交的推送 {len(entries)} 条")
+
+
+if CLUSTER_ENABLED:
+    sv.scheduled_job('interval', minutes=1)(sync_cluster)
@@ -3,13 +3,15 @@
 import asyncio
 import re
 
+import nonebot
 from hoshino import Service, priv
 from hoshino.typing import CQEvent
 from .pixiv import manager
+from .priority import with_priority, PRIORITY_INTERACTIVE
 from hoshino.config import NICKNAME
-from .utils import send_messages
+from .utils import send_messages, send_to_group
 from hoshino.util import DailyNumberLimiter, FreqLimiter
-from .config import MAX_DISPLAY_WORKS
+from .config import MAX_DISPLAY_WORKS, RANKING_PUSH_HOUR, RANKING_PUSH_MINUTE, RANKING_PUSH_LIMIT
 try:
     from .config import CHAIN_REPLY, RANK_LIMIT, PGET_DAILY_LIMIT, PREVIEW_ILLUSTRATOR_LIMIT, RANK_CD_MINUTES
 except ImportError:
@@ -36,8 +38,26 @@ HELP = '''
 [pixivai排行{r18}] 获取插画AI排行榜
 [pixiv月榜] 获取插画月榜
 [pixiv原画榜] 获取插画原画榜
+[pixiv订阅排行 榜单名] 每天推送榜单中新上榜的作品, 例如 pixiv订阅排行 日榜
+[pixiv取消订阅排行 榜单名] 取消订阅榜单
 '''.strip()
 
+# 可以订阅的榜单 {命令中的榜单名: (排行榜模式, 标题)}
+RANKING_MODES = {
+    '日榜': ('day', '插画日榜'),
+    '日榜r18': ('day_r18', '插画日榜R18'),
+    '男性向排行': ('day_male', '男性向排行榜'),
+    '男性向排行r18': ('day_male_r18', '男性向排行榜R18'),
+    '女性向排行': ('day_female', '女性向排行榜'),
+    '女性向排行r18': ('day_female_r18', '女性向排行榜R18'),
+    'ai排行': ('day_ai', 'AI排行榜'),
+    'ai排行r18': ('day_r18_ai', 'AI排行榜R18'),
+    '周榜': ('week', '插画周榜'),
+    '月榜': ('month', '插画月榜'),
+    '原画榜': ('week_original', '原画榜'),
+}
+RANKING_TITLES = {mode: title for mode, title in RANKING_MODES.values()}
+
 sv = Service(
     'pixiv-tools',
     help_=HELP,
@@ -45,6 +65,7 @@ sv = Service(
 )
 
 
+@with_priority(PRIORITY_INTERACTIVE)
 async def send_ranking(bot, ev: CQEvent, mode: str, title: str):
     """
     Sends ranking images, gets ranking data for the specified mode,
@@ -70,33 +91,38 @@ async def send_ranking(bot, ev: CQEvent, mode: str, title: str):
     # 准备要发送的消息列表
     messages_to_send = []
     for i, illust in enumerate(illusts[:RANK_LIMIT]):
-        rank = i + 1
-        illust_title = illust.get('title', '无标题')
-        artist_name = illust.get('user', {}).get('name', '未知画师')
+        messages_to_send.append(await build_ranking_message(i + 1, illust))
 
-        msg_parts = [
-            f"Top {rank}",
-            f"🎨 作品: {illust_title}",
-            f"🖌️ 画师: {artist_name}",
-        ]
+    await send_messages(bot, ev, messages_to_send)
 
-        # 下载图片并转换为Base64
-        image_url = manager.get_image_urls(illust)
-        if image_url and len(image_url) > 0:
-            b64_data = await manager.download_image_as_base64(image_url[0])
-            if b64_data:
-                msg_parts.append(f"[CQ:image,file=base64://{b64_data}]")
-            else:
-                msg_parts.append("(图片下载失败)")
-        else:
-            msg_parts.append("(未找到图片URL)")
 
-        messages_to_send.append('\n'.join(msg_parts))
+async def build_ranking_message(rank: int, illust: dict) -> str:
+    """构建排行榜中单个作品的消息, 包含名次、标题、画师和第一张图片"""
+    illust_title = illust.get('title', '无标题')
+    artist_name = illust.get('user', {}).get('name', '未知画师')
 
-    await send_messages(bot, ev, messages_to_send)
+    msg_parts = [
+        f"Top {rank}",
+        f"🎨 作品: {illust_title}",
+        f"🖌️ 画师: {artist_name}",
+    ]
+
+    # 下载图片并转换为CQ码
+    image_url = manager.get_image_urls(illust)
+    if image_url and len(image_url) > 0:
+        cq_image = await manager.download_image_as_cq(image_url[0])
+        if cq_image:
+            msg_parts.append(cq_image)
+        else:
+            msg_parts.append("(图片下载失败)")
+    else:
+        msg_parts.append("(未找到图片URL)")
+
+    return '\n'.join(msg_parts)
 
 
 @sv.on_prefix('pixiv预览画师')
+@with_priority(PRIORITY_INTERACTIVE)
 async def get_artist_illusts(bot, ev: CQEvent):
     """
     获取指定画师的最新作品, 增加了群聊发送规则判断.
@@ -148,8 +174,9 @@ async def get_artist_illusts(bot, ev: CQEvent):
             f"画师: {user_info.get('name', '未知')} (ID: {artist_id})"
         ]
         if user_info.get('profile_image_urls') and user_info['profile_image_urls'].get('medium'):
-            profile_image = await manager.download_image_as_base64(user_info['profile_image_urls']['medium'])
-            info.append(f"[CQ:image,file=base64://{profile_image}]")
+            profile_image = await manager.download_image_as_cq(user_info['profile_image_urls']['medium'])
+            if profile_image:
+                info.append(profile_image)
         messages_to_send.append('\n'.join(info))
 
     for illust in allowed_illusts:
@@ -164,9 +191,9 @@ async def get_artist_illusts(bot, ev: CQEvent):
 
         image_url = manager.get_image_urls(illust)
         if image_url:
-            b64_data = await manager.download_image_as_base64(image_url)
-            if b64_data:
-                msg_parts.append(f"[CQ:image,file=base64://{b64_data}]")
+            cq_image = await manager.download_image_as_cq(image_url[0])
+            if cq_image:
+                msg_parts.append(cq_image)
             else:
                 msg_parts.append("(图片下载失败)")
         else:
@@ -235,6 +262,7 @@ async def original_ranking(bot, ev: CQEvent):
 
 
 @sv.on_prefix('pixiv获取插画', 'pget')
+@with_priority(PRIORITY_INTERACTIVE)
 async def fetch_illust(bot, ev: CQEvent):
     """
     根据作品ID获取插画。
@@ -280,9 +308,9 @@ async def fetch_illust(bot, ev: CQEvent):
 
     # 处理动图
     if illust_type == 'ugoira':
-        b64_data = await manager.download_ugoira_as_gif_base64(illust)
-        if b64_data:
-            final_message = f"{text_message}\n[CQ:image,file=base64://{b64_data}]"
+        cq_image = await manager.download_ugoira_as_cq(illust)
+        if cq_image:
+            final_message = f"{text_message}\n{cq_image}"
             await bot.send(ev, final_message)
         else:
             await bot.send(ev, f"{text_message}\n(动图处理失败)")
@@ -298,10 +326,10 @@ async def fetch_illust(bot, ev: CQEvent):
         # 如果图片过多，则使用合并转发
         if page_count > 3:
             messages_to_forward = [text_message]
-            for url in image_urls[:MAX_DISPLAY_WORKS]:
-                b64_data = await manager.download_image_as_base64(url)
-                if b64_data:
-                    messages_to_forward.append(f"[CQ:image,file=base64://{b64_data}]")
+            for url in await manager.get_budgeted_image_urls(illust, MAX_DISPLAY_WORKS):
+                cq_image = await manager.download_image_as_cq(url)
+                if cq_image:
+                    messages_to_forward.append(cq_image)
 
             if len(image_urls) > MAX_DISPLAY_WORKS:
                 messages_to_forward.append(f"该作品共有 {len(image_urls)} 张图片，仅展示前 {MAX_DISPLAY_WORKS} 张。")
@@ -311,12 +339,103 @@ async def fetch_illust(bot, ev: CQEvent):
         # 否则，合并为一条消息发送
         else:
             message_parts = []
-            for url in image_urls:
-                b64_data = await manager.download_image_as_base64(url)
-                if b64_data:
-                    message_parts.append(f"[CQ:image,file=base64://{b64_data}]")
+            for url in await manager.get_budgeted_image_urls(illust, page_count):
+                cq_image = await manager.download_image_as_cq(url)
+                if cq_image:
+                    message_parts.append(cq_image)
 
             final_message = '\n'.join(message_parts)
             await bot.send(ev, final_message)
     pget_daily_time_limiter.increase(ev.user_id)
-    return None
\ No newline at end of file
+    return None
+
+
+@sv.on_prefix('pixiv订阅排行')
+async def subscribe_ranking(bot, ev: CQEvent):
+    """订阅榜单, 每天推送新上榜的作品 (仅管理员)"""
+    group_id = str(ev.group_id)
+    name = ev.message.extract_plain_text().strip().lower()
+    if not name:
+        subscribed = [title for mode, title in RANKING_TITLES.items()
+                      if mode in manager.get_ranking_subscriptions(group_id)]
+        return await bot.send(ev, f"可以订阅的榜单: {', '.join(RANKING_MODES)}\n"
+                                  f"本群已订阅: {', '.join(subscribed) or '无'}")
+
+    if not priv.check_priv(ev, priv.ADMIN):
+        return await bot.send(ev, "只有群主或管理员才能订阅排行榜")
+    if name not in RANKING_MODES:
+        return await bot.send(ev, f"没有这个榜单, 可以订阅的榜单: {', '.join(RANKING_MODES)}")
+
+    mode, title = RANKING_MODES[name]
+    if 'r18' in mode and not manager.is_r18_enabled(group_id):
+        return await bot.send(ev, "❌ 本群不允许查看R18内容的排行榜~")
+
+    if manager.add_ranking_subscription(group_id, mode):
+        await bot.send(ev, f"✅ 已订阅{title}, 每天 {RANKING_PUSH_HOUR:02d}:{RANKING_PUSH_MINUTE:02d} "
+                           f"推送前 {RANKING_PUSH_LIMIT} 名中新上榜的作品")
+    else:
+        await bot.send(ev, f"本群已经订阅了{title}")
+
+
+@sv.on_prefix('pixiv取消订阅排行')
+async def unsubscribe_ranking(bot, ev: CQEvent):
+    """取消订阅榜单 (仅管理员)"""
+    if not priv.check_priv(ev, priv.ADMIN):
+        return await bot.send(ev, "只有群主或管理员才能取消订阅排行榜")
+
+    name = ev.message.extract_plain_text().strip().lower()
+    if name not in RANKING_MODES:
+        return await bot.send(ev, f"没有这个榜单, 可以订阅的榜单: {', '.join(RANKING_MODES)}")
+
+    mode, title = RANKING_MODES[name]
+    if manager.remove_ranking_subscription(str(ev.group_id), mode):
+        await bot.send(ev, f"✅ 已取消订阅{title}")
+    else:
+        await bot.send(ev, f"本群没有订阅{title}")
+
+
+@sv.scheduled_job('cron', hour=RANKING_PUSH_HOUR, minute=RANKING_PUSH_MINUTE)
+async def push_ranking_updates():
+    """
+    每天推送各群订阅的榜单中新上榜的作品。
+    每个榜单只请求一次并和上一次的快照比较, 只有新上榜的作品需要下载图片, 同一个作品在多个群中只处理一次
+    """
+    subscribers = manager.get_ranking_subscribers()
+    if not subscribers:
+        return
+
+    bot = nonebot.get_bot()
+    for mode, group_ids in subscribers.items():
+        # R18榜单只推送给开启了R18的群
+        group_ids = [
+            group_id for group_id in group_ids
+            if sv.check_enabled(int(group_id)) and ('r18' not in mode or manager.is_r18_enabled(group_id))
+        ]
+        if not group_ids:
+            continue
+
+        illusts = await manager.get_ranking(mode)
+        if not illusts:
+            continue
+        new_entries = manager.diff_ranking(mode, illusts, RANKING_PUSH_LIMIT)
+        if not new_entries:
+            sv.logger.info(f"排行榜 {mode} 没有新上榜的作品")
+            continue
+
+        title = RANKING_TITLES.get(mode, mode)
+        rendered = {}  # {作品ID: 消息}
+        for group_id in group_ids:
+            entries = [(rank, illust) for rank, illust in new_entries if manager.is_illust_allowed(illust, group_id)]
+            if not entries:
+                continue
+            messages = [f"📈 {title} 今日新上榜 {len(entries)} 个作品"]
+            for rank, illust in entries:
+                illust_id = str(illust.get('id'))
+                if illust_id not in rendered:
+                    rendered[illust_id] = await build_ranking_message(rank, illust)
+                messages.append(rendered[illust_id])
+            try:
+                await send_to_group(bot, group_id, messages)
+            except Exception as e:
+                sv.logger.error(f"向群 {group_id} 推送排行榜 {mode} 时出错: {e}")
+        sv.logger.info(f"排行榜 {mode} 新上榜 {len(new_entries)} 个作品, 推送给 {len(group_ids)} 个群")
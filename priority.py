@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+请求优先级: 用户命令 > 订阅推送 > 后台任务 (名字刷新等)。
+当前优先级保存在 contextvar 中, 命令处理函数用 with_priority 设置, 其中的API请求和下载以及创建的任务都会继承;
+API速率控制、API并发预算和下载并发限制都按优先级放行, 用户命令可以插队到排队中的后台请求前面
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+from functools import wraps
+from typing import List, Optional, Tuple
+
+# 数字越小优先级越高
+PRIORITY_INTERACTIVE = 0  # 用户命令
+PRIORITY_PUSH = 1  # 订阅推送
+PRIORITY_BACKGROUND = 2  # 名字刷新等后台任务
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: '命令',
+    PRIORITY_PUSH: '推送',
+    PRIORITY_BACKGROUND: '后台',
+}
+
+current_priority: contextvars.ContextVar = contextvars.ContextVar('pixiv_priority', default=PRIORITY_PUSH)
+
+
+def with_priority(priority: int):
+    """装饰器: 以指定的优先级运行协程函数"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = current_priority.set(priority)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                current_priority.reset(token)
+        return wrapper
+    return decorator
+
+
+class PriorityWaitQueue:
+    """按 (优先级, 到达顺序) 排列的等待队列, 同一优先级内先到先得"""
+
+    def __init__(self):
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def push(self, priority: int) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._counter), future))
+        return future
+
+    def pop(self) -> Optional[asyncio.Future]:
+        """取出优先级最高的、还在等待的调用方, 没有时返回 None; 已经取消的调用方直接丢弃"""
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                return future
+        return None
+
+    def counts(self) -> dict:
+        """各优先级正在等待的数量"""
+        counts = {}
+        for priority, _, future in self._heap:
+            if not future.done():
+                counts[priority] = counts.get(priority, 0) + 1
+        return counts
+
+    def __bool__(self) -> bool:
+        return any(not future.done() for _, _, future in self._heap)
+
+
+class PrioritySemaphore:
+    """
+    按优先级唤醒等待者的信号量, 用法和 asyncio.Semaphore 相同 (async with)。
+    有空位时直接进入, 没有空位时按当前 contextvar 中的优先级排队
+    """
+
+    def __init__(self, value: int):
+        self._value = max(value, 1)
+        self._waiters = PriorityWaitQueue()
+
+    async def acquire(self) -> None:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = self._waiters.push(current_priority.get())
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已经被唤醒但调用方被取消时, 把名额交给下一个等待者
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        waiter = self._waiters.pop()
+        if waiter is not None:
+            # 名额直接交给等待者, _value 不变
+            waiter.set_result(None)
+        else:
+            self._value += 1
+
+    def waiting(self) -> dict:
+        return self._waiters.counts()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def format_waiting(counts: dict) -> str:
+    """把各优先级的等待数量格式化为文本"""
+    if not counts:
+        return "无"
+    return ', '.join(f"{PRIORITY_NAMES.get(p, p)} {n}" for p, n in sorted(counts.items()))
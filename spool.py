@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+图片暂存目录: 把处理好的图片写入本地文件, 让OneBot实现通过 file:/// 或本地HTTP地址读取,
+避免把几MB的 base64 字符串在消息构造、合并转发和 websocket 之间来回复制。
+"""
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+
+
+def guess_image_suffix(data: bytes) -> str:
+    """根据文件头判断图片格式, 返回文件后缀"""
+    if data.startswith(b'\xff\xd8'):
+        return '.jpg'
+    if data.startswith(b'\x89PNG'):
+        return '.png'
+    if data.startswith(b'GIF8'):
+        return '.gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    return '.img'
+
+
+class ImageSpool:
+    """
+    图片暂存目录
+    - mode='file': 返回 file:/// 地址, 适用于OneBot实现和机器人在同一台机器上的情况
+    - mode='http': 在本地启动一个只提供静态文件的HTTP服务, 返回 http 地址
+    """
+
+    def __init__(self, spool_dir: str, mode: str = 'file', http_host: str = '127.0.0.1',
+                 http_port: int = 8765, public_url: Optional[str] = None):
+        self.spool_dir = spool_dir
+        self.mode = mode
+        self.http_host = http_host
+        self.http_port = http_port
+        self.public_url = (public_url or f"http://{http_host}:{http_port}").rstrip('/')
+        self._runner: Optional[web.AppRunner] = None
+
+    def write(self, data: bytes) -> str:
+        """把图片写入暂存目录, 文件名使用内容的哈希, 相同内容只会写入一次, 返回文件路径"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        name = hashlib.sha1(data).hexdigest() + guess_image_suffix(data)
+        path = os.path.join(self.spool_dir, name)
+        if os.path.exists(path):
+            # 更新修改时间, 避免正在使用的文件被清理
+            os.utime(path)
+            return path
+
+        # 先写临时文件再重命名, 避免OneBot读到写了一半的文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    async def start_http_server(self) -> None:
+        """启动本地静态文件HTTP服务, 已经启动时直接返回"""
+        if self._runner is not None:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        app = web.Application()
+        app.router.add_static('/', self.spool_dir)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.http_host, self.http_port).start()
+        except Exception:
+            await runner.cleanup()
+            raise
+        self._runner = runner
+
+    async def stop_http_server(self) -> None:
+        """关闭本地HTTP服务"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def to_file_uri(self, path: str) -> str:
+        """返回 write 写入的图片OneBot可以读取的地址, write 会读写磁盘, 需要调用方在线程池中执行"""
+        if self.mode == 'http':
+            await self.start_http_server()
+            return f"{self.public_url}/{os.path.basename(path)}"
+        return Path(path).resolve().as_uri()
+
+    def cleanup(self, max_age_hours: float) -> int:
+        """删除超过 max_age_hours 没有被使用的文件, 返回删除的文件数量"""
+        if not os.path.isdir(self.spool_dir):
+            return 0
+        expire_before = time.time() - max_age_hours * 3600
+        removed = 0
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if os.path.isfile(path) and os.path.getmtime(path) < expire_before:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                # 文件可能正在被其他进程删除或读取, 下次再清理
+                continue
+        return removed
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+群的tag规则, 不依赖 hoshino 和插件配置
+- 普通规则和tag完全相同 (不区分大小写) 时匹配, 规则中的 * 和 ? 也只是普通字符, 所有这类规则放在一个集合中, 每个tag查一次
+- 以 `glob:` 开头的规则为通配符规则: * 匹配任意多个字符, ? 匹配一个字符, \\* 和 \\? 匹配字符本身,
+  例如 `glob:*水着*` 匹配包含"水着"的tag, `glob:R-18*` 匹配以"R-18"开头的tag;
+  所有通配符规则编译成一个正则表达式, 对换行连接的全部tag搜索一次
+  通配符规则需要前缀, 是为了让添加通配符支持之前保存的、本身含有 * 或 ? 的规则保持完全匹配的含义
+规则在群设置修改时编译一次, 检查作品时的开销和规则数量基本无关
+"""
+import re
+from typing import FrozenSet, Iterable, List, Optional, Pattern, Tuple
+
+WILDCARD_PREFIX = 'glob:'
+
+
+def is_wildcard_rule(rule: str) -> bool:
+    return rule.strip().lower().startswith(WILDCARD_PREFIX)
+
+
+def wildcard_to_regex(pattern: str) -> str:
+    """把通配符 (不含前缀) 转换为正则表达式, tag之间以换行分隔, 通配符不能跨过换行匹配到其他tag"""
+    parts = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            parts.append(re.escape(char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '*':
+            parts.append('[^\n]*')
+        elif char == '?':
+            parts.append('[^\n]')
+        else:
+            parts.append(re.escape(char))
+    if escaped:
+        # 末尾单独的反斜杠按普通字符处理
+        parts.append(re.escape('\\'))
+    return ''.join(parts)
+
+
+def compile_rules(rules: Iterable[str]) -> Tuple[FrozenSet[str], Optional[Pattern]]:
+    """把规则编译为 (完全匹配的tag集合, 通配符规则合并的正则表达式), 没有通配符规则时正则为 None"""
+    exact = set()
+    patterns = set()
+    for rule in rules:
+        rule = rule.strip().lower()
+        if not rule:
+            continue
+        if not is_wildcard_rule(rule):
+            exact.add(rule)
+            continue
+        pattern = rule[len(WILDCARD_PREFIX):].strip()
+        if pattern:
+            patterns.add(wildcard_to_regex(pattern))
+    pattern = re.compile('^(?:' + '|'.join(sorted(patterns)) + ')$', re.MULTILINE) if patterns else None
+    return frozenset(exact), pattern
+
+
+class TagFilter:
+    """
+    一个群编译好的tag规则
+    :param blocked: 屏蔽规则, 作品的任意一个tag匹配时不推送
+    :param allowed: 允许规则, 不为空时作品至少要有一个tag匹配才推送 (白名单模式), 屏蔽规则优先
+    """
+
+    def __init__(self, blocked: Iterable[str] = (), allowed: Iterable[str] = ()):
+        self._blocked_exact, self._blocked_pattern = compile_rules(blocked)
+        self._allowed_exact, self._allowed_pattern = compile_rules(allowed)
+        self.has_allow_rules = bool(self._allowed_exact) or self._allowed_pattern is not None
+
+    def __bool__(self) -> bool:
+        return bool(self._blocked_exact) or self._blocked_pattern is not None or self.has_allow_rules
+
+    @staticmethod
+    def _matches(exact: FrozenSet[str], pattern: Optional[Pattern], tags: List[str]) -> bool:
+        if exact and not exact.isdisjoint(tags):
+            return True
+        return pattern is not None and pattern.search('\n'.join(tags)) is not None
+
+    def allows(self, tags: List[str]) -> bool:
+        """
+        检查作品是否符合规则
+        :param tags: 作品的全部tag和翻译后的tag, 已经转为小写
+        """
+        if self._matches(self._blocked_exact, self._blocked_pattern, tags):
+            return False
+        if self.has_allow_rules:
+            return self._matches(self._allowed_exact, self._allowed_pattern, tags)
+        return True
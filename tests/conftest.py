@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+插件目录作为 pixiv_subscription 包导入, 插件内部的相对导入 (from .priority import ...) 可以正常使用。
+只测试不依赖 hoshino 的模块, 运行: python -m pytest -q tests
+"""
+import os
+import sys
+import types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'pixiv_subscription' not in sys.modules:
+    package = types.ModuleType('pixiv_subscription')
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules['pixiv_subscription'] = package
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+
+from pixiv_subscription.cluster import ClusterStore, artist_shard
+
+
+def make_stores(tmp_path, count=2, shard_count=8):
+    path = str(tmp_path / 'cluster.db')
+    return [ClusterStore(path, f'instance-{i}', shard_count=shard_count, lease_seconds=60) for i in range(count)]
+
+
+def test_each_delivery_is_claimed_once(tmp_path):
+    first, second = make_stores(tmp_path)
+    pairs = [(str(illust_id), 'g1') for illust_id in range(10)]
+    claimed_first = first.claim_deliveries(pairs[:6])
+    claimed_second = second.claim_deliveries(pairs[4:])
+    assert claimed_first == set(pairs[:6])
+    assert claimed_second == set(pairs[6:])
+    assert first.claim_deliveries(pairs) == set()
+
+
+def test_concurrent_claims_are_exclusive(tmp_path):
+    stores = make_stores(tmp_path, count=4)
+    pairs = [(str(illust_id), str(group_id)) for illust_id in range(50) for group_id in range(3)]
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda store: store.claim_deliveries(pairs), stores))
+    claimed = [pair for result in results for pair in result]
+    assert sorted(claimed) == sorted(pairs)
+
+
+def test_shards_are_split_between_instances(tmp_path):
+    first, second = make_stores(tmp_path)
+    assert len(first.heartbeat_and_refresh_leases()) == 8
+    second.heartbeat_and_refresh_leases()
+    # 第一个实例续约时释放超出公平份额的分片, 由第二个实例领取
+    first.heartbeat_and_refresh_leases()
+    second.heartbeat_and_refresh_leases()
+    assert len(first.owned_shards) == len(second.owned_shards) == 4
+    assert first.owned_shards.isdisjoint(second.owned_shards)
+    user_id = '12345'
+    assert first.owns_artist(user_id) != second.owns_artist(user_id)
+    assert artist_shard(user_id, 8) in first.owned_shards | second.owned_shards
+
+
+def test_outbox_is_delivered_to_owner_once(tmp_path):
+    first, second = make_stores(tmp_path)
+    first.enqueue('instance-1', 'g1', '9', 'artist', [{'id': 1}])
+    assert first.take_outbox() == []
+    entries = second.take_outbox()
+    assert entries == [{'group_id': 'g1', 'user_id': '9', 'artist_name': 'artist', 'illusts': [{'id': 1}]}]
+    assert second.take_outbox() == []
+
+
+def test_lowest_instance_id_owns_shared_group(tmp_path):
+    first, second = make_stores(tmp_path)
+    second.publish_groups({'g1': {'r18_enabled': True}})
+    first.publish_groups({'g1': {'r18_enabled': False}, 'g2': {}})
+    groups = first.load_groups()
+    assert groups['g1'] == ('instance-0', {'r18_enabled': False})
+    assert groups['g2'][0] == 'instance-0'
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+import asyncio
+
+from pixiv_subscription.follow_sync import FollowSync, is_api_success
+
+
+class FakeFollowApi:
+    """模拟 pixivpy3 3.7.5 的 AppPixivAPI: 关注/取关成功时返回空的 JsonDict, 失败时返回包含 error 的字典"""
+
+    def __init__(self, fail_ids=(), rate_limited_ids=()):
+        self.fail_ids = set(fail_ids)
+        self.rate_limited_ids = set(rate_limited_ids)
+        self.calls = []
+
+    async def __call__(self, api_method, user_id):
+        self.calls.append((api_method, user_id))
+        if user_id in self.rate_limited_ids:
+            return {'error': {'message': 'Rate Limit'}}
+        if user_id in self.fail_ids:
+            return {'error': {'user_message': 'failed'}}
+        return {}
+
+
+def is_rate_limited(result):
+    return isinstance(result, dict) and 'rate limit' in str(result.get('error', '')).lower()
+
+
+def test_is_api_success():
+    assert is_api_success({})
+    assert not is_api_success({'error': {'message': 'x'}})
+    assert not is_api_success(None)
+    assert not is_api_success(ValueError('x'))
+
+
+def test_apply_records_successful_follows_and_unfollows():
+    sync = FollowSync({'1', '9'}, {'9'})
+    sync.reconcile({'1', '9'})
+    api = FakeFollowApi()
+    followed, unfollowed, failures = asyncio.run(sync.apply(api, {'1', '2', '3'}, batch_size=10))
+    assert (followed, unfollowed, failures) == (2, 1, [])
+    assert sync.following == {'1', '2', '3'}
+    assert sync.managed == {'2', '3'}
+    # 状态已经记录, 再次同步时不会重复请求
+    assert sync.plan({'1', '2', '3'}) == ([], [])
+    assert asyncio.run(sync.apply(api, {'1', '2', '3'}, batch_size=10)) == (0, 0, [])
+    assert len(api.calls) == 3
+
+
+def test_apply_respects_batch_size_and_failures():
+    sync = FollowSync(set(), ())
+    sync.reconcile(set())
+    api = FakeFollowApi(fail_ids={'2'})
+    followed, _, failures = asyncio.run(sync.apply(api, {'1', '2', '3', '4'}, batch_size=3))
+    assert followed == 2
+    assert [user_id for _, user_id, _ in failures] == ['2']
+    assert sync.following == {'1', '3'}
+    assert sync.plan({'1', '2', '3', '4'}) == (['2', '4'], [])
+
+
+def test_apply_stops_when_rate_limited():
+    sync = FollowSync(set(), ())
+    sync.reconcile(set())
+    api = FakeFollowApi(rate_limited_ids={'2'})
+    asyncio.run(sync.apply(api, {'1', '2', '3'}, batch_size=10, is_rate_limited=is_rate_limited))
+    assert api.calls == [('user_follow_add', '1'), ('user_follow_add', '2')]
+
+
+def test_covered_requires_reconcile():
+    sync = FollowSync({'1', '2'}, {'2'})
+    # 从文件加载的关注列表没有核对过, 不能用来跳过单独检查
+    assert sync.covered() == set()
+    removed = sync.reconcile({'1'})
+    assert removed == {'2'}
+    assert sync.covered() == {'1'}
+    assert sync.managed == set()
+    sync.invalidate()
+    assert sync.covered() == set()
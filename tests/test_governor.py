@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from pixiv_subscription.governor import AimdGovernor, is_rate_limited
+from pixiv_subscription.priority import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, with_priority
+
+
+def test_additive_increase_is_capped():
+    governor = AimdGovernor(initial_rate=1.0, min_rate=0.2, max_rate=1.2, increase=0.1)
+    governor.on_success()
+    assert governor.rate == pytest.approx(1.1)
+    for _ in range(10):
+        governor.on_success()
+    assert governor.rate == pytest.approx(1.2)
+
+
+def test_multiplicative_decrease_respects_cooldown_and_floor():
+    governor = AimdGovernor(initial_rate=4.0, min_rate=0.5, max_rate=5.0, decrease=0.5, cooldown=60)
+    governor.on_throttled()
+    assert governor.rate == pytest.approx(2.0)
+    # 冷却期内的限流是降速之前发出的请求, 不重复降速
+    governor.on_throttled()
+    assert governor.rate == pytest.approx(2.0)
+    assert governor.throttled == 2
+
+    governor = AimdGovernor(initial_rate=1.0, min_rate=0.5, max_rate=5.0, decrease=0.1, cooldown=0)
+    governor.on_throttled()
+    governor.on_throttled()
+    assert governor.rate == pytest.approx(0.5)
+
+
+def test_acquire_paces_calls_at_rate():
+    async def main():
+        governor = AimdGovernor(initial_rate=20.0, min_rate=1.0, max_rate=20.0)
+        start = time.monotonic()
+        for _ in range(5):
+            await governor.acquire()
+        return time.monotonic() - start
+
+    # 第一次立即放行, 之后每次间隔 1/20 秒
+    assert asyncio.run(main()) >= 4 / 20 * 0.9
+
+
+def test_waiters_are_released_by_priority():
+    async def main():
+        governor = AimdGovernor(initial_rate=50.0, min_rate=1.0, max_rate=50.0)
+        order = []
+
+        async def call(name):
+            await governor.acquire()
+            order.append(name)
+
+        await governor.acquire()
+        tasks = [asyncio.ensure_future(with_priority(PRIORITY_BACKGROUND)(call)(f'bg{i}')) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(with_priority(PRIORITY_INTERACTIVE)(call)('cmd')))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ['cmd', 'bg0', 'bg1', 'bg2']
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.response = type('Response', (), {'status_code': status_code})()
+
+
+def test_rate_limit_is_classified_by_status_and_message():
+    assert is_rate_limited({'error': {'message': 'Rate Limit', 'reason': '', 'user_message': ''}})
+    assert is_rate_limited({'error': 'Too Many Requests'})
+    assert is_rate_limited(FakeHTTPError('error', 429))
+    assert is_rate_limited(Exception('{"error": {"message": "Rate Limit"}}'))
+    assert not is_rate_limited({'error': None, 'illusts': []})
+    assert not is_rate_limited(None)
+
+
+def test_digits_in_ids_and_urls_are_not_rate_limits():
+    assert not is_rate_limited({'error': {'message': 'Artist 1429403 not found', 'reason': ''}})
+    assert not is_rate_limited(Exception('https://i.pximg.net/img-original/img/403/12942900_p0.png'))
+    assert not is_rate_limited(FakeHTTPError('Forbidden', 403))
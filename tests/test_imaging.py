@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+import io
+import zipfile
+
+from PIL import Image, ImageSequence
+
+from pixiv_subscription.imaging import add_ugoira_noise, render_ugoira
+
+
+def make_zip(frames: int = 4, size: int = 32) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zip_file:
+        for i in range(frames):
+            frame = Image.new('RGB', (size, size), (i * 40, 100, 200 - i * 40))
+            frame_buf = io.BytesIO()
+            frame.save(frame_buf, format='PNG')
+            zip_file.writestr(f'{i:06d}.png', frame_buf.getvalue())
+    return buf.getvalue()
+
+
+def frame_count(data: bytes) -> int:
+    return sum(1 for _ in ImageSequence.Iterator(Image.open(io.BytesIO(data))))
+
+
+def test_gif_noise_only_changes_one_palette_byte():
+    data = render_ugoira(make_zip(), [{'delay': 50}] * 4, 'GIF')
+    noised = add_ugoira_noise(data)
+    assert len(noised) == len(data)
+    assert sum(a != b for a, b in zip(data, noised)) == 1
+    assert frame_count(noised) == frame_count(data)
+
+
+def test_webp_noise_keeps_animation():
+    data = render_ugoira(make_zip(), [{'delay': 50}] * 4, 'WEBP')
+    noised = add_ugoira_noise(data)
+    assert noised != data
+    assert frame_count(noised) == frame_count(data)
+
+
+def test_static_fallback_is_noised_as_still_image():
+    buf = io.BytesIO()
+    Image.new('RGB', (16, 16), (10, 20, 30)).save(buf, format='PNG')
+    noised = add_ugoira_noise(buf.getvalue())
+    assert noised != buf.getvalue()
+    assert Image.open(io.BytesIO(noised)).format == 'PNG'
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+from pixiv_subscription.journal import DeliveryJournal, STATE_FAILED, STATE_PENDING, STATE_SENT
+
+
+def test_load_pending_uses_last_state(tmp_path):
+    journal = DeliveryJournal(str(tmp_path / 'journal.jsonl'), fsync_batch=100)
+    journal.record('run-1', 1, 'g1', STATE_PENDING, user_id='9')
+    journal.record('run-1', 2, 'g1', STATE_PENDING)
+    journal.record('run-1', 3, 'g2', STATE_PENDING)
+    journal.record('run-1', 1, 'g1', STATE_SENT)
+    journal.record('run-1', 3, 'g2', STATE_FAILED)
+    # load_pending 会先写入缓冲区中的记录
+    pending = journal.load_pending()
+    assert [(entry['illust'], entry['group']) for entry in pending] == [('2', 'g1')]
+
+
+def test_load_pending_skips_torn_lines(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = DeliveryJournal(str(path))
+    journal.record('run-1', 1, 'g1', STATE_PENDING, user_id='9')
+    journal.flush()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"run": "run-1", "illust": "1", "gr')
+    pending = DeliveryJournal(str(path)).load_pending()
+    assert len(pending) == 1
+    assert pending[0]['user_id'] == '9'
+
+
+def test_compact_keeps_only_pending(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = DeliveryJournal(str(path))
+    for illust_id in range(5):
+        journal.record('run-1', illust_id, 'g1', STATE_PENDING)
+    for illust_id in range(3):
+        journal.record('run-1', illust_id, 'g1', STATE_SENT)
+    assert journal.compact() == 2
+    with open(path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 2
+    assert sorted(entry['illust'] for entry in DeliveryJournal(str(path)).load_pending()) == ['3', '4']
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+import asyncio
+
+import pytest
+
+from pixiv_subscription.cache import single_flight
+from pixiv_subscription.priority import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PrioritySemaphore, \
+    current_priority, with_priority
+
+
+async def hold(semaphore, order, name, release):
+    async with semaphore:
+        order.append(name)
+        await release.wait()
+
+
+def test_semaphore_wakes_higher_priority_first():
+    async def main():
+        semaphore = PrioritySemaphore(1)
+        release = asyncio.Event()
+        order = []
+        holder = asyncio.ensure_future(hold(semaphore, order, 'holder', release))
+        await asyncio.sleep(0)
+        background = [
+            asyncio.ensure_future(with_priority(PRIORITY_BACKGROUND)(hold)(semaphore, order, f'bg{i}', release))
+            for i in range(2)
+        ]
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(with_priority(PRIORITY_INTERACTIVE)(hold)(semaphore, order, 'cmd', release))
+        await asyncio.sleep(0)
+        assert semaphore.waiting() == {PRIORITY_INTERACTIVE: 1, PRIORITY_BACKGROUND: 2}
+        release.set()
+        await asyncio.gather(holder, interactive, *background)
+        assert order == ['holder', 'cmd', 'bg0', 'bg1']
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def main():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+        waiter = asyncio.ensure_future(semaphore.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        semaphore.release()
+        # 名额回到信号量, 下一个调用方可以直接进入
+        await asyncio.wait_for(semaphore.acquire(), timeout=1)
+        semaphore.release()
+        assert semaphore.waiting() == {}
+
+    asyncio.run(main())
+
+
+def test_waiter_cancelled_after_wakeup_passes_slot_on():
+    async def main():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+        first = asyncio.ensure_future(semaphore.acquire())
+        second = asyncio.ensure_future(semaphore.acquire())
+        await asyncio.sleep(0)
+        # release 把名额交给 first, first 在恢复执行之前被取消, 名额应当继续交给 second
+        semaphore.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(second, timeout=1)
+        semaphore.release()
+        await asyncio.wait_for(semaphore.acquire(), timeout=1)
+
+    asyncio.run(main())
+
+
+class PriorityRecorder:
+    def __init__(self):
+        self.inflight_requests = {}
+        self.priorities = []
+        self.release = asyncio.Event()
+
+    @single_flight(lambda key: key)
+    async def fetch(self, key):
+        self.priorities.append(current_priority.get())
+        await self.release.wait()
+        return key
+
+
+def test_single_flight_does_not_demote_higher_priority_callers():
+    async def main():
+        client = PriorityRecorder()
+        background = asyncio.ensure_future(with_priority(PRIORITY_BACKGROUND)(client.fetch)('a'))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(with_priority(PRIORITY_INTERACTIVE)(client.fetch)('a'))
+        await asyncio.sleep(0)
+        # 之后的后台调用方加入优先级更高的请求
+        late = asyncio.ensure_future(with_priority(PRIORITY_BACKGROUND)(client.fetch)('a'))
+        await asyncio.sleep(0)
+        client.release.set()
+        assert await asyncio.gather(background, interactive, late) == ['a', 'a', 'a']
+        assert client.priorities == [PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE]
+        assert client.inflight_requests == {}
+
+    asyncio.run(main())
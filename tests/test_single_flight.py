@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+import asyncio
+
+import pytest
+
+from pixiv_subscription.cache import single_flight
+
+
+class FakeClient:
+    def __init__(self):
+        self.inflight_requests = {}
+        self.calls = 0
+        self.release = None
+
+    @single_flight(lambda key: key)
+    async def fetch(self, key):
+        self.calls += 1
+        await self.release.wait()
+        return f"result-{key}"
+
+
+def test_concurrent_calls_share_one_request():
+    async def main():
+        client = FakeClient()
+        client.release = asyncio.Event()
+        tasks = [asyncio.ensure_future(client.fetch('a')) for _ in range(5)]
+        other = asyncio.ensure_future(client.fetch('b'))
+        await asyncio.sleep(0)
+        client.release.set()
+        results = await asyncio.gather(*tasks, other)
+        assert results == ['result-a'] * 5 + ['result-b']
+        assert client.calls == 2
+        # 完成后立即移除, 下一次调用重新请求
+        assert client.inflight_requests == {}
+        await client.fetch('a')
+        assert client.calls == 3
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_shared_request():
+    async def main():
+        client = FakeClient()
+        client.release = asyncio.Event()
+        first = asyncio.ensure_future(client.fetch('a'))
+        second = asyncio.ensure_future(client.fetch('a'))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        client.release.set()
+        assert await second == 'result-a'
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert client.calls == 1
+
+    asyncio.run(main())
+
+
+def test_exception_is_shared_and_not_cached():
+    class FailingClient(FakeClient):
+        @single_flight(lambda key: key)
+        async def fetch(self, key):
+            self.calls += 1
+            await asyncio.sleep(0)
+            raise ValueError(key)
+
+    async def main():
+        client = FailingClient()
+        results = await asyncio.gather(client.fetch('a'), client.fetch('a'), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert client.calls == 1
+        with pytest.raises(ValueError):
+            await client.fetch('a')
+        assert client.calls == 2
+
+    asyncio.run(main())
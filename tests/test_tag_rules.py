@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+from pixiv_subscription.illust_helpers import is_illust_allowed
+from pixiv_subscription.tag_rules import TagFilter, compile_rules
+
+
+def test_exact_rules_ignore_case():
+    tag_filter = TagFilter(['R-18', ' 水着 '])
+    assert not tag_filter.allows(['r-18'])
+    assert not tag_filter.allows(['风景', '水着'])
+    assert tag_filter.allows(['夏の水着'])
+
+
+def test_rules_without_prefix_keep_exact_meaning():
+    # 添加通配符支持之前保存的规则, 其中的 * 和 ? 仍然是普通字符
+    tag_filter = TagFilter(['?', '*'])
+    assert tag_filter.allows(['a', 'bc'])
+    assert not tag_filter.allows(['?'])
+    assert not tag_filter.allows(['*'])
+    assert compile_rules(['?', '*']) == (frozenset({'?', '*'}), None)
+
+
+def test_wildcard_rules():
+    tag_filter = TagFilter(['glob:*水着*', 'GLOB:ab?', 'glob:R-18*'])
+    assert not tag_filter.allows(['夏の水着です'])
+    assert not tag_filter.allows(['abc'])
+    assert not tag_filter.allows(['r-18g'])
+    assert tag_filter.allows(['abcd', 'ab', 'xr-18'])
+
+
+def test_wildcards_do_not_cross_tags():
+    tag_filter = TagFilter(['glob:a*b'])
+    assert tag_filter.allows(['a', 'b'])
+    assert not tag_filter.allows(['x', 'a-b'])
+
+
+def test_escaped_wildcards_match_literally():
+    tag_filter = TagFilter(['glob:\\*\\?*'])
+    assert not tag_filter.allows(['*?abc'])
+    assert tag_filter.allows(['xyabc'])
+
+
+def test_allow_list_and_block_precedence():
+    tag_filter = TagFilter(['glob:*r18*'], ['glob:*風景*', 'cat'])
+    assert tag_filter.has_allow_rules
+    assert tag_filter.allows(['風景画'])
+    assert tag_filter.allows(['cat'])
+    assert not tag_filter.allows(['人物'])
+    assert not tag_filter.allows(['風景', 'r18g'])
+
+
+def test_empty_filter_is_falsy():
+    assert not TagFilter()
+    assert not TagFilter(['', '  ', 'glob:'])
+    assert TagFilter(allowed=['x'])
+
+
+def test_is_illust_allowed_uses_filter():
+    illust = {'x_restrict': 0, 'tags': [{'name': 'Original', 'translated_name': '原创'}]}
+    assert is_illust_allowed(illust, False, TagFilter(['glob:orig*'])) is False
+    assert is_illust_allowed(illust, False, TagFilter(['原创'])) is False
+    assert is_illust_allowed(illust, False, TagFilter(['other']))
+    assert not is_illust_allowed({'x_restrict': 1, 'tags': []}, False, None)
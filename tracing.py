@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*-coding:utf-8 -*-
+"""
+检查任务的耗时追踪和采样分析
+- 每次检查是一个 run, 其中的每个阶段 (API请求、下载、图片处理、发送、等待) 是一个 span,
+  最近几次 run 保存在环形缓冲区中, 用于找出慢在哪里
+- 当前的 run 和 span 深度保存在 contextvar 中, 检查中创建的后台任务会自动继承, 不在 run 中时 span 不做任何记录
+- SamplingProfiler 在后台线程中定时采样所有线程的调用栈, 结果为 collapsed stack 格式,
+  可以用 flamegraph.pl 或 speedscope 打开
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+
+class Span:
+    """一个阶段的耗时记录, start 为相对 run 开始的秒数"""
+    __slots__ = ('name', 'start', 'duration', 'depth', 'attrs')
+
+    def __init__(self, name: str, start: float, depth: int, attrs: Dict):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+        self.depth = depth
+        self.attrs = attrs
+
+    def describe(self) -> str:
+        attrs = ' '.join(f"{key}={value}" for key, value in self.attrs.items())
+        return f"{self.name} {attrs}".strip()
+
+
+class RunTrace:
+    """一次检查的全部 span, 超过 max_spans 后不再记录新的 span, 只计数"""
+
+    def __init__(self, name: str, max_spans: int):
+        self.name = name
+        self.started_at = time.time()
+        self.perf_start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    def totals(self) -> List[Tuple[str, int, float]]:
+        """按 span 名字汇总, 返回 [(名字, 次数, 总耗时)], 总耗时从大到小排列; 并发的 span 会重复计时"""
+        totals: Dict[str, List] = {}
+        for s in self.spans:
+            entry = totals.setdefault(s.name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += s.duration
+        return sorted(((name, count, total) for name, (count, total) in totals.items()),
+                      key=lambda item: item[2], reverse=True)
+
+
+_current_run: contextvars.ContextVar = contextvars.ContextVar('pixiv_trace_run', default=None)
+_current_depth: contextvars.ContextVar = contextvars.ContextVar('pixiv_trace_depth', default=0)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict]:
+    """
+    记录一个阶段的耗时, 返回的字典可以在阶段结束前补充属性 (例如下载的字节数)。
+    不在 run 中时只返回一个空字典
+    """
+    trace: Optional[RunTrace] = _current_run.get()
+    if trace is None or len(trace.spans) >= trace.max_spans:
+        if trace is not None:
+            trace.dropped += 1
+        yield attrs
+        return
+
+    depth = _current_depth.get()
+    record = Span(name, time.perf_counter() - trace.perf_start, depth, attrs)
+    trace.spans.append(record)
+    token = _current_depth.set(depth + 1)
+    try:
+        yield attrs
+    finally:
+        record.duration = time.perf_counter() - trace.perf_start - record.start
+        _current_depth.reset(token)
+
+
+async def traced_sleep(seconds: float) -> None:
+    """asyncio.sleep, 等待的时间作为一个 span 记录"""
+    with span('sleep', seconds=seconds):
+        await asyncio.sleep(seconds)
+
+
+class Tracer:
+    """
+    保存最近 history 次 run 的环形缓冲区
+    :param history: 保存的 run 数量, 0 表示关闭追踪
+    :param max_spans: 单次 run 最多记录的 span 数量, 避免订阅很多时占用过多内存
+    """
+
+    def __init__(self, history: int = 10, max_spans: int = 20000):
+        self.enabled = history > 0
+        self.runs: Deque[RunTrace] = deque(maxlen=max(history, 1))
+        self.max_spans = max_spans
+
+    @contextmanager
+    def run(self, name: str) -> Iterator[Optional[RunTrace]]:
+        """开始一次 run, 其中 (包括其中创建的任务) 的 span 都记录到这个 run"""
+        if not self.enabled:
+            yield None
+            return
+        trace = RunTrace(name, self.max_spans)
+        self.runs.append(trace)
+        token = _current_run.set(trace)
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - trace.perf_start
+            _current_run.reset(token)
+
+    def format_report(self, limit: int = 10) -> str:
+        """生成最近几次 run 的概况、最近一次 run 各阶段的汇总, 以及所有 run 中最慢的 span"""
+        if not self.enabled:
+            return "耗时追踪未开启"
+        if not self.runs:
+            return "还没有记录到检查"
+
+        lines = ["最近的检查:"]
+        for trace in self.runs:
+            duration = f"{trace.duration:.1f}s" if trace.duration is not None else "进行中"
+            dropped = f", 超出上限 {trace.dropped} 个" if trace.dropped else ""
+            lines.append(f"- {trace.name} {datetime.fromtimestamp(trace.started_at):%m-%d %H:%M:%S} "
+                         f"耗时 {duration}, 阶段 {len(trace.spans)} 个{dropped}")
+
+        latest = self.runs[-1]
+        lines.append("\n最近一次检查各阶段合计 (并发的阶段会重复计时):")
+        for name, count, total in latest.totals()[:limit]:
+            lines.append(f"- {name}: {count} 次, 共 {total:.2f}s")
+
+        slowest = sorted(((trace, s) for trace in self.runs for s in trace.spans),
+                         key=lambda item: item[1].duration, reverse=True)[:limit]
+        lines.append(f"\n最慢的 {len(slowest)} 个阶段:")
+        for trace, s in slowest:
+            lines.append(f"- {s.duration:.2f}s {s.describe()} ({trace.name} +{s.start:.1f}s)")
+        return '\n'.join(lines)
+
+
+class SamplingProfiler:
+    """
+    采样分析器: 后台线程每隔 interval 秒记录一次所有线程的调用栈, 按调用栈统计出现次数。
+    只读取其他线程的栈帧, 不修改解释器的全局状态, 对被分析的代码基本没有影响
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._sample_loop, name='pixiv-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample_loop(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def write(self, path: str) -> int:
+        """把采样结果以 collapsed stack 格式写入文件, 返回采样的调用栈种类数"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        return len(self.samples)